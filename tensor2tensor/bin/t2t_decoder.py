@@ -26,12 +26,23 @@ Example usage to decode from dataset:
 
 Set FLAGS.decode_interactive or FLAGS.decode_from_file for alternative decode
 sources.
+
+To decode a large file with several local worker processes, set
+FLAGS.decode_workers. The file is split into work units of inputs of similar
+length which the workers claim as they finish, and the decodes are merged into
+FLAGS.decode_to_file in the order of the inputs. Running the same command
+again after a failure only decodes the units that were not decoded yet.
 """
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
 import os
+import subprocess
+import sys
+import time
+
 from tensor2tensor.bin import t2t_trainer
 from tensor2tensor.data_generators import problem  # pylint: disable=unused-import
 from tensor2tensor.data_generators import text_encoder
@@ -61,6 +72,14 @@ flags.DEFINE_integer("decode_shards", 1, "Number of decoding replicas.")
 flags.DEFINE_string("score_file", "", "File to score. Each line in the file "
                     "must be in the format input \t target.")
 flags.DEFINE_bool("decode_in_memory", False, "Decode in memory.")
+flags.DEFINE_integer("decode_workers", 1,
+                     "Number of local worker processes decoding "
+                     "decode_from_file. Requires decode_to_file.")
+flags.DEFINE_integer("decode_unit_size", 1000,
+                     "Number of inputs per work unit with decode_workers.")
+flags.DEFINE_string("decode_unit_dir", None,
+                    "Set by decode_workers: directory of the work units to "
+                    "decode.")
 
 
 def create_hparams():
@@ -86,6 +105,8 @@ def decode(estimator, hparams, decode_hp):
       raise ValueError("TPU can only decode from dataset.")
     decoding.decode_interactively(estimator, hparams, decode_hp,
                                   checkpoint_path=FLAGS.checkpoint_path)
+  elif FLAGS.decode_unit_dir:
+    decode_units(estimator, hparams, decode_hp)
   elif FLAGS.decode_from_file:
     if estimator.config.use_tpu:
       raise ValueError("TPU can only decode from dataset.")
@@ -105,6 +126,66 @@ def decode(estimator, hparams, decode_hp):
         dataset_split="test" if FLAGS.eval_use_test_set else None)
 
 
+def decode_units(estimator, hparams, decode_hp):
+  """Decodes work units until none are left."""
+  unit = decoding.claim_decode_unit(FLAGS.decode_unit_dir)
+  while unit:
+    inputs_filename, decodes_filename = unit
+    # The decodes only appear once complete, see release_decode_units.
+    decoding.decode_from_file(estimator, inputs_filename, hparams, decode_hp,
+                              decodes_filename + ".tmp",
+                              checkpoint_path=FLAGS.checkpoint_path)
+    tf.gfile.Rename(decodes_filename + ".tmp", decodes_filename,
+                    overwrite=True)
+    unit = decoding.claim_decode_unit(FLAGS.decode_unit_dir)
+
+
+def run_decode_workers(decode_hp):
+  """Decodes decode_from_file with decode_workers local worker processes."""
+  if not FLAGS.decode_to_file:
+    raise ValueError("Decoding with workers requires --decode_to_file.")
+  unit_dir = os.path.expanduser(FLAGS.decode_to_file) + ".units"
+  num_units = decoding.split_decode_units(
+      FLAGS.decode_from_file, unit_dir, FLAGS.decode_unit_size,
+      decode_hp.delimiter)
+  tf.logging.info("Decoding %d work units with %d workers." %
+                  (num_units, FLAGS.decode_workers))
+
+  # Each worker gets its share of the CPU threads unless set explicitly.
+  threads = max(1, multiprocessing.cpu_count() // FLAGS.decode_workers)
+  worker_args = [sys.executable] + sys.argv + [
+      "--decode_workers=1",
+      "--decode_unit_dir=%s" % unit_dir,
+      "--intra_op_parallelism_threads=%d" % (
+          FLAGS.intra_op_parallelism_threads or threads),
+      "--inter_op_parallelism_threads=%d" % (
+          FLAGS.inter_op_parallelism_threads or threads),
+  ]
+  workers = [
+      subprocess.Popen(worker_args) for _ in range(FLAGS.decode_workers)]
+  try:
+    running = workers
+    while running:
+      time.sleep(1)
+      for worker in running:
+        if worker.poll():
+          raise ValueError("A decoding worker failed with exit code %d." %
+                           worker.returncode)
+      running = [worker for worker in running if worker.returncode is None]
+  finally:
+    # Stop the other workers if one failed, and let a new run decode the
+    # units they claimed.
+    for worker in workers:
+      if worker.poll() is None:
+        worker.terminate()
+    for worker in workers:
+      worker.wait()
+    decoding.release_decode_units(unit_dir)
+
+  decoding.merge_decode_units(unit_dir, FLAGS.decode_to_file,
+                              decode_hp.delimiter)
+
+
 def score_file(filename):
   """Score each line in a file and return the scores."""
   # Prepare model.
@@ -182,6 +263,10 @@ def main(_):
   hp = create_hparams()
   decode_hp = create_decode_hparams()
 
+  if FLAGS.decode_workers > 1 and FLAGS.decode_from_file:
+    run_decode_workers(decode_hp)
+    return
+
   estimator = trainer_lib.create_estimator(
       FLAGS.model,
       hp,
@@ -168,6 +168,8 @@ def create_experiment_fn(**kwargs):
       min_eval_frequency=FLAGS.local_eval_frequency,
       schedule=FLAGS.schedule,
       eval_throttle_seconds=FLAGS.eval_throttle_seconds,
+      eval_all_checkpoints=FLAGS.eval_all_checkpoints,
+      eval_num_workers=FLAGS.eval_num_workers,
       export=FLAGS.export_saved_model,
       decode_hparams=decoding.decode_hparams(FLAGS.decode_hparams),
       use_tfdbg=FLAGS.tfdbg,
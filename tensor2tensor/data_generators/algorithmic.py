@@ -60,7 +60,144 @@ class AlgorithmicProblem(problem.Problem):
   def num_shards(self):
     return 10
 
+  @property
+  def synthetic_data(self):
+    """Whether to generate cases in the input pipeline instead of on disk.
+
+    When True, `dataset` draws cases from `synthetic_cases` on the fly: the
+    training data is an endless stream and the dev data the same dev_size
+    cases on every evaluation, so no generate_data step is needed. The
+    problems registered with a "_synthetic" suffix set it.
+    """
+    return False
+
+  @property
+  def synthetic_seed(self):
+    """Seed of the random cases generated when synthetic_data is True."""
+    return 1
+
+  @property
+  def skip_random_fraction_when_training(self):
+    return not self.synthetic_data
+
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    """Draws cases with a NumPy RandomState for the synthetic input pipeline.
+
+    Problems override this with a vectorized version of `generator`; the
+    default falls back to `generator`, which uses the global NumPy random
+    state instead of rng.
+
+    Args:
+      rng: np.random.RandomState to draw the cases with.
+      max_length: integer, maximum length of sequences to generate.
+      nbr_cases: the number of cases to generate.
+
+    Returns:
+      A list of nbr_cases dictionaries {"inputs": input-list,
+      "targets": target-list}, as yielded by `generator`.
+    """
+    del rng
+    return list(self.generator(self.num_symbols, max_length, nbr_cases))
+
+  def synthetic_dataset(self, dataset_split, partition_id=0, num_partitions=1,
+                        block_size=1024):
+    """Dataset of cases generated on the fly, see `synthetic_data`.
+
+    Args:
+      dataset_split: DatasetSplit; TRAIN gives an endless stream of cases of
+        train_length, other splits dev_size cases of dev_length.
+      partition_id: integer, which partition of the data to generate.
+      num_partitions: how many partitions are read in parallel, each one
+        generates different cases.
+      block_size: number of cases drawn by each call to `synthetic_cases`.
+
+    Returns:
+      Dataset of dict<feature name, int64 Tensor> with the "inputs" and
+      "targets" of each case, shifted past the reserved ids and ending in EOS.
+    """
+    is_training = dataset_split == problem.DatasetSplit.TRAIN
+    max_length = self.train_length if is_training else self.dev_length
+    nbr_cases = None if is_training else self.dev_size // num_partitions
+    seed = [self.synthetic_seed, int(is_training), partition_id]
+    if is_training:
+      # Each new training stream (e.g. after every evaluation in
+      # continuous_train_and_eval) continues with new cases.
+      self._synthetic_train_streams = getattr(
+          self, "_synthetic_train_streams", 0) + 1
+      seed.append(self._synthetic_train_streams)
+
+    def cases():
+      rng = np.random.RandomState(seed)
+      remaining = nbr_cases
+      while remaining is None or remaining > 0:
+        block = block_size if remaining is None else min(block_size, remaining)
+        for case in self.synthetic_cases(rng, max_length, block):
+          yield {
+              feature: np.append(
+                  np.asarray(case[feature], dtype=np.int64) +
+                  text_encoder.NUM_RESERVED_TOKENS, text_encoder.EOS_ID)
+              for feature in ["inputs", "targets"]
+          }
+        if remaining is not None:
+          remaining -= block
+
+    return tf.data.Dataset.from_generator(
+        cases, {"inputs": tf.int64, "targets": tf.int64},
+        {"inputs": tf.TensorShape([None]), "targets": tf.TensorShape([None])})
+
+  def dataset(self,
+              mode,
+              data_dir=None,
+              num_threads=None,
+              output_buffer_size=None,
+              shuffle_files=None,
+              hparams=None,
+              preprocess=True,
+              dataset_split=None,
+              shard=None,
+              partition_id=0,
+              num_partitions=1,
+              max_records=-1):
+    if not self.synthetic_data:
+      return super(AlgorithmicProblem, self).dataset(
+          mode,
+          data_dir=data_dir,
+          num_threads=num_threads,
+          output_buffer_size=output_buffer_size,
+          shuffle_files=shuffle_files,
+          hparams=hparams,
+          preprocess=preprocess,
+          dataset_split=dataset_split,
+          shard=shard,
+          partition_id=partition_id,
+          num_partitions=num_partitions,
+          max_records=max_records)
+
+    del shuffle_files, shard  # Generated cases are already in random order.
+    dataset_split = dataset_split or mode
+    if hparams is None:
+      hparams = problem.default_model_hparams()
+    if not hasattr(hparams, "data_dir"):
+      hparams.add_hparam("data_dir", data_dir)
+    # Construct the Problem's hparams so that items within it are accessible
+    _ = self.get_hparams(hparams)
+
+    dataset = self.synthetic_dataset(dataset_split, partition_id,
+                                     num_partitions)
+    if preprocess:
+      dataset = self.preprocess(dataset, mode, hparams, interleave=False)
+    dataset = dataset.map(
+        self.maybe_reverse_and_copy, num_parallel_calls=num_threads)
+    dataset = dataset.take(max_records)
+    if output_buffer_size:
+      dataset = dataset.prefetch(output_buffer_size)
+    return dataset
+
   def generate_data(self, data_dir, _, task_id=-1):
+    if self.synthetic_data:
+      tf.logging.info("Skipping data generation, %s generates its data in the "
+                      "input pipeline.", self.name)
+      return
 
     def generator_eos(nbr_symbols, max_length, nbr_cases):
       """Shift by NUM_RESERVED_IDS and append EOS token."""
@@ -88,6 +225,29 @@ class AlgorithmicProblem(problem.Problem):
     p.target_space_id = problem.SpaceID.DIGIT_1
 
 
+def random_lengths(rng, max_length, nbr_cases):
+  """Draws nbr_cases lengths uniformly at random from [1, max_length]."""
+  return rng.randint(max_length, size=nbr_cases) + 1
+
+
+def random_sequences(rng, nbr_symbols, max_length, nbr_cases):
+  """Draws sequences like the generators, all at once.
+
+  Args:
+    rng: np.random.RandomState to draw the sequences with.
+    nbr_symbols: symbols are drawn uniformly at random from [0, nbr_symbols).
+    max_length: lengths are drawn uniformly at random from [1, max_length].
+    nbr_cases: the number of sequences to draw.
+
+  Returns:
+    A pair of an int64 array [nbr_cases, max_length] of symbols and an array
+    [nbr_cases] of lengths; row i holds sequence i in its first lengths[i]
+    columns.
+  """
+  symbols = rng.randint(nbr_symbols, size=(nbr_cases, max_length))
+  return symbols.astype(np.int64), random_lengths(rng, max_length, nbr_cases)
+
+
 @registry.register_problem
 class AlgorithmicIdentityBinary40(AlgorithmicProblem):
   """Problem spec for algorithmic binary identity task."""
@@ -117,6 +277,12 @@ class AlgorithmicIdentityBinary40(AlgorithmicProblem):
       inputs = [np.random.randint(nbr_symbols) for _ in range(l)]
       yield {"inputs": inputs, "targets": inputs}
 
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    symbols, lengths = random_sequences(rng, self.num_symbols, max_length,
+                                        nbr_cases)
+    return [{"inputs": row[:l], "targets": row[:l]}
+            for row, l in zip(symbols, lengths)]
+
 
 @registry.register_problem
 class AlgorithmicIdentityDecimal40(AlgorithmicIdentityBinary40):
@@ -157,6 +323,13 @@ class AlgorithmicShiftDecimal40(AlgorithmicProblem):
       inputs = [np.random.randint(nbr_symbols - shift) for _ in range(l)]
       yield {"inputs": inputs, "targets": [i + shift for i in inputs]}
 
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    shift = 10
+    symbols, lengths = random_sequences(rng, self.num_symbols - shift,
+                                        max_length, nbr_cases)
+    return [{"inputs": row[:l], "targets": row[:l] + shift}
+            for row, l in zip(symbols, lengths)]
+
   @property
   def dev_length(self):
     return 80
@@ -191,6 +364,12 @@ class AlgorithmicReverseBinary40(AlgorithmicProblem):
       inputs = [np.random.randint(nbr_symbols) for _ in range(l)]
       yield {"inputs": inputs, "targets": list(reversed(inputs))}
 
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    symbols, lengths = random_sequences(rng, self.num_symbols, max_length,
+                                        nbr_cases)
+    return [{"inputs": row[:l], "targets": row[l - 1::-1]}
+            for row, l in zip(symbols, lengths)]
+
 
 @registry.register_problem
 class AlgorithmicReverseDecimal40(AlgorithmicReverseBinary40):
@@ -324,6 +503,85 @@ def random_number_lower_endian(length, base):
   return prefix + [np.random.randint(base - 1) + 1]  # Last digit is not 0.
 
 
+def random_numbers_lower_endian(rng, lengths, base):
+  """Vectorized random_number_lower_endian for numbers of the given lengths.
+
+  Args:
+    rng: np.random.RandomState to draw the digits with.
+    lengths: array of number lengths, all at least 1.
+    base: in which base are the numbers.
+
+  Returns:
+    An int64 array [len(lengths), max(lengths)] of lower-endian digits, zero
+    past the length of each number.
+  """
+  width = np.max(lengths)
+  digits = rng.randint(base, size=(len(lengths), width)).astype(np.int64)
+  digits[np.arange(width)[np.newaxis, :] >= lengths[:, np.newaxis]] = 0
+  # Last digit can be 0 only if length is 1.
+  rows = np.nonzero(lengths > 1)[0]
+  digits[rows, lengths[rows] - 1] = rng.randint(1, base, size=len(rows))
+  return digits
+
+
+def propagate_carries(digits, base):
+  """Reduces a [batch, width] array of lower-endian digit sums to digits.
+
+  Args:
+    digits: int64 array of non-negative digit sums; the last column must be
+      wide enough to absorb every carry.
+    base: in which base are the numbers.
+
+  Returns:
+    A pair of the int64 array of lower-endian digits and an array of the
+    lengths of the numbers without leading zeros (at least 1).
+  """
+  digits = digits.copy()
+  for i in range(digits.shape[1] - 1):
+    digits[:, i + 1] += digits[:, i] // base
+    digits[:, i] %= base
+  nonzero = digits != 0
+  width = digits.shape[1]
+  lengths = np.where(nonzero.any(axis=1),
+                     width - np.argmax(nonzero[:, ::-1], axis=1), 1)
+  return digits, lengths
+
+
+def random_operands(rng, base, max_length, nbr_cases):
+  """Draws the 2 numbers of the addition and multiplication tasks.
+
+  The length of the first number is drawn uniformly at random in
+  [1, max_length/2] and the length of the second so that both fit in
+  max_length with the separator, as in the generators.
+
+  Args:
+    rng: np.random.RandomState to draw the numbers with.
+    base: in which base are the numbers.
+    max_length: integer, maximum length of the inputs.
+    nbr_cases: the number of pairs to draw.
+
+  Returns:
+    Lower-endian digit arrays and lengths (n1, l1, n2, l2) of the numbers.
+  """
+  l1 = random_lengths(rng, max_length // 2, nbr_cases)
+  l2 = np.floor(rng.random_sample(nbr_cases) *
+                (max_length - l1 - 1)).astype(np.int64) + 1
+  n1 = random_numbers_lower_endian(rng, l1, base)
+  n2 = random_numbers_lower_endian(rng, l2, base)
+  return n1, l1, n2, l2
+
+
+def arithmetic_cases(base, n1, l1, n2, l2, result, result_lengths):
+  """Builds addition and multiplication cases from their digit arrays."""
+  cases = []
+  for i in range(len(l1)):
+    cases.append({
+        "inputs": np.concatenate([n1[i, :l1[i]], [base], n2[i, :l2[i]]]),
+        "targets": result[i, :result_lengths[i]]
+    })
+  return cases
+
+
 @registry.register_problem
 class AlgorithmicAdditionBinary40(AlgorithmicProblem):
   """Problem spec for algorithmic binary addition task."""
@@ -364,6 +622,17 @@ class AlgorithmicAdditionBinary40(AlgorithmicProblem):
       targets = number_to_lower_endian(result, base)
       yield {"inputs": inputs, "targets": targets}
 
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    base = self.num_symbols
+    if max_length < 3:
+      raise ValueError("Maximum length must be at least 3.")
+    n1, l1, n2, l2 = random_operands(rng, base, max_length, nbr_cases)
+    sums = np.zeros((nbr_cases, max(n1.shape[1], n2.shape[1]) + 1), np.int64)
+    sums[:, :n1.shape[1]] += n1
+    sums[:, :n2.shape[1]] += n2
+    result, result_lengths = propagate_carries(sums, base)
+    return arithmetic_cases(base, n1, l1, n2, l2, result, result_lengths)
+
 
 @registry.register_problem
 class AlgorithmicAdditionDecimal40(AlgorithmicAdditionBinary40):
@@ -415,6 +684,18 @@ class AlgorithmicMultiplicationBinary40(AlgorithmicProblem):
       targets = number_to_lower_endian(result, base)
       yield {"inputs": inputs, "targets": targets}
 
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    base = self.num_symbols
+    if max_length < 3:
+      raise ValueError("Maximum length must be at least 3.")
+    n1, l1, n2, l2 = random_operands(rng, base, max_length, nbr_cases)
+    # Long multiplication: add n2 shifted by i times each digit i of n1.
+    products = np.zeros((nbr_cases, n1.shape[1] + n2.shape[1]), np.int64)
+    for i in range(n1.shape[1]):
+      products[:, i:i + n2.shape[1]] += n1[:, i:i + 1] * n2
+    result, result_lengths = propagate_carries(products, base)
+    return arithmetic_cases(base, n1, l1, n2, l2, result, result_lengths)
+
 
 @registry.register_problem
 class AlgorithmicMultiplicationDecimal40(AlgorithmicMultiplicationBinary40):
@@ -507,11 +788,120 @@ class AlgorithmicSortProblem(AlgorithmicProblem):
 
       yield {"inputs": inputs, "targets": targets}
 
+  def synthetic_cases(self, rng, max_length, nbr_cases):
+    nbr_symbols = self.num_symbols
+    if self.unique:
+      # Sample our inputs w/o replacement by ranking random keys.
+      symbols = np.argsort(rng.random_sample((nbr_cases, nbr_symbols)),
+                           axis=1)[:, :max_length]
+      lengths = np.minimum(random_lengths(rng, max_length, nbr_cases),
+                           nbr_symbols)
+    else:
+      symbols, lengths = random_sequences(rng, nbr_symbols, max_length,
+                                          nbr_cases)
+    # Padding sorts after every symbol, so the targets come first.
+    padded = np.where(
+        np.arange(symbols.shape[1])[np.newaxis, :] < lengths[:, np.newaxis],
+        symbols, nbr_symbols)
+    targets = np.sort(padded, axis=1)
+    return [{"inputs": row[:l], "targets": sorted_row[:l]}
+            for row, sorted_row, l in zip(symbols, targets, lengths)]
+
   def eval_metrics(self):
     defaults = super(AlgorithmicSortProblem, self).eval_metrics()
     return defaults + [metrics.Metrics.EDIT_DISTANCE]
 
 
+@registry.register_problem
+class AlgorithmicIdentityBinary40Synthetic(AlgorithmicIdentityBinary40):
+  """Identity of binary sequences, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicIdentityDecimal40Synthetic(AlgorithmicIdentityDecimal40):
+  """Identity of decimal sequences, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicShiftDecimal40Synthetic(AlgorithmicShiftDecimal40):
+  """Shift of decimal sequences, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicReverseBinary40Synthetic(AlgorithmicReverseBinary40):
+  """Reversal of binary sequences, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicReverseDecimal40Synthetic(AlgorithmicReverseDecimal40):
+  """Reversal of decimal sequences, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicAdditionBinary40Synthetic(AlgorithmicAdditionBinary40):
+  """Addition of binary numbers, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicAdditionDecimal40Synthetic(AlgorithmicAdditionDecimal40):
+  """Addition of decimal numbers, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicMultiplicationBinary40Synthetic(AlgorithmicMultiplicationBinary40):
+  """Multiplication of binary numbers, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicMultiplicationDecimal40Synthetic(AlgorithmicMultiplicationDecimal40):
+  """Multiplication of decimal numbers, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
+@registry.register_problem
+class AlgorithmicSortSynthetic(AlgorithmicSortProblem):
+  """Sorting of sequences, generated in the input pipeline."""
+
+  @property
+  def synthetic_data(self):
+    return True
+
+
 @registry.register_problem
 class TinyAlgo(AlgorithmicIdentityBinary40):
   """A small algorthmic problem for testing."""
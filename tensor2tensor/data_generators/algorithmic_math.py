@@ -22,7 +22,14 @@ from __future__ import division
 from __future__ import print_function
 
 from collections import namedtuple
+import functools
+import io
+import json
+import multiprocessing
+import os
 import random
+import signal
+import threading
 import six
 from six.moves import range  # pylint: disable=redefined-builtin
 import sympy
@@ -297,12 +304,19 @@ def generate_algebra_simplify_sample(vlist, ops, min_depth, max_depth):
     sample: String representation of the input.
     target: String representation of the solution.
   """
+  sample = random_algebra_simplify_expr(vlist, ops, min_depth, max_depth)
+  return sample, algebra_simplify_target(sample)
+
+
+def random_algebra_simplify_expr(vlist, ops, min_depth, max_depth):
+  """Randomly generate the input of an algebra simplify dataset sample."""
   depth = random.randrange(min_depth, max_depth + 1)
-  expr = random_expr(depth, vlist, ops)
+  return str(random_expr(depth, vlist, ops))
 
-  sample = str(expr)
-  target = format_sympy_expr(sympy.simplify(sample))
-  return sample, target
+
+def algebra_simplify_target(sample):
+  """Simplifies the input of an algebra simplify dataset sample with sympy."""
+  return format_sympy_expr(sympy.simplify(sample))
 
 
 def generate_calculus_integrate_sample(vlist, ops, min_depth, max_depth,
@@ -329,18 +343,149 @@ def generate_calculus_integrate_sample(vlist, ops, min_depth, max_depth,
         'var:expression'.
     target: String representation of the solution.
   """
+  sample = random_calculus_integrate_expr(vlist, ops, min_depth, max_depth)
+  return sample, calculus_integrate_target(sample, functions)
+
+
+def random_calculus_integrate_expr(vlist, ops, min_depth, max_depth):
+  """Randomly generate the 'var:expression' input of an integral sample."""
   var_index = random.randrange(len(vlist))
   var = vlist[var_index]
   consts = vlist[:var_index] + vlist[var_index + 1:]
 
   depth = random.randrange(min_depth, max_depth + 1)
   expr = random_expr_with_required_var(depth, var, consts, ops)
+  return var + ":" + str(expr)
+
 
-  expr_str = str(expr)
-  sample = var + ":" + expr_str
-  target = format_sympy_expr(
+def calculus_integrate_target(sample, functions):
+  """Integrates the 'var:expression' input of an integral sample with sympy."""
+  var, expr_str = sample.split(":", 1)
+  return format_sympy_expr(
       sympy.integrate(expr_str, sympy.Symbol(var)), functions=functions)
-  return sample, target
+
+
+class SampleTimeoutError(Exception):
+  """Raised when computing the target of a sample takes too long."""
+
+
+def _raise_sample_timeout(signum, frame):
+  del signum, frame
+  raise SampleTimeoutError()
+
+
+def _in_main_thread():
+  return threading.current_thread().name == "MainThread"
+
+
+def _compute_target(target_fn, timeout, sample):
+  """Returns target_fn(sample), or None if it fails or exceeds timeout."""
+  # SIGALRM interrupts pure Python code like sympy anywhere, which makes the
+  # timeout hard. Signal handlers can only be set from the main thread, which
+  # in a process forked from another thread does not carry its name.
+  use_alarm = False
+  if timeout:
+    try:
+      previous_handler = signal.signal(signal.SIGALRM, _raise_sample_timeout)
+      use_alarm = True
+    except ValueError:
+      pass  # generate_sympy_samples then computes targets in a pool.
+  if use_alarm:
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+  try:
+    return target_fn(sample)
+  except Exception:  # pylint: disable=broad-except
+    return None
+  finally:
+    if use_alarm:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+      # None when the previous handler was not installed from Python.
+      signal.signal(signal.SIGALRM, previous_handler or signal.SIG_DFL)
+
+
+def _compute_target_star(args):
+  return _compute_target(*args)
+
+
+def _read_target_cache(cache_file):
+  """Reads the sample to target dict written by `_append_target_cache`."""
+  cache = {}
+  if cache_file and os.path.exists(cache_file):
+    with io.open(cache_file, encoding="utf-8") as f:
+      for line in f:
+        sample, target = json.loads(line)
+        cache[sample] = target
+  return cache
+
+
+def _append_target_cache(cache_file, samples, targets):
+  """Appends samples and their targets (None for dropped ones) to cache_file."""
+  with io.open(cache_file, "a", encoding="utf-8") as f:
+    for sample, target in zip(samples, targets):
+      f.write(six.text_type(json.dumps([sample, target])) + u"\n")
+
+
+def generate_sympy_samples(sample_fn, target_fn, nbr_cases, num_processes=1,
+                           timeout=None, cache_file=None, chunk_size=1000):
+  """Generates samples whose targets are computed with sympy.
+
+  Inputs are drawn with sample_fn in this process, so they only depend on the
+  state of `random`, and their targets are computed in a pool of
+  num_processes worker processes. Samples whose target can not be computed
+  within timeout seconds, or at all, are dropped and replaced by new ones.
+
+  Args:
+    sample_fn: Function without arguments returning the input string of a
+        random sample.
+    target_fn: Picklable function mapping an input string to its target string.
+    nbr_cases: The number of samples to generate, or None for no limit.
+    num_processes: Number of worker processes; with 1 targets are computed in
+        this process, unless a timeout is set and this is not the main thread,
+        where the timeout could not be enforced.
+    timeout: Seconds after which the computation of a target is abandoned, or
+        None to wait for every target.
+    cache_file: Optional path of a file caching the target of every input seen,
+        including dropped ones, so that regenerating a dataset only computes
+        the targets of new inputs. Use one cache file per dataset.
+    chunk_size: Number of inputs drawn at a time.
+
+  Yields:
+    (sample, target) pairs of strings.
+  """
+  cache = _read_target_cache(cache_file)
+  pool = None
+  if num_processes > 1 or timeout and not _in_main_thread():
+    pool = multiprocessing.Pool(num_processes)
+  nbr_case = 0
+  try:
+    while nbr_cases is None or nbr_case < nbr_cases:
+      if nbr_cases is not None:
+        chunk_size = min(chunk_size, nbr_cases - nbr_case)
+      samples = [sample_fn() for _ in range(chunk_size)]
+      chunk_cache = cache if cache_file else {}
+      new_samples = []
+      seen = set()
+      for sample in samples:
+        if sample not in chunk_cache and sample not in seen:
+          seen.add(sample)
+          new_samples.append(sample)
+      args = [(target_fn, timeout, sample) for sample in new_samples]
+      if pool:
+        new_targets = pool.map(_compute_target_star, args)
+      else:
+        new_targets = [_compute_target_star(arg) for arg in args]
+      chunk_cache.update(zip(new_samples, new_targets))
+      if cache_file and new_samples:
+        _append_target_cache(cache_file, new_samples, new_targets)
+      for sample in samples:
+        target = chunk_cache[sample]
+        if target is None or nbr_cases is not None and nbr_case >= nbr_cases:
+          continue
+        yield sample, target
+        nbr_case += 1
+  finally:
+    if pool:
+      pool.terminate()
 
 
 # AlgebraConfig holds objects required to generate the algebra inverse
@@ -490,7 +635,10 @@ def algebra_inverse(alphabet_size=26, min_depth=0, max_depth=2,
 def algebra_simplify(alphabet_size=26,
                      min_depth=0,
                      max_depth=2,
-                     nbr_cases=10000):
+                     nbr_cases=10000,
+                     num_processes=1,
+                     timeout=None,
+                     cache_file=None):
   """Generate the algebra simplify dataset.
 
   Each sample is a symbolic math expression involving unknown variables. The
@@ -503,6 +651,11 @@ def algebra_simplify(alphabet_size=26,
     max_depth: Maximum depth of the expression trees on both sides of the
         equals sign in the equation.
     nbr_cases: The number of cases to generate.
+    num_processes: Number of processes simplifying expressions with sympy.
+    timeout: Seconds after which the simplification of an expression is
+        abandoned and the expression dropped, or None to never drop it.
+    cache_file: Optional file caching the simplified expressions across runs,
+        see `generate_sympy_samples`.
 
   Yields:
     A dictionary {"inputs": input-list, "targets": target-list} where
@@ -518,9 +671,12 @@ def algebra_simplify(alphabet_size=26,
                      "Got max_depth=%s, min_depth=%s" % (max_depth, min_depth))
 
   alg_cfg = math_dataset_init(alphabet_size, digits=5)
-  for _ in range(nbr_cases):
-    sample, target = generate_algebra_simplify_sample(
-        alg_cfg.vlist, list(alg_cfg.ops.values()), min_depth, max_depth)
+  sample_fn = functools.partial(random_algebra_simplify_expr, alg_cfg.vlist,
+                                list(alg_cfg.ops.values()), min_depth,
+                                max_depth)
+  for sample, target in generate_sympy_samples(
+      sample_fn, algebra_simplify_target, nbr_cases, num_processes, timeout,
+      cache_file):
     yield {
         "inputs": alg_cfg.int_encoder(sample),
         "targets": alg_cfg.int_encoder(target)
@@ -530,7 +686,10 @@ def algebra_simplify(alphabet_size=26,
 def calculus_integrate(alphabet_size=26,
                        min_depth=0,
                        max_depth=2,
-                       nbr_cases=10000):
+                       nbr_cases=10000,
+                       num_processes=1,
+                       timeout=None,
+                       cache_file=None):
   """Generate the calculus integrate dataset.
 
   Each sample is a symbolic math expression involving unknown variables. The
@@ -544,6 +703,11 @@ def calculus_integrate(alphabet_size=26,
     max_depth: Maximum depth of the expression trees on both sides of the
         equals sign in the equation.
     nbr_cases: The number of cases to generate.
+    num_processes: Number of processes integrating expressions with sympy.
+    timeout: Seconds after which the integration of an expression is abandoned
+        and the expression dropped, or None to never drop it.
+    cache_file: Optional file caching the integrals across runs, see
+        `generate_sympy_samples`.
 
   Yields:
     A dictionary {"inputs": input-list, "targets": target-list} where
@@ -566,18 +730,27 @@ def calculus_integrate(alphabet_size=26,
 
   functions = {"log": "L"}
   alg_cfg = math_dataset_init(alphabet_size, digits=5, functions=functions)
+  sample_fn = functools.partial(random_calculus_integrate_expr, alg_cfg.vlist,
+                                list(alg_cfg.ops.values()), min_depth,
+                                max_depth)
+  target_fn = functools.partial(calculus_integrate_target,
+                                functions=alg_cfg.functions)
+  samples = generate_sympy_samples(sample_fn, target_fn, None, num_processes,
+                                   timeout, cache_file)
   nbr_case = 0
-  while nbr_case < nbr_cases:
-    try:
-      sample, target = generate_calculus_integrate_sample(
-          alg_cfg.vlist,
-          list(alg_cfg.ops.values()), min_depth, max_depth, alg_cfg.functions)
-      yield {
-          "inputs": alg_cfg.int_encoder(sample),
-          "targets": alg_cfg.int_encoder(target)
-      }
-    except:  # pylint:disable=bare-except
-      continue
-    if nbr_case % 10000 == 0:
-      print(" calculus_integrate: generating case %d." % nbr_case)
-    nbr_case += 1
+  try:
+    while nbr_case < nbr_cases:
+      sample, target = next(samples)
+      try:
+        case = {
+            "inputs": alg_cfg.int_encoder(sample),
+            "targets": alg_cfg.int_encoder(target)
+        }
+      except KeyError:  # The integral has tokens outside of the vocabulary.
+        continue
+      if nbr_case % 10000 == 0:
+        print(" calculus_integrate: generating case %d." % nbr_case)
+      yield case
+      nbr_case += 1
+  finally:
+    samples.close()
@@ -18,6 +18,12 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import functools
+import itertools
+import os
+import signal
+import threading
+import time
 import six
 import sympy
 from tensor2tensor.data_generators import algorithmic_math
@@ -25,6 +31,16 @@ from tensor2tensor.data_generators import algorithmic_math
 import tensorflow as tf
 
 
+def slow_upper(sample):
+  if sample == "slow":
+    time.sleep(60)
+  return sample.upper()
+
+
+def failing_target(sample):
+  raise ValueError("Target of %s is not cached." % sample)
+
+
 class AlgorithmicMathTest(tf.test.TestCase):
 
   def testAlgebraInverse(self):
@@ -77,6 +93,41 @@ class AlgorithmicMathTest(tf.test.TestCase):
       self.assertEqual(0, sympy.simplify("%s-(%s)" % (expression, derivative)))
     self.assertEqual(counter, 10)
 
+  def testGenerateSympySamples(self):
+    cache_file = os.path.join(self.get_temp_dir(), "sympy_cache")
+    inputs = ["a", "slow", "b", "a"]
+    samples = list(algorithmic_math.generate_sympy_samples(
+        functools.partial(next, itertools.cycle(inputs)), slow_upper, 5,
+        num_processes=2, timeout=0.5, cache_file=cache_file, chunk_size=4))
+    self.assertEqual(samples, [("a", "A"), ("b", "B"), ("a", "A"),
+                               ("a", "A"), ("b", "B")])
+
+    # All targets, including the dropped one, come from the cache now.
+    cached_samples = list(algorithmic_math.generate_sympy_samples(
+        functools.partial(next, itertools.cycle(inputs)), failing_target, 5,
+        cache_file=cache_file))
+    self.assertEqual(cached_samples, samples)
+
+  def testComputeTargetRestoresAlarmHandler(self):
+    handler = lambda signum, frame: None
+    previous_handler = signal.signal(signal.SIGALRM, handler)
+    try:
+      self.assertIsNone(
+          algorithmic_math._compute_target(slow_upper, 0.5, "slow"))
+      self.assertIs(handler, signal.getsignal(signal.SIGALRM))
+    finally:
+      signal.signal(signal.SIGALRM, previous_handler)
+
+  def testComputeTargetOutsideMainThread(self):
+    # No alarm can be set outside the main thread, the target is computed
+    # without timeout.
+    targets = []
+    thread = threading.Thread(target=lambda: targets.append(
+        algorithmic_math._compute_target(slow_upper, 0.5, "a")))
+    thread.start()
+    thread.join()
+    self.assertEqual(targets, ["A"])
+
 
 if __name__ == "__main__":
   tf.test.main()
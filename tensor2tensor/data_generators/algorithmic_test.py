@@ -17,9 +17,12 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import numpy as np
 from six.moves import range  # pylint: disable=redefined-builtin
 
 from tensor2tensor.data_generators import algorithmic
+from tensor2tensor.data_generators import problem
+from tensor2tensor.data_generators import text_encoder
 
 import tensorflow as tf
 
@@ -105,6 +108,83 @@ class AlgorithmicTest(tf.test.TestCase):
       self.assertEqual(list(sorted(d["inputs"])), d["targets"])
     self.assertEqual(counter, 10)
 
+  def testSyntheticCases(self):
+    rng = np.random.RandomState(0)
+
+    def number(digits, base):
+      return algorithmic.lower_endian_to_number([int(d) for d in digits], base)
+
+    def split(inputs, base):
+      separator = list(inputs).index(base)
+      return number(inputs[:separator], base), number(
+          inputs[separator + 1:], base)
+
+    def product(inputs, base):
+      n1, n2 = split(inputs, base)
+      return n1 * n2
+
+    checks = [
+        (algorithmic.AlgorithmicIdentityDecimal40(),
+         lambda i, t: self.assertAllEqual(i, t)),
+        (algorithmic.AlgorithmicShiftDecimal40(),
+         lambda i, t: self.assertAllEqual(np.asarray(i) + 10, t)),
+        (algorithmic.AlgorithmicReverseBinary40(),
+         lambda i, t: self.assertAllEqual(i[::-1], t)),
+        (algorithmic.AlgorithmicSortProblem(),
+         lambda i, t: self.assertAllEqual(sorted(i), t)),
+        (algorithmic.AlgorithmicAdditionDecimal40(),
+         lambda i, t: self.assertEqual(sum(split(i, 10)), number(t, 10))),
+        (algorithmic.AlgorithmicMultiplicationBinary40(),
+         lambda i, t: self.assertEqual(product(i, 2), number(t, 2))),
+        (algorithmic.AlgorithmicMultiplicationDecimal40(),
+         lambda i, t: self.assertEqual(product(i, 10), number(t, 10))),
+    ]
+    for algo_problem, check in checks:
+      cases = algo_problem.synthetic_cases(rng, 12, 50)
+      self.assertEqual(len(cases), 50)
+      for case in cases:
+        self.assertTrue(1 <= len(case["inputs"]) <= 12)
+        self.assertTrue(np.all(np.asarray(case["inputs"]) <
+                               algo_problem.num_symbols + 1))
+        # Only the most significant digit of a number or result can not be 0.
+        if "Addition" in algo_problem.name or "Multiplication" in (
+            algo_problem.name):
+          self.assertTrue(len(case["targets"]) == 1 or case["targets"][-1])
+        check(case["inputs"], case["targets"])
+
+  def testSyntheticDataset(self):
+
+    class SyntheticReverse(algorithmic.AlgorithmicReverseDecimal40):
+
+      @property
+      def synthetic_data(self):
+        return True
+
+      @property
+      def dev_size(self):
+        return 5
+
+    reverse_problem = SyntheticReverse()
+    train = reverse_problem.dataset(
+        tf.estimator.ModeKeys.TRAIN).take(100).make_one_shot_iterator()
+    dev = reverse_problem.dataset(
+        tf.estimator.ModeKeys.EVAL, dataset_split=problem.DatasetSplit.EVAL)
+    dev_next = dev.make_one_shot_iterator().get_next()
+    with self.test_session() as sess:
+      train_next = train.get_next()
+      for _ in range(100):
+        example = sess.run(train_next)
+        inputs, targets = example["inputs"], example["targets"]
+        self.assertEqual(inputs[-1], text_encoder.EOS_ID)
+        self.assertAllEqual(inputs[-2::-1], targets[:-1])
+        self.assertTrue(np.all(inputs[:-1] >= text_encoder.NUM_RESERVED_TOKENS))
+      dev_cases = []
+      for _ in range(5):
+        dev_cases.append(sess.run(dev_next)["inputs"])
+      with self.assertRaises(tf.errors.OutOfRangeError):
+        sess.run(dev_next)
+    self.assertLessEqual(max(len(inputs) for inputs in dev_cases), 401)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -56,7 +56,8 @@ def _get_cifar(directory, url):
   tarfile.open(path, "r:gz").extractall(directory)
 
 
-def cifar_generator(cifar_version, tmp_dir, training, how_many, start_from=0):
+def cifar_generator(cifar_version, tmp_dir, training, how_many, start_from=0,
+                    image_format="png"):
   """Image generator for CIFAR-10 and 100.
 
   Args:
@@ -65,6 +66,7 @@ def cifar_generator(cifar_version, tmp_dir, training, how_many, start_from=0):
     training: a Boolean; if true, we use the train set, otherwise the test set.
     how_many: how many images and labels to generate.
     start_from: from which image to start.
+    image_format: format in which to store the images, "png" or "raw".
 
   Returns:
     An instance of image_generator that produces CIFAR-10 images and labels.
@@ -107,7 +109,8 @@ def cifar_generator(cifar_version, tmp_dir, training, how_many, start_from=0):
     all_labels.extend([labels[j] for j in range(num_images)])
   return image_utils.image_generator(
       all_images[start_from:start_from + how_many],
-      all_labels[start_from:start_from + how_many])
+      all_labels[start_from:start_from + how_many],
+      image_format)
 
 
 @registry.register_problem
@@ -137,9 +140,11 @@ class ImageCifar10Tune(mnist.ImageMnistTune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar_generator("cifar10", tmp_dir, True, 48000)
+      return cifar_generator("cifar10", tmp_dir, True, 48000,
+                             image_format=self.image_format)
     else:
-      return cifar_generator("cifar10", tmp_dir, True, 2000, 48000)
+      return cifar_generator("cifar10", tmp_dir, True, 2000, 48000,
+                             image_format=self.image_format)
 
 
 @registry.register_problem
@@ -147,9 +152,20 @@ class ImageCifar10(ImageCifar10Tune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar_generator("cifar10", tmp_dir, True, 50000)
+      return cifar_generator("cifar10", tmp_dir, True, 50000,
+                             image_format=self.image_format)
     else:
-      return cifar_generator("cifar10", tmp_dir, False, 10000)
+      return cifar_generator("cifar10", tmp_dir, False, 10000,
+                             image_format=self.image_format)
+
+
+@registry.register_problem
+class ImageCifar10Raw(ImageCifar10):
+  """CIFAR-10, images stored as raw uint8 pixels rather than PNG."""
+
+  @property
+  def raw_image_shape(self):
+    return [_CIFAR10_IMAGE_SIZE, _CIFAR10_IMAGE_SIZE, 3]
 
 
 @registry.register_problem
@@ -358,9 +374,11 @@ class ImageCifar100Tune(mnist.ImageMnistTune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar_generator("cifar100", tmp_dir, True, 48000)
+      return cifar_generator("cifar100", tmp_dir, True, 48000,
+                             image_format=self.image_format)
     else:
-      return cifar_generator("cifar100", tmp_dir, True, 2000, 48000)
+      return cifar_generator("cifar100", tmp_dir, True, 2000, 48000,
+                             image_format=self.image_format)
 
 
 @registry.register_problem
@@ -368,9 +386,20 @@ class ImageCifar100(ImageCifar100Tune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar_generator("cifar100", tmp_dir, True, 50000)
+      return cifar_generator("cifar100", tmp_dir, True, 50000,
+                             image_format=self.image_format)
     else:
-      return cifar_generator("cifar100", tmp_dir, False, 10000)
+      return cifar_generator("cifar100", tmp_dir, False, 10000,
+                             image_format=self.image_format)
+
+
+@registry.register_problem
+class ImageCifar100Raw(ImageCifar100):
+  """CIFAR-100, images stored as raw uint8 pixels rather than PNG."""
+
+  @property
+  def raw_image_shape(self):
+    return [_CIFAR100_IMAGE_SIZE, _CIFAR100_IMAGE_SIZE, 3]
 
 
 @registry.register_problem
@@ -487,9 +516,11 @@ class ImageCifar20Tune(mnist.ImageMnistTune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar_generator("cifar20", tmp_dir, True, 48000)
+      return cifar_generator("cifar20", tmp_dir, True, 48000,
+                             image_format=self.image_format)
     else:
-      return cifar_generator("cifar20", tmp_dir, True, 2000, 48000)
+      return cifar_generator("cifar20", tmp_dir, True, 2000, 48000,
+                             image_format=self.image_format)
 
 
 @registry.register_problem
@@ -497,9 +528,11 @@ class ImageCifar20(ImageCifar20Tune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar_generator("cifar20", tmp_dir, True, 50000)
+      return cifar_generator("cifar20", tmp_dir, True, 50000,
+                             image_format=self.image_format)
     else:
-      return cifar_generator("cifar20", tmp_dir, False, 10000)
+      return cifar_generator("cifar20", tmp_dir, False, 10000,
+                             image_format=self.image_format)
 
 
 @registry.register_problem
@@ -18,7 +18,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
 import os
+import struct
+import zlib
+
+import numpy as np
 from tensor2tensor.data_generators import generator_utils
 from tensor2tensor.data_generators import problem
 from tensor2tensor.data_generators import text_encoder
@@ -100,7 +105,25 @@ class ImageProblem(problem.Problem):
     """Number of color channels."""
     return 3
 
+  @property
+  def raw_image_shape(self):
+    """[height, width, channels] of images stored as raw uint8 bytes.
+
+    When set, generated records hold the pixels in "image/raw" instead of a
+    PNG in "image/encoded" and are read back with a reshape rather than an
+    image decoder. None (the default) stores images as PNG.
+    """
+    return None
+
+  @property
+  def image_format(self):
+    """Format in which the generators store images, "raw" or "png"."""
+    return "raw" if self.raw_image_shape else "png"
+
   def example_reading_spec(self):
+    if self.raw_image_shape:
+      return self._raw_image_reading_spec()
+
     data_fields = {
         "image/encoded": tf.FixedLenFeature((), tf.string),
         "image/format": tf.FixedLenFeature((), tf.string),
@@ -116,6 +139,24 @@ class ImageProblem(problem.Problem):
 
     return data_fields, data_items_to_decoders
 
+  def _raw_image_reading_spec(self):
+    """Reading spec for records with images of raw_image_shape in image/raw."""
+    data_fields = {
+        "image/raw": tf.FixedLenFeature((), tf.string),
+    }
+
+    def decode_image(keys_to_tensors):
+      image = tf.decode_raw(keys_to_tensors["image/raw"], tf.uint8)
+      return tf.reshape(image, self.raw_image_shape)
+
+    data_items_to_decoders = {
+        "inputs":
+            tf.contrib.slim.tfexample_decoder.ItemHandlerCallback(
+                ["image/raw"], decode_image),
+    }
+
+    return data_fields, data_items_to_decoders
+
   def preprocess_example(self, example, mode, hparams):
     if not self._was_reversed:
       example["inputs"] = tf.image.per_image_standardization(example["inputs"])
@@ -193,54 +234,242 @@ class Image2ClassProblem(ImageProblem):
         self.dev_filepaths(data_dir, self.dev_shards, shuffled=False))
 
 
-def encode_images_as_png(images):
-  """Yield images encoded as pngs."""
-  if tf.contrib.eager.in_eager_mode():
+# PNG color types by number of channels: gray, gray+alpha, RGB and RGBA.
+_PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+def _png_chunk(chunk_type, data):
+  """Returns a PNG chunk with its length and CRC."""
+  crc = zlib.crc32(chunk_type + data) & 0xffffffff
+  return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(
+      ">I", crc)
+
+
+def _png_filter_rows(rows, bytes_per_pixel):
+  """Applies to each row the PNG filter that should compress it best.
+
+  As libpng does, every row is filtered with each of the None, Sub, Up,
+  Average and Paeth filters, and the one with the smallest sum of absolute
+  values of the filtered bytes, taken as signed, is kept.
+
+  Args:
+    rows: uint8 numpy array of shape [height, width * channels].
+    bytes_per_pixel: the number of channels.
+
+  Returns:
+    uint8 numpy array of shape [height, width * channels + 1], each row
+    starting with its filter type.
+  """
+  x = rows.astype(np.int16)
+  # The bytes of the pixel on the left, above, and above on the left.
+  a = np.zeros_like(x)
+  a[:, bytes_per_pixel:] = x[:, :-bytes_per_pixel]
+  b = np.zeros_like(x)
+  b[1:] = x[:-1]
+  c = np.zeros_like(x)
+  c[1:, bytes_per_pixel:] = x[:-1, :-bytes_per_pixel]
+  p = a + b - c
+  pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+  paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+  predictions = np.stack([np.zeros_like(x), a, b, (a + b) // 2, paeth])
+  filtered = ((x - predictions) % 256).astype(np.uint8)
+  costs = np.abs(filtered.view(np.int8).astype(np.int32)).sum(axis=2)
+  filter_types = np.argmin(costs, axis=0)
+  height = rows.shape[0]
+  filtered_rows = np.empty((height, rows.shape[1] + 1), dtype=np.uint8)
+  filtered_rows[:, 0] = filter_types
+  filtered_rows[:, 1:] = filtered[filter_types, np.arange(height)]
+  return filtered_rows
+
+
+def encode_png(image, compression_level=6):
+  """Encodes an image as PNG with NumPy and zlib, without TensorFlow.
+
+  Rows are filtered as by libpng, which `tf.image.encode_png` uses, so the
+  output is about as small.
+
+  Args:
+    image: uint8 numpy array of shape [height, width, channels] with 1 to 4
+      channels.
+    compression_level: zlib compression level, from 0 to 9.
+
+  Returns:
+    The PNG encoded image as a string.
+
+  Raises:
+    ValueError: if the image does not have 1 to 4 channels.
+  """
+  image = np.asarray(image, dtype=np.uint8)
+  if image.ndim == 2:
+    image = image[:, :, np.newaxis]
+  height, width, channels = image.shape
+  if channels not in _PNG_COLOR_TYPES:
+    raise ValueError("Can not encode an image with %d channels as PNG."
+                     % channels)
+  rows = _png_filter_rows(image.reshape((height, width * channels)), channels)
+  # The strategy libpng uses for filtered rows.
+  compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 15, 8,
+                                zlib.Z_FILTERED)
+  data = compressor.compress(rows.tobytes()) + compressor.flush()
+  header = struct.pack(">IIBBBBB", width, height, 8,
+                       _PNG_COLOR_TYPES[channels], 0, 0, 0)
+  return b"".join([
+      b"\x89PNG\r\n\x1a\n",
+      _png_chunk(b"IHDR", header),
+      _png_chunk(b"IDAT", data),
+      _png_chunk(b"IEND", b"")])
+
+
+def _image_chunks(images, chunk_size):
+  """Yields lists of chunk_size images from an iterable of images."""
+  chunk = []
+  for image in images:
+    chunk.append(np.asarray(image))
+    if len(chunk) == chunk_size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def encode_images_as_png(images, num_processes=1, chunk_size=256):
+  """Yield images encoded as pngs, in order.
+
+  Images are encoded with `encode_png`, in this process or by a pool of worker
+  processes, one chunk of images at a time. The next chunk is read from
+  `images` while the previous one is being encoded, so `images` can be a lazy
+  generator. Where available the workers are spawned rather than forked, as
+  forking is not safe once TensorFlow runs threads in this process.
+
+  Args:
+    images: iterable of uint8 numpy arrays of shape [height, width, channels].
+    num_processes: number of worker processes. With 1 the images are encoded
+      in this process.
+    chunk_size: number of images sent to the pool at a time.
+
+  Yields:
+    The PNG encoded images, in the order of `images`.
+  """
+  if num_processes <= 1:
     for image in images:
-      yield tf.image.encode_png(image).numpy()
+      yield encode_png(image)
+    return
+  if hasattr(multiprocessing, "get_context"):
+    pool = multiprocessing.get_context("spawn").Pool(num_processes)
   else:
-    (height, width, channels) = images[0].shape
-    with tf.Graph().as_default():
-      image_t = tf.placeholder(dtype=tf.uint8, shape=(height, width, channels))
-      encoded_image_t = tf.image.encode_png(image_t)
-      with tf.Session() as sess:
-        for image in images:
-          enc_string = sess.run(encoded_image_t, feed_dict={image_t: image})
+    pool = multiprocessing.Pool(num_processes)
+  try:
+    pending = None
+    for chunk in _image_chunks(images, chunk_size):
+      encoding = pool.map_async(encode_png, chunk)
+      if pending is not None:
+        for enc_string in pending.get():
           yield enc_string
+      pending = encoding
+    if pending is not None:
+      for enc_string in pending.get():
+        yield enc_string
+  finally:
+    pool.terminate()
 
 
-def image_generator(images, labels):
+def image_generator(images, labels, image_format="png", num_processes=1):
   """Generator for images that takes image and labels lists and creates pngs.
 
   Args:
     images: list of images given as [width x height x channels] numpy arrays.
     labels: list of ints, same length as images.
+    image_format: "png" to store the images PNG encoded, or "raw" to store
+      their uint8 pixels as is, see `ImageProblem.raw_image_shape`.
+    num_processes: number of processes encoding the PNG images, see
+      `encode_images_as_png`.
 
   Yields:
     A dictionary representing the images with the following fields:
-    * image/encoded: the string encoding the image as PNG,
-    * image/format: the string "png" representing image format,
+    * image/encoded: the string encoding the image as PNG, or image/raw: the
+      bytes of the uint8 image if image_format is "raw",
+    * image/format: the string representing image format,
     * image/class/label: an integer representing the label,
     * image/height: an integer representing the height,
     * image/width: an integer representing the width.
     Every field is actually a singleton list of the corresponding type.
 
   Raises:
-    ValueError: if images is an empty list.
+    ValueError: if images is an empty list or image_format is unknown.
   """
   if not images:
     raise ValueError("Must provide some images for the generator.")
+  if image_format == "png":
+    image_key = "image/encoded"
+    image_strings = encode_images_as_png(images, num_processes=num_processes)
+  elif image_format == "raw":
+    image_key = "image/raw"
+    image_strings = (np.asarray(image, dtype=np.uint8).tobytes()
+                     for image in images)
+  else:
+    raise ValueError("Unknown image format %s." % image_format)
   width, height, _ = images[0].shape
-  for (enc_image, label) in zip(encode_images_as_png(images), labels):
+  for (image_string, label) in zip(image_strings, labels):
     yield {
-        "image/encoded": [enc_image],
-        "image/format": ["png"],
+        image_key: [image_string],
+        "image/format": [image_format],
         "image/class/label": [int(label)],
         "image/height": [height],
         "image/width": [width]
     }
 
 
+def convert_png_records_to_raw(input_filepaths, output_filepaths, image_shape,
+                               num_parallel_calls=8):
+  """Rewrites records with PNG images in the raw image format.
+
+  The PNG in "image/encoded" of every record is replaced by its uint8 pixels
+  in "image/raw"; all other fields are kept. This converts the data of an
+  existing image problem for a problem with `raw_image_shape` set.
+
+  Args:
+    input_filepaths: list of TFRecord files with PNG encoded images.
+    output_filepaths: list of TFRecord files to write, one per input file.
+    image_shape: [height, width, channels] of the images.
+    num_parallel_calls: number of images to decode in parallel.
+
+  Raises:
+    ValueError: if the numbers of input and output files differ.
+  """
+  if len(input_filepaths) != len(output_filepaths):
+    raise ValueError("Got %d input files but %d output files." %
+                     (len(input_filepaths), len(output_filepaths)))
+
+  def decode(serialized):
+    features = tf.parse_single_example(
+        serialized, {"image/encoded": tf.FixedLenFeature((), tf.string)})
+    image = tf.image.decode_png(features["image/encoded"],
+                                channels=image_shape[-1])
+    with tf.control_dependencies([
+        tf.assert_equal(tf.shape(image), image_shape,
+                        message="Image does not have the expected shape.")]):
+      return serialized, tf.identity(image)
+
+  for input_filepath, output_filepath in zip(input_filepaths, output_filepaths):
+    with tf.Graph().as_default():
+      dataset = tf.data.TFRecordDataset(input_filepath).map(
+          decode, num_parallel_calls=num_parallel_calls)
+      next_record = dataset.make_one_shot_iterator().get_next()
+      with tf.Session() as sess, tf.python_io.TFRecordWriter(
+          output_filepath) as writer:
+        while True:
+          try:
+            serialized, image = sess.run(next_record)
+          except tf.errors.OutOfRangeError:
+            break
+          example = tf.train.Example.FromString(serialized)
+          feature = example.features.feature
+          del feature["image/encoded"]
+          feature["image/raw"].bytes_list.value.append(image.tobytes())
+          feature["image/format"].bytes_list.value[:] = [b"raw"]
+          writer.write(example.SerializeToString())
+
+
 class Image2TextProblem(ImageProblem):
   """Base class for image-to-text problems."""
 
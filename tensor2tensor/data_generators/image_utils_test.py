@@ -17,8 +17,13 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import os
 import numpy as np
+from tensor2tensor.data_generators import cifar  # pylint: disable=unused-import
+from tensor2tensor.data_generators import generator_utils
 from tensor2tensor.data_generators import image_utils
+from tensor2tensor.data_generators import mnist  # pylint: disable=unused-import
+from tensor2tensor.utils import registry
 
 import tensorflow as tf
 
@@ -70,6 +75,83 @@ class ImageTest(tf.test.TestCase):
       decoded2 = sess.run(decoded_png_t, feed_dict={image_t: encoded_img2[0]})
       self.assertAllClose(decoded2, image2)
 
+  def testEncodeImagesAsPng(self):
+    np.random.seed(1111)
+    images = [np.random.randint(0, 256, size=(7, 5, channels), dtype=np.uint8)
+              for channels in [1, 2, 3, 4, 3, 1, 4]]
+    in_process = list(image_utils.encode_images_as_png(
+        images, num_processes=1))
+    in_pool = list(image_utils.encode_images_as_png(
+        images, num_processes=2, chunk_size=3))
+    self.assertEqual(in_process, in_pool)
+    self.assertEqual(in_process, list(image_utils.encode_images_as_png(images)))
+
+    image_t = tf.placeholder(dtype=tf.string)
+    decoded_png_t = tf.image.decode_png(image_t)
+    with self.test_session() as sess:
+      for image, encoded in zip(images, in_pool):
+        decoded = sess.run(decoded_png_t, feed_dict={image_t: encoded})
+        self.assertAllEqual(decoded, image)
+
+  def testEncodePngSize(self):
+    np.random.seed(1111)
+    y, x = np.mgrid[0:32, 0:32]
+    gradient = np.stack([3 * x, 3 * y, 2 * (x + y)], axis=2)
+    image = np.clip(gradient + np.random.randint(-6, 7, size=(32, 32, 3)),
+                    0, 255).astype(np.uint8)
+    with self.test_session() as sess:
+      tf_encoded = sess.run(tf.image.encode_png(image))
+    # The rows are filtered, as by tf.image.encode_png.
+    self.assertLess(len(image_utils.encode_png(image)), 1.05 * len(tf_encoded))
+
+  def testRegisteredRawImageProblems(self):
+    for name, shape in [("image_mnist_raw", [28, 28, 1]),
+                        ("image_fashion_mnist_raw", [28, 28, 1]),
+                        ("image_cifar10_raw", [32, 32, 3]),
+                        ("image_cifar100_raw", [32, 32, 3])]:
+      raw_problem = registry.problem(name)
+      self.assertEqual(raw_problem.image_format, "raw")
+      self.assertEqual(raw_problem.raw_image_shape, shape)
+      data_fields, _ = raw_problem.example_reading_spec()
+      self.assertIn("image/raw", data_fields)
+    self.assertEqual(registry.problem("image_cifar10").image_format, "png")
+
+  def testRawImageRecords(self):
+
+    class RawImageProblem(image_utils.Image2ClassProblem):
+
+      @property
+      def raw_image_shape(self):
+        return [10, 12, 3]
+
+    np.random.seed(1111)
+    images = [np.random.randint(0, 256, size=(10, 12, 3), dtype=np.uint8)
+              for _ in range(3)]
+    tmp_dir = self.get_temp_dir()
+    png_filepath = os.path.join(tmp_dir, "png_records")
+    raw_filepath = os.path.join(tmp_dir, "raw_records")
+    converted_filepath = os.path.join(tmp_dir, "converted_records")
+    generator_utils.generate_files(
+        image_utils.image_generator(images, [1, 2, 3]), [png_filepath])
+    generator_utils.generate_files(
+        image_utils.image_generator(images, [1, 2, 3], image_format="raw"),
+        [raw_filepath])
+    image_utils.convert_png_records_to_raw(
+        [png_filepath], [converted_filepath], [10, 12, 3])
+
+    problem = RawImageProblem()
+    self.assertEqual(problem.image_format, "raw")
+    for filepath in [raw_filepath, converted_filepath]:
+      with tf.Graph().as_default():
+        dataset = tf.data.TFRecordDataset(filepath).map(
+            problem.decode_example)
+        example = dataset.make_one_shot_iterator().get_next()
+        with tf.Session() as sess:
+          for image, label in zip(images, [1, 2, 3]):
+            example_np = sess.run(example)
+            self.assertAllEqual(example_np["inputs"], image)
+            self.assertAllEqual(example_np["targets"], [label])
+
   def testMakeMultiscaleDivisible(self):
     image = tf.random_normal([256, 256, 3])
     resolutions = [8, 16, 64, 256]
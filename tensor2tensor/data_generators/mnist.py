@@ -87,7 +87,8 @@ def mnist_common_generator(tmp_dir,
                            how_many,
                            data_filename,
                            label_filename,
-                           start_from=0):
+                           start_from=0,
+                           image_format="png"):
   """Image generator for MNIST.
 
   Args:
@@ -97,6 +98,7 @@ def mnist_common_generator(tmp_dir,
     data_filename: file that contains features data.
     label_filename: file that contains labels.
     start_from: from which image to start.
+    image_format: format in which to store the images, "png" or "raw".
 
   Returns:
     An instance of image_generator that produces MNIST images.
@@ -110,10 +112,12 @@ def mnist_common_generator(tmp_dir,
   random.shuffle(data)
   images, labels = list(zip(*data))
   return image_utils.image_generator(images[start_from:start_from + how_many],
-                                     labels[start_from:start_from + how_many])
+                                     labels[start_from:start_from + how_many],
+                                     image_format)
 
 
-def mnist_generator(tmp_dir, training, how_many, start_from=0):
+def mnist_generator(tmp_dir, training, how_many, start_from=0,
+                    image_format="png"):
   """Image generator for MNIST.
 
   Args:
@@ -121,6 +125,7 @@ def mnist_generator(tmp_dir, training, how_many, start_from=0):
     training: a Boolean; if true, we use the train set, otherwise the test set.
     how_many: how many images and labels to generate.
     start_from: from which image to start.
+    image_format: format in which to store the images, "png" or "raw".
 
   Returns:
     An instance of image_generator that produces MNIST images.
@@ -128,7 +133,8 @@ def mnist_generator(tmp_dir, training, how_many, start_from=0):
   _get_mnist(tmp_dir)
   d = _MNIST_TRAIN_DATA_FILENAME if training else _MNIST_TEST_DATA_FILENAME
   l = _MNIST_TRAIN_LABELS_FILENAME if training else _MNIST_TEST_LABELS_FILENAME
-  return mnist_common_generator(tmp_dir, training, how_many, d, l, start_from)
+  return mnist_common_generator(tmp_dir, training, how_many, d, l, start_from,
+                                image_format)
 
 
 @registry.register_problem
@@ -165,9 +171,11 @@ class ImageMnistTune(image_utils.Image2ClassProblem):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return mnist_generator(tmp_dir, True, 55000)
+      return mnist_generator(tmp_dir, True, 55000,
+                             image_format=self.image_format)
     else:
-      return mnist_generator(tmp_dir, True, 5000, 55000)
+      return mnist_generator(tmp_dir, True, 5000, 55000,
+                             image_format=self.image_format)
 
 
 @registry.register_problem
@@ -175,9 +183,20 @@ class ImageMnist(ImageMnistTune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return mnist_generator(tmp_dir, True, 60000)
+      return mnist_generator(tmp_dir, True, 60000,
+                             image_format=self.image_format)
     else:
-      return mnist_generator(tmp_dir, False, 10000)
+      return mnist_generator(tmp_dir, False, 10000,
+                             image_format=self.image_format)
+
+
+@registry.register_problem
+class ImageMnistRaw(ImageMnist):
+  """MNIST, images stored as raw uint8 pixels rather than PNG."""
+
+  @property
+  def raw_image_shape(self):
+    return [_MNIST_IMAGE_SIZE, _MNIST_IMAGE_SIZE, 1]
 
 
 # URLs and filenames for MNIST data.
@@ -200,7 +219,8 @@ def _get_fashion_mnist(directory):
                                    _FASHION_MNIST_URL + filename)
 
 
-def fashion_mnist_generator(tmp_dir, training, how_many, start_from=0):
+def fashion_mnist_generator(tmp_dir, training, how_many, start_from=0,
+                            image_format="png"):
   """Image generator for FashionMNIST.
 
   Args:
@@ -208,6 +228,7 @@ def fashion_mnist_generator(tmp_dir, training, how_many, start_from=0):
     training: a Boolean; if true, we use the train set, otherwise the test set.
     how_many: how many images and labels to generate.
     start_from: from which image to start.
+    image_format: format in which to store the images, "png" or "raw".
 
   Returns:
     An instance of image_generator that produces MNIST images.
@@ -217,7 +238,8 @@ def fashion_mnist_generator(tmp_dir, training, how_many, start_from=0):
       _MNIST_TRAIN_DATA_FILENAME if training else _MNIST_TEST_DATA_FILENAME)
   l = _FASHION_MNIST_LOCAL_FILE_PREFIX + (
       _MNIST_TRAIN_LABELS_FILENAME if training else _MNIST_TEST_LABELS_FILENAME)
-  return mnist_common_generator(tmp_dir, training, how_many, d, l, start_from)
+  return mnist_common_generator(tmp_dir, training, how_many, d, l, start_from,
+                                image_format)
 
 
 @registry.register_problem
@@ -252,6 +274,17 @@ class ImageFashionMnist(image_utils.Image2ClassProblem):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return fashion_mnist_generator(tmp_dir, True, 60000)
+      return fashion_mnist_generator(tmp_dir, True, 60000,
+                                     image_format=self.image_format)
     else:
-      return fashion_mnist_generator(tmp_dir, False, 10000)
+      return fashion_mnist_generator(tmp_dir, False, 10000,
+                                     image_format=self.image_format)
+
+
+@registry.register_problem
+class ImageFashionMnistRaw(ImageFashionMnist):
+  """Fashion MNIST, images stored as raw uint8 pixels rather than PNG."""
+
+  @property
+  def raw_image_shape(self):
+    return [_FASHION_MNIST_IMAGE_SIZE, _FASHION_MNIST_IMAGE_SIZE, 1]
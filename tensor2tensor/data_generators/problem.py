@@ -309,6 +309,15 @@ class Problem(object):
     """
     return False
 
+  @property
+  def skip_random_fraction_when_training(self):
+    """Skip a random number of examples at the beginning of training.
+
+    Problems that do not read their training data from files, and so can not
+    derive the skip from them, turn this off.
+    """
+    return True
+
   def dataset_filename(self):
     return self.name
 
@@ -833,14 +842,15 @@ class Problem(object):
     if is_training:
       # Repeat and skip a random number of records
       dataset = dataset.repeat()
-      data_files = tf.contrib.slim.parallel_reader.get_data_files(
-          self.filepattern(data_dir, mode))
-      #  In continuous_train_and_eval when switching between train and
-      #  eval, this input_fn method gets called multiple times and it
-      #  would give you the exact same samples from the last call
-      #  (because the Graph seed is set). So this skip gives you some
-      #  shuffling.
-      dataset = skip_random_fraction(dataset, data_files[0])
+      if self.skip_random_fraction_when_training:
+        data_files = tf.contrib.slim.parallel_reader.get_data_files(
+            self.filepattern(data_dir, mode))
+        #  In continuous_train_and_eval when switching between train and
+        #  eval, this input_fn method gets called multiple times and it
+        #  would give you the exact same samples from the last call
+        #  (because the Graph seed is set). So this skip gives you some
+        #  shuffling.
+        dataset = skip_random_fraction(dataset, data_files[0])
 
     dataset = dataset.map(
         data_reader.cast_ints_to_int32, num_parallel_calls=num_threads)
@@ -44,6 +44,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import re
 import sys
 import unicodedata
 import six
@@ -86,6 +87,45 @@ def encode(text):
   return ret
 
 
+# Regular expression matching the alphanumeric tokens, built on first use.
+_alphanumeric_token_re = None
+
+
+def _build_alphanumeric_token_re():
+  """Regular expression matching the runs of _ALPHANUMERIC_CHAR_SET."""
+  codes = sorted(ord(c) for c in _ALPHANUMERIC_CHAR_SET)
+  ranges = []
+  start = prev = codes[0]
+  for code in codes[1:]:
+    if code != prev + 1:
+      ranges.append((start, prev))
+      start = code
+    prev = code
+  ranges.append((start, prev))
+  char_class = u"".join(
+      re.escape(six.unichr(first)) if first == last else
+      u"%s-%s" % (re.escape(six.unichr(first)), re.escape(six.unichr(last)))
+      for first, last in ranges)
+  return re.compile(u"[%s]+" % char_class, re.UNICODE)
+
+
+def alphanumeric_tokens(text):
+  """Returns the alphanumeric tokens of encode(text), in order.
+
+  Equivalent to keeping the tokens of encode(text) that start with an
+  alphanumeric character, but scans the text with a single regular expression.
+
+  Args:
+    text: a unicode string
+  Returns:
+    a list of tokens as Unicode strings
+  """
+  global _alphanumeric_token_re
+  if _alphanumeric_token_re is None:
+    _alphanumeric_token_re = _build_alphanumeric_token_re()
+  return _alphanumeric_token_re.findall(text)
+
+
 def decode(tokens):
   """Decode a list of tokens to a unicode string.
 
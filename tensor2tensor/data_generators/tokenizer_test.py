@@ -57,6 +57,17 @@ class TokenizerTest(tf.test.TestCase):
       s = u"".join(six.unichr(random.randint(0, 65535)) for _ in range(10))
       self.assertEqual(s, tokenizer.decode(tokenizer.encode(s)))
 
+  def test_alphanumeric_tokens(self):
+    self.assertListEqual(
+        [u"Dude", u"that", u"s", u"so", u"cool", u"1969"],
+        tokenizer.alphanumeric_tokens(u"Dude - that's so cool. (1969)"))
+    for _ in range(100):
+      s = u"".join(six.unichr(random.randint(0, 65535)) for _ in range(30))
+      self.assertListEqual(
+          [t for t in tokenizer.encode(s)
+           if t[0] in tokenizer._ALPHANUMERIC_CHAR_SET],
+          tokenizer.alphanumeric_tokens(s))
+
 
 class TestTokenCounts(tf.test.TestCase):
 
@@ -18,10 +18,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import os
+import numpy as np
 import six
 
 from tensor2tensor.data_generators import generator_utils
+from tensor2tensor.data_generators import image_utils
 from tensor2tensor.data_generators import problem
 from tensor2tensor.data_generators import text_encoder
 from tensor2tensor.utils import metrics
@@ -138,6 +141,29 @@ class VideoProblem(problem.Problem):
   def use_not_breaking_batching(self):
     return True
 
+  @property
+  def video_clip_stride(self):
+    """Number of frames between the starts of clips from the same video.
+
+    Only used with use_not_breaking_batching. 1 gives all overlapping clips,
+    the number of frames per clip gives disjoint clips. Clips start at frame
+    numbers multiple of the stride, and the other clips are never built.
+    """
+    return 1
+
+  @property
+  def frames_per_record(self):
+    """Number of frames stored in each record on disk.
+
+    By default (0) every frame is a separate record with a PNG image. If
+    positive, each record holds a clip of this many consecutive frames of one
+    video as raw uint8 data, with the extra fields of all its frames, so that
+    clips need not be reassembled from single frames at read time. It must be
+    at least the number of input and target frames, and preprocess_example
+    is then called on whole clips.
+    """
+    return 0
+
   def preprocess_example(self, example, mode, hparams):
     """Runtime preprocessing, e.g., resize example["frame"]."""
     return example
@@ -167,6 +193,10 @@ class VideoProblem(problem.Problem):
   def example_reading_spec(self):
     extra_data_fields, extra_data_items_to_decoders = self.extra_reading_spec
 
+    if self.frames_per_record:
+      return self._clip_reading_spec(extra_data_fields,
+                                     extra_data_items_to_decoders)
+
     data_fields = {
         "image/encoded": tf.FixedLenFeature((), tf.string),
         "image/format": tf.FixedLenFeature((), tf.string),
@@ -185,6 +215,29 @@ class VideoProblem(problem.Problem):
 
     return data_fields, data_items_to_decoders
 
+  def _clip_reading_spec(self, extra_data_fields, extra_data_items_to_decoders):
+    """Reading spec for records of frames_per_record frames."""
+    clip_shape = [self.frames_per_record] + self.frame_shape
+    data_fields = {
+        "video/raw": tf.FixedLenFeature((), tf.string),
+    }
+    for key, field in six.iteritems(extra_data_fields):
+      data_fields[key] = tf.FixedLenFeature(
+          [self.frames_per_record] + list(field.shape), field.dtype)
+
+    def decode_clip(keys_to_tensors):
+      clip = tf.decode_raw(keys_to_tensors["video/raw"], tf.uint8)
+      return tf.reshape(clip, clip_shape)
+
+    data_items_to_decoders = {
+        "frame":
+            tf.contrib.slim.tfexample_decoder.ItemHandlerCallback(
+                ["video/raw"], decode_clip),
+    }
+    data_items_to_decoders.update(extra_data_items_to_decoders)
+
+    return data_fields, data_items_to_decoders
+
   def preprocess(self, dataset, mode, hparams, interleave=True):
     del interleave
     def split_on_batch(x):
@@ -241,7 +294,9 @@ class VideoProblem(problem.Problem):
 
       Simple batching of images into videos may result into broken videos
       with two parts from two different videos. This preprocessing avoids
-      this using the frame number.
+      this using the frame number. Each frame is read and decoded once, then
+      a window slides over the frames, video_clip_stride frames at a time,
+      and only the windows within one video are kept.
 
       Args:
         dataset: raw not-batched dataset.
@@ -250,46 +305,125 @@ class VideoProblem(problem.Problem):
         batched not-broken videos.
 
       """
-      def check_integrity_and_batch(*datasets):
-        """Checks whether a sequence of frames are from the same video.
+      stride = self.video_clip_stride
+
+      def check_integrity(features):
+        """Checks whether a window of frames is from the same video.
 
         Args:
-          *datasets: datasets each skipping 1 frame from the previous one.
+          features: features of num_frames consecutive frames, batched.
 
         Returns:
-          batched data and the integrity flag.
+          the integrity flag.
         """
-        not_broken = tf.constant(True)
-        if "frame_number" in datasets[0]:
-          frame_numbers = [dataset["frame_number"][0] for dataset in datasets]
-
-          not_broken = tf.equal(
-              frame_numbers[-1] - frame_numbers[0], num_frames-1)
-          if self.only_keep_videos_from_0th_frame:
-            not_broken = tf.logical_and(not_broken,
-                                        tf.equal(frame_numbers[0], 0))
-        else:
-          tf.logging.warning("use_not_breaking_batching is True but "
-                             "no frame_number is in the dataset.")
-
-        features = {}
-        for key in datasets[0].keys():
-          values = [dataset[key] for dataset in datasets]
-          batch = tf.stack(values)
-          features[key] = batch
-        return features, not_broken
-
-      ds = [dataset.skip(i) for i in range(num_frames)]
-      dataset = tf.data.Dataset.zip(tuple(ds))
-      dataset = dataset.map(check_integrity_and_batch)
-      dataset = dataset.filter(lambda _, not_broken: not_broken)
-      dataset = dataset.map(lambda features, _: features)
+        frame_numbers = features["frame_number"][:, 0]
+        not_broken = tf.reduce_all(
+            tf.equal(frame_numbers[1:] - frame_numbers[:-1], 1))
+        if self.only_keep_videos_from_0th_frame:
+          not_broken = tf.logical_and(not_broken,
+                                      tf.equal(frame_numbers[0], 0))
+        return not_broken
+
+      def padding_before_frame(state, features):
+        """Counts the padding frames aligning the window starts on a video.
+
+        Windows start every stride positions. Within a video the position of
+        a frame minus its frame number stays the same, so when a video starts
+        the position is moved to its frame number modulo stride, and only
+        windows starting at frame numbers multiple of stride are built.
 
-      return dataset
+        Args:
+          state: (previous frame number, position of the next frame).
+          features: features of a frame.
+
+        Returns:
+          the next state and the features with their number of padding frames.
+        """
+        previous_frame_number, position = state
+        frame_number = tf.to_int64(features["frame_number"][0])
+        padding = tf.where(
+            tf.equal(frame_number, previous_frame_number + 1),
+            tf.constant(0, tf.int64), (frame_number - position) % stride)
+        return (frame_number, position + padding + 1), (features, padding)
+
+      def pad_frame(features, padding):
+        # The padding frames have frame number -1, so their windows are
+        # dropped by check_integrity.
+        padded = {}
+        for k, v in six.iteritems(features):
+          if v.dtype == tf.string:
+            fill = ""
+          else:
+            fill = tf.cast(-1 if k == "frame_number" else 0, v.dtype)
+          padding_shape = tf.concat([[tf.to_int32(padding)], tf.shape(v)], 0)
+          padded[k] = tf.concat(
+              [tf.fill(padding_shape, fill), tf.expand_dims(v, 0)], 0)
+        return padded
+
+      def strided_windows(dataset):
+        """Windows of num_frames frames starting every stride positions."""
+        if stride < num_frames:
+          return dataset.apply(
+              tf.contrib.data.sliding_window_batch(num_frames, stride))
+        # The windows are disjoint, the frames between them are dropped.
+        dataset = dataset.apply(tf.contrib.data.enumerate_dataset())
+        dataset = dataset.filter(
+            lambda position, _: position % stride < num_frames)
+        dataset = dataset.map(lambda _, features: features)
+        return dataset.apply(
+            tf.contrib.data.batch_and_drop_remainder(num_frames))
+
+      if "frame_number" not in dataset.output_shapes:
+        tf.logging.warning("use_not_breaking_batching is True but "
+                           "no frame_number is in the dataset.")
+        return strided_windows(dataset)
+      if stride > 1:
+        dataset = dataset.apply(tf.contrib.data.scan(
+            (tf.constant(-2, tf.int64), tf.constant(0, tf.int64)),
+            padding_before_frame))
+        dataset = dataset.map(pad_frame).apply(tf.contrib.data.unbatch())
+      return strided_windows(dataset).filter(check_integrity)
+
+    def clips_from_records(dataset):
+      """Takes num_frames consecutive frames from each stored clip.
+
+      Args:
+        dataset: dataset of clips of frames_per_record frames.
+
+      Returns:
+        batched not-broken videos.
+
+      Raises:
+        ValueError: if the stored clips are shorter than num_frames.
+      """
+      if self.frames_per_record < num_frames:
+        raise ValueError("Records of %d frames are too short for %d frames." %
+                         (self.frames_per_record, num_frames))
+
+      def take_frames(features):
+        start = 0
+        # We start at a random frame of the clip to add variety.
+        if self.random_skip and not self.only_keep_videos_from_0th_frame:
+          start = tf.random_uniform(
+              [], maxval=self.frames_per_record - num_frames + 1,
+              dtype=tf.int32)
+        return {k: v[start:start + num_frames]
+                for k, v in six.iteritems(features)}
+
+      if (self.only_keep_videos_from_0th_frame and
+          "frame_number" in dataset.output_shapes):
+        dataset = dataset.filter(
+            lambda features: tf.equal(features["frame_number"][0, 0], 0))
+      return dataset.map(take_frames)
 
     preprocessed_dataset = dataset.map(_preprocess)
     num_frames = (hparams.video_num_input_frames +
                   hparams.video_num_target_frames)
+    if self.frames_per_record:
+      dataset = clips_from_records(preprocessed_dataset)
+      dataset = dataset.map(features_from_batch)
+      dataset = dataset.shuffle(256)
+      return dataset
     # We jump by a random position at the beginning to add variety.
     if self.random_skip:
       random_skip = tf.random_uniform([], maxval=num_frames, dtype=tf.int64)
@@ -348,43 +482,93 @@ class VideoProblem(problem.Problem):
     Raises:
       ValueError: if the frame has a different number of channels than required.
     """
-    with tf.Graph().as_default():
-      image_t = tf.placeholder(
-          dtype=tf.uint8, shape=(None, None, None))
-      encoded_image_t = tf.image.encode_png(image_t)
-      with tf.Session() as sess:
-        for features in self.generate_samples(data_dir, tmp_dir, dataset_split):
-          unencoded_frame = features.pop("frame")
-          height, width, channels = unencoded_frame.shape
-          if channels != self.num_channels:
-            raise ValueError("Generated frame has %d channels while the class "
-                             "assumes %d channels." % (channels,
-                                                       self.num_channels))
-          if height != self.frame_height:
-            raise ValueError("Generated frame has height %d while the class "
-                             "assumes height %d." % (height, self.frame_height))
-          if width != self.frame_width:
-            raise ValueError("Generated frame has width %d while the class "
-                             "assumes width %d." % (width, self.frame_width))
-          encoded_frame = sess.run(encoded_image_t, feed_dict={
-              image_t: unencoded_frame})
-          features["image/encoded"] = [encoded_frame]
-          features["image/format"] = ["png"]
-          features["image/height"] = [height]
-          features["image/width"] = [width]
-          if "image/debug" in features:
-            unencoded_debug = features.pop("image/debug")
-            encoded_debug = sess.run(encoded_image_t, feed_dict={
-                image_t: unencoded_debug})
-            features["image/encoded_debug"] = [encoded_debug]
-          yield features
+    if self.frames_per_record:
+      for features in self.generate_encoded_clips(
+          data_dir, tmp_dir, dataset_split):
+        yield features
+      return
+
+    # Frames are encoded in worker processes while generate_samples runs
+    # ahead; the features of frames in flight wait here in order.
+    in_flight = collections.deque()
+
+    def unencoded_images():
+      for features in self.generate_samples(data_dir, tmp_dir, dataset_split):
+        unencoded_frame = features.pop("frame")
+        height, width, channels = unencoded_frame.shape
+        if channels != self.num_channels:
+          raise ValueError("Generated frame has %d channels while the class "
+                           "assumes %d channels." % (channels,
+                                                     self.num_channels))
+        if height != self.frame_height:
+          raise ValueError("Generated frame has height %d while the class "
+                           "assumes height %d." % (height, self.frame_height))
+        if width != self.frame_width:
+          raise ValueError("Generated frame has width %d while the class "
+                           "assumes width %d." % (width, self.frame_width))
+        unencoded_debug = features.pop("image/debug", None)
+        in_flight.append((features, unencoded_debug is not None))
+        yield unencoded_frame
+        if unencoded_debug is not None:
+          yield unencoded_debug
+
+    encoded_images = image_utils.encode_images_as_png(unencoded_images())
+    for encoded_frame in encoded_images:
+      features, has_debug = in_flight.popleft()
+      features["image/encoded"] = [encoded_frame]
+      features["image/format"] = ["png"]
+      features["image/height"] = [self.frame_height]
+      features["image/width"] = [self.frame_width]
+      if has_debug:
+        features["image/encoded_debug"] = [next(encoded_images)]
+      yield features
+
+  def generate_encoded_clips(self, data_dir, tmp_dir, dataset_split):
+    """Generate clips of frames_per_record frames with possible extra data.
+
+    Consecutive frames from `self.generate_samples` are grouped into clips of
+    one video, using "frame_number" if present to detect where videos start.
+    Frames that do not fill a whole clip at the end of a video are dropped.
+
+    Args:
+      data_dir: final data directory.
+      tmp_dir: temporary directory that you can use for downloading and scratch.
+      dataset_split: problem.DatasetSplit, which data split to generate samples
+        for (for example, training and evaluation).
+
+    Yields:
+      Sample: dict<str feature_name, feature value> with the raw frames of the
+        clip as "video/raw" and the extra fields of its frames concatenated.
+
+    Raises:
+      ValueError: if a frame does not have the shape of frame_shape.
+    """
+    clip = []
+    for features in self.generate_samples(data_dir, tmp_dir, dataset_split):
+      if list(features["frame"].shape) != self.frame_shape:
+        raise ValueError("Generated frame has shape %s while the class "
+                         "assumes %s." % (features["frame"].shape,
+                                          self.frame_shape))
+      features.pop("image/debug", None)
+      if clip and "frame_number" in features and (
+          features["frame_number"][0] != clip[-1]["frame_number"][0] + 1):
+        clip = []
+      clip.append(features)
+      if len(clip) < self.frames_per_record:
+        continue
+      frames = np.stack([f.pop("frame") for f in clip]).astype(np.uint8)
+      encoded = {"video/raw": [frames.tobytes()]}
+      for key in clip[0]:
+        encoded[key] = [value for f in clip for value in f[key]]
+      yield encoded
+      clip = []
 
   def generate_encoded_samples_debug(self, data_dir, tmp_dir, dataset_split):
     """Generate samples of the encoded frames and dump for debug if needed."""
     counter = 0
     for sample in self.generate_encoded_samples(
         data_dir, tmp_dir, dataset_split):
-      if self.debug_dump_frames_path:
+      if self.debug_dump_frames_path and "video/raw" not in sample:
         if not tf.gfile.Exists(self.debug_dump_frames_path):
           tf.gfile.MkDir(self.debug_dump_frames_path)
         path = os.path.join(self.debug_dump_frames_path,
@@ -414,18 +598,24 @@ class VideoProblem(problem.Problem):
     for _, paths in split_paths:
       all_paths.extend(paths)
 
+    def cycle_every_n(paths):
+      # Clips are self-contained, so they need not be kept in one shard.
+      if self.frames_per_record:
+        return 1
+      return self.total_number_of_frames // len(paths)
+
     if self.is_generate_per_split:
       for split, paths in split_paths:
         generator_utils.generate_files(
             self.generate_encoded_samples_debug(
                 data_dir, tmp_dir, split), paths,
-            cycle_every_n=self.total_number_of_frames // len(paths))
+            cycle_every_n=cycle_every_n(paths))
     else:
       generator_utils.generate_files(
           self.generate_encoded_samples_debug(
               data_dir, tmp_dir, problem.DatasetSplit.TRAIN),
           all_paths,
-          cycle_every_n=self.total_number_of_frames // len(all_paths))
+          cycle_every_n=cycle_every_n(all_paths))
 
 
 # TODO(lukaszkaiser): remove this version after everything is ported.
@@ -38,6 +38,8 @@ flags.DEFINE_string("out_dir", None, "Directory to write references to.")
 flags.DEFINE_string("commoncrawl_wet_dir", None,
                     "Path to CommonCrawl wet.gz files locally. If not "
                     "provided, will download.")
+flags.DEFINE_integer("num_workers", 1,
+                     "Number of processes reading WET files.")
 
 
 def main(_):
@@ -62,7 +64,8 @@ def main(_):
     tf.logging.info("Sharded out WET files. Processing %d files",
                     len(wet_files))
 
-    wikisum.extract_references_from_wets(wet_files, FLAGS.metadata_dir, out_dir)
+    wikisum.extract_references_from_wets(wet_files, FLAGS.metadata_dir, out_dir,
+                                         num_workers=FLAGS.num_workers)
 
 
 if __name__ == "__main__":
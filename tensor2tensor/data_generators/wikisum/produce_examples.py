@@ -39,6 +39,9 @@ flags.DEFINE_string("urls_dir", "gs://tensor2tensor-data/wikisum/wiki_urls/",
 flags.DEFINE_string("vocab_dir", None, "Directory with vocab file")
 flags.DEFINE_bool("for_commoncrawl", False,
                   "Whether to use WikisumCommoncrawl or WikisumWeb.")
+flags.DEFINE_integer("num_workers", 1,
+                     "Number of processes ranking and encoding the examples "
+                     "of a task.")
 
 
 def main(_):
@@ -63,7 +66,8 @@ def main(_):
         refs_dir=FLAGS.refs_dir,
         urls_dir=FLAGS.urls_dir,
         vocab_path=os.path.join(FLAGS.vocab_dir, problem.vocab_filename),
-        out_filepaths=out_filepaths)
+        out_filepaths=out_filepaths,
+        num_workers=FLAGS.num_workers)
 
 
 if __name__ == "__main__":
@@ -21,20 +21,14 @@ import collections
 import contextlib
 import datetime
 import gzip
+import multiprocessing
 import os
 import re
 import urllib
+import zlib
 
 import tensorflow as tf
 
-# pylint: disable=g-import-not-at-top
-# To maintain compatibility with Python 2 and 3
-try:
-  import cStringIO as StringIO
-except ImportError:
-  import io as StringIO
-# pylint: enable=g-import-not-at-top
-
 
 # Each entry is a URL to the wet.paths.gz file for that CommonCrawl dump.
 WET_PATHS_BY_DATE = {
@@ -46,6 +40,9 @@ S3_HTTP_PREFIX = 'https://commoncrawl.s3.amazonaws.com/'
 NUM_SHARDS = 1000
 METADTA_SUFFIX = '.metadata.json'
 
+# Size of the reads from WET files, and of the decompressed chunks.
+WET_CHUNK_SIZE = 2**20
+
 
 
 def readahead(path):
@@ -114,15 +111,107 @@ def wet_records_from_file_obj(f, take_ownership=False):
     f.close()
 
 
-def wet_records(wet_filepath):
-  """Generate WETRecords from filepath."""
-  if wet_filepath.endswith('.gz'):
-    fopen = gzip.open
-  else:
-    fopen = tf.gfile.FastGFile
+_WARC_VERSION = b'WARC/1.0'
+_WARC_URI_HEADER = b'WARC-Target-URI:'
+_WARC_LENGTH_HEADER = b'Content-Length:'
+_WARC_HEADER_END_RE = re.compile(br'\n\r?\n')
+
+
+def read_chunks(f, chunk_size=WET_CHUNK_SIZE):
+  """Generate chunks of at most chunk_size bytes from file object f."""
+  while True:
+    chunk = f.read(chunk_size)
+    if not chunk:
+      break
+    yield chunk
+
+
+def gunzip_chunks(chunks, chunk_size=WET_CHUNK_SIZE):
+  """Decompress gzipped chunks incrementally.
+
+  Concatenated gzip members, as in CommonCrawl files where every record is
+  compressed separately, are decompressed one after the other.
 
-  with fopen(wet_filepath) as f:
-    for record in wet_records_from_file_obj(f):
+  Args:
+    chunks: iterable of bytes, the compressed data.
+    chunk_size: int, maximum size of the decompressed chunks.
+
+  Yields:
+    bytes, the decompressed data.
+  """
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  for data in chunks:
+    while data:
+      decompressed = decompressor.decompress(data, chunk_size)
+      if decompressed:
+        yield decompressed
+      data = decompressor.unconsumed_tail
+      if decompressor.unused_data:
+        # Start of the next gzip member.
+        data = decompressor.unused_data
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  decompressed = decompressor.flush()
+  if decompressed:
+    yield decompressed
+
+
+def wet_records_from_chunks(chunks):
+  """Generate WETRecords from chunks of an uncompressed WET file.
+
+  Records start at a WARC/1.0 line and their content is Content-Length bytes
+  after the blank line ending the headers. Only the current record and the
+  current chunk are held in memory.
+
+  Args:
+    chunks: iterable of bytes, the WET file.
+
+  Yields:
+    WETRecords with a WARC-Target-URI, url and content as bytes.
+  """
+  buf = b''
+  for chunk in chunks:
+    buf += chunk
+    pos = 0
+    while True:
+      start = buf.find(_WARC_VERSION, pos)
+      if start < 0:
+        # Keep what could be the beginning of the next version line.
+        pos = max(pos, len(buf) - len(_WARC_VERSION) + 1)
+        break
+      header_end = _WARC_HEADER_END_RE.search(buf, start)
+      if not header_end:
+        pos = start
+        break
+
+      url = None
+      length = None
+      for line in buf[start:header_end.start()].split(b'\n'):
+        if line.startswith(_WARC_URI_HEADER):
+          url = line[len(_WARC_URI_HEADER):].strip()
+        elif line.startswith(_WARC_LENGTH_HEADER):
+          length = int(line[len(_WARC_LENGTH_HEADER):])
+      if length is None:
+        # Not a record header, look for the next one.
+        pos = start + len(_WARC_VERSION)
+        continue
+
+      content_end = header_end.end() + length
+      if content_end > len(buf):
+        pos = start
+        break
+      if url:
+        yield WETRecord(url, buf[header_end.end():content_end])
+      pos = content_end
+    buf = buf[pos:]
+
+
+def wet_records(wet_filepath, chunk_size=WET_CHUNK_SIZE):
+  """Generate WETRecords from filepath, streaming the (gzipped) file."""
+  with tf.gfile.Open(readahead(wet_filepath), 'rb') as f:
+    chunks = read_chunks(f, chunk_size)
+    if wet_filepath.endswith('.gz'):
+      chunks = gunzip_chunks(chunks, chunk_size)
+    for record in wet_records_from_chunks(chunks):
       yield record
 
 
@@ -200,14 +289,10 @@ def shard(items, num_shards):
   return sharded
 
 
-def gzip_memfile(fname):
-  with tf.gfile.Open(readahead(fname)) as f:
-    memfile = StringIO.StringIO(f.read())
-  return gzip.GzipFile(fileobj=memfile)
-
-
 _SOME_ALPHA_RE = re.compile(r'[A-Za-z]+')
-_ONLY_ALPHA_RE = re.compile(r'^[A-Za-z]*$')
+# Whitespace-separated tokens that are a period or only letters.
+_PERIOD_TOKEN_RE = re.compile(r'(?<!\S)\.(?!\S)')
+_ALPHA_TOKEN_RE = re.compile(r'(?<!\S)[A-Za-z]+(?!\S)')
 
 
 def filter_paragraph(p):
@@ -229,28 +314,42 @@ def filter_paragraph(p):
     return True
 
   # Require some letters.
-  if not re.search(_SOME_ALPHA_RE, p):
+  if not _SOME_ALPHA_RE.search(p):
     return True
 
   # Keep this one at the end, probably the most complicated logic.
   # We try to detect sentences, which should have a minimum of 3 tokens
-  # with only alphabetic characters.
-  last = 0
-  found_sentence = False
-  num_alpha = 0
-  for i, x in enumerate(tokens):
-    if x == '.':
-      if i - last > 3 and num_alpha >= 3:
-        found_sentence = True
-        break
-      last = i
-      num_alpha = 0
-    if re.match(_ONLY_ALPHA_RE, x):
-      num_alpha += 1
-  if not found_sentence:
-    return True
+  # with only alphabetic characters, and end with a period token. The first
+  # sentence needs at least 4 tokens.
+  sentences = _PERIOD_TOKEN_RE.split(p)
+  for i, sentence in enumerate(sentences[:-1]):
+    if (len(_ALPHA_TOKEN_RE.findall(sentence)) >= 3 and
+        (i > 0 or len(sentence.split()) > 3)):
+      return False
+
+  return True
 
-  return False
+
+def filter_paragraphs(paragraphs, num_workers=1, chunksize=1000):
+  """Applies filter_paragraph to a list of paragraphs.
+
+  Args:
+    paragraphs: list<str>, the paragraphs.
+    num_workers: int, number of processes to filter the paragraphs with, only
+      worth it for very large lists.
+    chunksize: int, number of paragraphs sent to a process at a time.
+
+  Returns:
+    list<bool>, True for the paragraphs to remove.
+  """
+  if num_workers <= 1:
+    return [filter_paragraph(p) for p in paragraphs]
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    return pool.map(filter_paragraph, paragraphs, chunksize=chunksize)
+  finally:
+    pool.terminate()
+    pool.join()
 
 
 @contextlib.contextmanager
@@ -18,6 +18,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import gzip
 import os
 from tensor2tensor.data_generators.wikisum import utils
 
@@ -32,8 +33,49 @@ def _get_testdata(filename):
     return f.read()
 
 
+def wet_record_bytes(url, content, warc_type=b"conversion"):
+  """Serializes a WET record like the CommonCrawl WET files."""
+  headers = [b"WARC/1.0", b"WARC-Type: " + warc_type]
+  if url:
+    headers.append(b"WARC-Target-URI: " + url)
+  headers += [b"WARC-Date: 2017-09-19T12:00:00Z",
+              b"Content-Type: text/plain",
+              b"Content-Length: %d" % len(content)]
+  return b"\r\n".join(headers) + b"\r\n\r\n" + content + b"\r\n\r\n"
+
+
+def write_wet_file(path, records):
+  """Writes a WET file, gzipping every record separately if path is .gz."""
+  records = [wet_record_bytes(None, b"software: Nutch 1.6", b"warcinfo")] + [
+      wet_record_bytes(url, content) for url, content in records]
+  with open(path, "wb") as f:
+    for record in records:
+      if path.endswith(".gz"):
+        with gzip.GzipFile(fileobj=f, mode="wb") as member:
+          member.write(record)
+      else:
+        f.write(record)
+
+
 class UtilsTest(tf.test.TestCase):
 
+  def test_wet_records(self):
+    records = [
+        (b"http://a.com/1", b"First line.\nSecond line."),
+        (b"http://b.com/2", b"Mentions WARC/1.0\r\n\r\nand blank lines."),
+        (b"http://c.com/3", u"Caf\u00e9 \u65e5\u672c".encode("utf-8")),
+        (b"http://d.com/4", b""),
+        (b"http://e.com/5", b"x" * 5000),
+    ]
+    for filename in ["records.wet", "records.wet.gz"]:
+      path = os.path.join(self.get_temp_dir(), filename)
+      write_wet_file(path, records)
+      for chunk_size in [1, 7, 64, 2**20]:
+        self.assertEqual(
+            records,
+            [tuple(r) for r in utils.wet_records(path, chunk_size=chunk_size)],
+            msg="%s, chunk_size=%d" % (filename, chunk_size))
+
   def test_filter_paragraph(self):
     for bad in tf.gfile.Glob(os.path.join(_TESTDATA, "para_bad*.txt")):
       for p in _get_testdata(bad).split("\n"):
@@ -44,6 +86,25 @@ class UtilsTest(tf.test.TestCase):
         p = _get_testdata(good)
       self.assertFalse(utils.filter_paragraph(p), msg="Filtered %s" % p)
 
+  def test_filter_paragraphs(self):
+    paragraphs = []
+    for filename in ["para_bad1.txt", "para_good1.txt"]:
+      paragraphs.extend(_get_testdata(filename).split("\n"))
+    paragraphs += [
+        "one two three . a b c d",
+        "one two three four five six",
+        ". one two three . a b",
+        "x1 y2 z3 . one two three . a",
+        "one two three four.",
+        "one two three four . . a",
+    ]
+    expected = [utils.filter_paragraph(p) for p in paragraphs]
+    self.assertEqual([True, True, False, False, True, False], expected[-6:])
+    self.assertEqual(expected, utils.filter_paragraphs(paragraphs))
+    self.assertEqual(expected,
+                     utils.filter_paragraphs(paragraphs, num_workers=2,
+                                             chunksize=4))
+
 
 if __name__ == "__main__":
   tf.test.main()
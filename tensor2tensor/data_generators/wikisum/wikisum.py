@@ -21,11 +21,14 @@ from __future__ import print_function
 import collections
 import json
 import math
+import multiprocessing
+import multiprocessing.pool
 import os
 import re
 import string
 import tempfile
 
+import numpy as np
 import six
 from tensor2tensor.data_generators import generator_utils
 from tensor2tensor.data_generators import problem
@@ -250,7 +253,8 @@ def _references_content(ref_files):
   data = {}
   for ex in generator_utils.tfrecord_iterator(
       ref_files, gzipped=True, example_spec=example_spec):
-    data[ex["url"]] = text_encoder.to_unicode(ex["content"])
+    data[text_encoder.to_unicode(ex["url"])] = text_encoder.to_unicode(
+        ex["content"])
   return data
 
 
@@ -319,65 +323,181 @@ def _wiki_articles(shard_id, wikis_dir=None):
             sections=sections)
 
 
-def _token_counts(text, token_set=None):
-  counts = collections.defaultdict(int)
-  for token in tokenizer.encode(text_encoder.native_to_unicode(text)):
-    if token_set and token not in token_set:
-      continue
-    counts[token] += 1
-  return counts
+# Punctuation characters, and runs of anything but punctuation and whitespace.
+_NORMALIZED_TOKEN_RE = re.compile(
+    r"[{0}]|[^\s{0}]+".format(re.escape(string.punctuation)))
 
 
 def _normalize_text(text):
-  text = text.lower()
-  # Space around punctuation
-  text = re.sub("[%s]" % re.escape(string.punctuation), r" \g<0> ", text)
-  text = re.sub(r"\s+", " ", text)
-  text = text.strip()
-  return text
+  # Space around punctuation, single spaces between tokens.
+  return " ".join(_NORMALIZED_TOKEN_RE.findall(text.lower()))
 
 
 def _tokens_to_score(tokens):
   return {t for t in tokens if re.search("[a-z0-9]", t)}
 
 
-def rank_reference_paragraphs(wiki_title, references_content, normalize=True):
-  """Rank and return reference paragraphs by tf-idf score on title tokens."""
+def _top_indices(scores, k=None):
+  """Indices of the k largest scores, largest first, ties in index order.
+
+  Same as the first k entries of a stable descending sort of scores, but with
+  a partial sort when k is smaller than the number of scores.
+
+  Args:
+    scores: 1-D float np.array.
+    k: optional int.
+
+  Returns:
+    1-D int np.array.
+  """
+  if k is None or k >= len(scores):
+    return np.argsort(-scores, kind="mergesort")
+  if k <= 0:
+    return np.zeros([0], dtype=np.int64)
+  kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+  above = np.flatnonzero(scores > kth_score)
+  ties = np.flatnonzero(scores == kth_score)[:k - len(above)]
+  selected = np.sort(np.concatenate([above, ties]))
+  return selected[np.argsort(-scores[selected], kind="mergesort")]
+
+
+def rank_reference_paragraphs(wiki_title, references_content, normalize=True,
+                              max_paragraphs=None):
+  """Rank and return reference paragraphs by tf-idf score on title tokens.
+
+  The counts of the title tokens in the paragraphs are gathered into one
+  [num_paragraphs, num_title_tokens] matrix and scored with NumPy, adding the
+  terms of the title tokens in the same order as a per-paragraph loop would,
+  so that the scores and the order are exactly the same.
+
+  Args:
+    wiki_title: string, the title of the article.
+    references_content: list<str>, the content of its references.
+    normalize: bool, whether to return the normalized paragraphs.
+    max_paragraphs: optional int, only return that many of the top paragraphs.
+
+  Returns:
+    list<str>, the paragraphs by decreasing score. Paragraphs with the same
+    score keep their order.
+  """
   normalized_title = _normalize_text(wiki_title)
-  title_tokens = _tokens_to_score(
-      set(tokenizer.encode(text_encoder.native_to_unicode(normalized_title))))
-  ref_paragraph_info = []
-  doc_counts = collections.defaultdict(int)
-  for ref in references_content:
-    for paragraph in ref.split("\n"):
-      normalized_paragraph = _normalize_text(paragraph)
-      if cc_utils.filter_paragraph(normalized_paragraph):
-        # Skip paragraph
-        continue
-      counts = _token_counts(normalized_paragraph, title_tokens)
-      for token in title_tokens:
-        if counts[token]:
-          doc_counts[token] += 1
-      content = normalized_paragraph if normalize else paragraph
-      info = {"content": content, "counts": counts}
-      ref_paragraph_info.append(info)
-
-  for info in ref_paragraph_info:
-    score = 0.
-    for token in title_tokens:
-      term_frequency = info["counts"][token]
-      inv_doc_frequency = (
-          float(len(ref_paragraph_info)) / max(doc_counts[token], 1))
-      score += term_frequency * math.log(inv_doc_frequency)
-    info["score"] = score
-
-  ref_paragraph_info.sort(key=lambda el: el["score"], reverse=True)
-  return [info["content"] for info in ref_paragraph_info]
+  title_tokens = list(_tokens_to_score(
+      set(tokenizer.encode(text_encoder.native_to_unicode(normalized_title)))))
+  raw_paragraphs = [paragraph for ref in references_content
+                    for paragraph in ref.split("\n")]
+  normalized_paragraphs = [_normalize_text(p) for p in raw_paragraphs]
+  paragraphs = []
+  counts = []
+  for paragraph, normalized_paragraph, skip in zip(
+      raw_paragraphs, normalized_paragraphs,
+      cc_utils.filter_paragraphs(normalized_paragraphs)):
+    if skip:
+      continue
+    # Only the alphanumeric tokens can be title tokens.
+    token_counts = collections.Counter(tokenizer.alphanumeric_tokens(
+        text_encoder.native_to_unicode(normalized_paragraph)))
+    counts.append([token_counts[token] for token in title_tokens])
+    paragraphs.append(normalized_paragraph if normalize else paragraph)
+  if not paragraphs:
+    return []
+
+  counts = np.array(counts, dtype=np.int64).reshape(
+      [len(paragraphs), len(title_tokens)])
+  doc_counts = np.count_nonzero(counts, axis=0)
+  scores = np.zeros([len(paragraphs)])
+  for i in range(len(title_tokens)):
+    inv_doc_frequency = float(len(paragraphs)) / max(int(doc_counts[i]), 1)
+    scores += counts[:, i] * math.log(inv_doc_frequency)
+
+  return [paragraphs[i] for i in _top_indices(scores, max_paragraphs)]
+
+
+def _wiki_example(wiki_title, wiki_ref_content, sections, vocab, eot_ids):
+  """Example dict for a Wikipedia article, None if its lead is too short."""
+  # Rank reference paragraphs with TFIDF
+  ranked_paragraphs = rank_reference_paragraphs(wiki_title, wiki_ref_content)
+
+  # Construct inputs from Wiki title and references
+  inputs = []
+  inputs.extend(vocab.encode(wiki_title))
+  inputs.extend(eot_ids)
+  for paragraph in ranked_paragraphs:
+    if len(inputs) >= 1e6:
+      break
+    paragraph += " "
+    inputs.extend(vocab.encode(paragraph))
+
+  # Construct targets from article sections
+  targets, section_boundaries = _encode_wiki_sections(sections, vocab)
+
+  # Skip if lead section is too short
+  if (not section_boundaries or
+      section_boundaries[0] < _MIN_LEADSECTION_TOKENS):
+    return None
+
+  inputs.append(text_encoder.EOS_ID)
+  targets.append(text_encoder.EOS_ID)
+  return {
+      "inputs": inputs,
+      "targets": targets,
+      "section_boundaries": section_boundaries,
+  }
+
+
+# Vocabulary of the processes of the pool used by produce_examples.
+_worker_vocab = None
+
+
+def _init_example_worker(vocab):
+  global _worker_vocab
+  _worker_vocab = vocab
+
+
+def _wiki_example_in_worker(args):
+  wiki_title, wiki_ref_content, sections = args
+  return _wiki_example(wiki_title, wiki_ref_content, sections, _worker_vocab,
+                       _worker_vocab.encode(EOT))
+
+
+def _ordered_imap(pool, fn, iterable, max_pending):
+  """Like pool.imap, but draws at most max_pending items ahead of the output.
+
+  Args:
+    pool: a multiprocessing.Pool.
+    fn: function to apply to the items.
+    iterable: the items.
+    max_pending: maximum number of items submitted to the pool and not yet
+      yielded.
+
+  Yields:
+    fn(item) for the items of iterable, in order.
+  """
+  pending = collections.deque()
+  for item in iterable:
+    pending.append(pool.apply_async(fn, (item,)))
+    if len(pending) >= max_pending:
+      yield pending.popleft().get()
+  while pending:
+    yield pending.popleft().get()
 
 
 def produce_examples(shard_ids, wikis_dir, refs_dir, urls_dir, vocab_path,
-                     out_filepaths):
-  """Produce examples from shard_ids to out_filepaths."""
+                     out_filepaths, num_workers=1, max_pending=1000):
+  """Produce examples from shard_ids to out_filepaths.
+
+  Args:
+    shard_ids: list<int>, the input shards.
+    wikis_dir: directory with the Wikipedia articles.
+    refs_dir: directory with the process_X dirs holding the references.
+    urls_dir: directory with the reference urls of the articles.
+    vocab_path: path of the SubwordTextEncoder vocabulary.
+    out_filepaths: list<str>, the output files.
+    num_workers: number of processes ranking the reference paragraphs and
+      encoding the examples. With more than one, the references of the next
+      shard are also loaded while the current one is processed.
+    max_pending: maximum number of articles handed to the workers ahead of
+      the writer.
+  """
   # * Join the Wikipedia articles with their references
   # * Run Tf-idf to sort reference paragraphs
   # * Encode the Wikipedia and reference text with the vocabulary
@@ -388,19 +508,37 @@ def produce_examples(shard_ids, wikis_dir, refs_dir, urls_dir, vocab_path,
   vocab = text_encoder.SubwordTextEncoder(vocab_path)
   eot_ids = vocab.encode(EOT)
 
-  def example_generator():
-    """Generate Example dicts."""
-    stats = dict(total_original_wikis=0, total_original_refs=0,
-                 total_found_refs=0, ref_lengths=[], wiki_original_refs=[],
-                 wiki_found_refs=[], wikis_skipped_no_refs=0,
-                 wikis_skipped_short_lead=0, num_wikis_written=0)
+  stats = dict(total_original_wikis=0, total_original_refs=0,
+               total_found_refs=0, ref_lengths=[], wiki_original_refs=[],
+               wiki_found_refs=[], wikis_skipped_no_refs=0,
+               wikis_skipped_short_lead=0, num_wikis_written=0)
+
+  def shard_references(ref_files_by_shard, refs_pool):
+    """Generates (shard_id, refs_content), loading one shard ahead."""
+    if refs_pool is None:
+      for shard_id in shard_ids:
+        yield shard_id, _references_content(ref_files_by_shard[shard_id])
+      return
+    if not shard_ids:
+      return
+    next_refs = refs_pool.apply_async(
+        _references_content, (ref_files_by_shard[shard_ids[0]],))
+    for i, shard_id in enumerate(shard_ids):
+      refs_content = next_refs.get()
+      if i + 1 < len(shard_ids):
+        next_refs = refs_pool.apply_async(
+            _references_content, (ref_files_by_shard[shard_ids[i + 1]],))
+      yield shard_id, refs_content
+
+  def wiki_inputs(refs_pool):
+    """Generates (wiki_title, wiki_ref_content, sections) for the articles."""
     ref_files_by_shard = _references_files_by_shard(refs_dir)
-    for shard_id in shard_ids:
+    for shard_id, refs_content in shard_references(ref_files_by_shard,
+                                                   refs_pool):
       tf.logging.info("Processing shard %d", shard_id)
+      tf.logging.info("Loaded reference content for shard")
       wiki_urls = _wiki_urls_for_shard(shard_id, urls_dir)
       tf.logging.info("Loaded wiki URLs for shard")
-      refs_content = _references_content(ref_files_by_shard[shard_id])
-      tf.logging.info("Loaded reference content for shard")
       for i, wiki in enumerate(_wiki_articles(shard_id, wikis_dir)):
         if not i % 1000:
           tf.logging.info("Processing wiki index %d for shard %d", i, shard_id)
@@ -428,40 +566,36 @@ def produce_examples(shard_ids, wikis_dir, refs_dir, urls_dir, vocab_path,
           stats["wikis_skipped_no_refs"] += 1
           continue
 
-        # Rank reference paragraphs with TFIDF
-        wiki_title = _normalize_text(wiki.title)
-        ranked_paragraphs = rank_reference_paragraphs(wiki_title,
-                                                      wiki_ref_content)
-
-        # Construct inputs from Wiki title and references
-        inputs = []
-        inputs.extend(vocab.encode(wiki_title))
-        inputs.extend(eot_ids)
-        for paragraph in ranked_paragraphs:
-          if len(inputs) >= 1e6:
-            break
-          paragraph += " "
-          inputs.extend(vocab.encode(paragraph))
-
-        # Construct targets from article sections
-        targets, section_boundaries = _encode_wiki_sections(
-            wiki.sections, vocab)
-
-        # Skip if lead section is too short
-        if (not section_boundaries or
-            section_boundaries[0] < _MIN_LEADSECTION_TOKENS):
+        yield _normalize_text(wiki.title), wiki_ref_content, wiki.sections
+
+  def example_generator():
+    """Generate Example dicts."""
+    if num_workers > 1:
+      # The pools are created before this process runs any TensorFlow session,
+      # whose threads do not survive a fork. The references are loaded in a
+      # thread to avoid copying them between processes.
+      pool = multiprocessing.Pool(
+          num_workers, initializer=_init_example_worker, initargs=(vocab,))
+      refs_pool = multiprocessing.pool.ThreadPool(1)
+      examples = _ordered_imap(pool, _wiki_example_in_worker,
+                               wiki_inputs(refs_pool), max_pending)
+    else:
+      pool = refs_pool = None
+      examples = (_wiki_example(wiki_title, wiki_ref_content, sections, vocab,
+                                eot_ids)
+                  for wiki_title, wiki_ref_content, sections in wiki_inputs(
+                      refs_pool))
+    try:
+      for example in examples:
+        if example is None:
           stats["wikis_skipped_short_lead"] += 1
           continue
-
-        inputs.append(text_encoder.EOS_ID)
-        targets.append(text_encoder.EOS_ID)
-
         stats["num_wikis_written"] += 1
-        yield {
-            "inputs": inputs,
-            "targets": targets,
-            "section_boundaries": section_boundaries,
-        }
+        yield example
+    finally:
+      if pool is not None:
+        pool.terminate()
+        refs_pool.terminate()
 
     tf.logging.info("Total: %d, Skipped: %d",
                     stats["num_wikis_written"],
@@ -499,52 +633,100 @@ def _process_folders(tmp_dir):
   return tf.gfile.Glob(os.path.join(tmp_dir, PROCESS_FOLDER_PREFIX) + "*")
 
 
+def _wet_file_references(wet_file, metadata_dir, tmp_dir=None):
+  """Yields the references found in a WET file as they are read.
+
+  Args:
+    wet_file: path or URL of a WET file.
+    metadata_dir: directory of the metadata files of the WET files.
+    tmp_dir: directory to download the WET file to if wet_file is a URL.
+
+  Yields:
+    (list<int>, str), the reference shards and serialized Example of each
+    reference in the WET file.
+  """
+  # Read metadata file
+  metadata_fname = os.path.join(
+      metadata_dir, os.path.basename(wet_file)) + cc_utils.METADTA_SUFFIX
+  with tf.gfile.Open(cc_utils.readahead(metadata_fname)) as f:
+    wet_metadata = json.loads(f.read())
+
+  if not wet_metadata:
+    # No references in this WET file
+    return
+
+  if wet_file.startswith("http"):
+    # download
+    if not tmp_dir:
+      tmp_dir = tempfile.gettempdir()
+    record_gen = cc_utils.wet_records_from_url(wet_file, tmp_dir)
+  else:
+    # local
+    record_gen = cc_utils.wet_records(wet_file)
+
+  for wet_record in record_gen:
+    shard_ids = wet_metadata.get(
+        text_encoder.to_unicode_ignore_errors(wet_record.url))
+    if not shard_ids:
+      # URL not in dataset
+      continue
+
+    # Serialize
+    ex = _make_example_from_record(wet_record)
+    yield shard_ids, ex.SerializeToString()
+
+
+def _wet_file_references_in_worker(args):
+  return list(_wet_file_references(*args))
+
+
 def extract_references_from_wets(wet_files, metadata_dir, out_dir,
-                                 tmp_dir=None):
-  """Extract references from WET files into sharded output files."""
+                                 tmp_dir=None, num_workers=1,
+                                 max_pending=None):
+  """Extract references from WET files into sharded output files.
+
+  Args:
+    wet_files: list<str>, paths or URLs of WET files.
+    metadata_dir: directory of the metadata files of the WET files.
+    out_dir: directory to write the reference shards to.
+    tmp_dir: directory to download WET files to.
+    num_workers: int, number of processes reading WET files. The references
+      are written in the same order for any number of workers. With 1 they
+      are written as they are read.
+    max_pending: maximum number of WET files handed to the workers ahead of
+      the writer, whose references are held in memory. Defaults to twice
+      num_workers.
+  """
   # Setup output files
   shard_files = make_ref_shard_files(out_dir)
 
-  num_refs = 0
-  for i, wet_file in enumerate(wet_files):
-    num_refs_in_wet = 0
-    tf.logging.info("Processing file %d", i)
-
-    # Read metadata file
-    metadata_fname = os.path.join(
-        metadata_dir, os.path.basename(wet_file)) + cc_utils.METADTA_SUFFIX
-    with tf.gfile.Open(cc_utils.readahead(metadata_fname)) as f:
-      wet_metadata = json.loads(f.read())
-
-    if not wet_metadata:
-      # No references in this WET file
-      continue
+  pool = None
+  if num_workers > 1:
+    pool = multiprocessing.Pool(num_workers)
+    references_by_file = _ordered_imap(
+        pool, _wet_file_references_in_worker,
+        [(wet_file, metadata_dir, tmp_dir) for wet_file in wet_files],
+        max_pending or 2 * num_workers)
+  else:
+    references_by_file = (
+        _wet_file_references(wet_file, metadata_dir, tmp_dir)
+        for wet_file in wet_files)
 
-    if wet_file.startswith("http"):
-      # download
-      if not tmp_dir:
-        tmp_dir = tempfile.gettempdir()
-      record_gen = cc_utils.wet_records_from_url(wet_file, tmp_dir)
-    else:
-      # local
-      record_gen = cc_utils.wet_records_from_file_obj(
-          cc_utils.gzip_memfile(wet_file), take_ownership=True)
-
-    for wet_record in record_gen:
-      shard_ids = wet_metadata.get(wet_record.url)
-      if not shard_ids:
-        # URL not in dataset
-        continue
-
-      # Serialize and write out
-      ex = _make_example_from_record(wet_record)
-      ex_str = ex.SerializeToString()
-      for shard_id in shard_ids:
-        shard_files[shard_id].write(ex_str)
-      num_refs += 1
-      num_refs_in_wet += 1
-
-    tf.logging.info("Wrote out %d references for this WET", num_refs_in_wet)
+  num_refs = 0
+  try:
+    for i, references in enumerate(references_by_file):
+      tf.logging.info("Processing file %d", i)
+      num_refs_in_wet = 0
+      for shard_ids, ex_str in references:
+        for shard_id in shard_ids:
+          shard_files[shard_id].write(ex_str)
+        num_refs_in_wet += 1
+      num_refs += num_refs_in_wet
+      tf.logging.info("Wrote out %d references for this WET", num_refs_in_wet)
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
 
   tf.logging.info("Wrote out %d references total", num_refs)
 
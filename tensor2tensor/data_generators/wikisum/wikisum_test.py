@@ -0,0 +1,268 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for tensor2tensor.data_generators.wikisum.wikisum."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import math
+import os
+import time
+
+from tensor2tensor.data_generators import text_encoder
+from tensor2tensor.data_generators import tokenizer
+from tensor2tensor.data_generators.wikisum import utils
+from tensor2tensor.data_generators.wikisum import utils_test
+from tensor2tensor.data_generators.wikisum import wikisum
+
+import tensorflow as tf
+
+pkg_dir, _ = os.path.split(__file__)
+_TESTDATA = os.path.join(pkg_dir, "test_data")
+
+_WORDS = ("the river flows through a valley near old town where farmers grow "
+          "wheat and barley while the castle on the hill watches").split()
+
+
+def _sentence(seed, length=12):
+  return " ".join(_WORDS[(seed * 7 + i * 3) % len(_WORDS)]
+                  for i in range(length))
+
+
+def _bytes_feature(values):
+  return tf.train.Feature(bytes_list=tf.train.BytesList(
+      value=[tf.compat.as_bytes(v) for v in values]))
+
+
+def _write_dataset(tmp_dir, shard_ids, num_wikis=6, num_refs=3):
+  """Writes wikis, urls and references for shard_ids, returns the dirs."""
+  wikis_dir = os.path.join(tmp_dir, "wikis")
+  urls_dir = os.path.join(tmp_dir, "urls")
+  refs_dir = os.path.join(tmp_dir, "refs")
+  for d in [wikis_dir, urls_dir]:
+    tf.gfile.MakeDirs(d)
+  ref_writers = wikisum.make_ref_shard_files(
+      os.path.join(refs_dir, wikisum.PROCESS_FOLDER_PREFIX + "_0"))
+  texts = []
+  for shard_id in shard_ids:
+    urls = {}
+    wiki_path = os.path.join(wikis_dir, wikisum.WIKI_CONTENT_FILE % shard_id)
+    with tf.python_io.TFRecordWriter(wiki_path) as wiki_writer:
+      for i in range(num_wikis):
+        seed = shard_id * num_wikis + i
+        wiki_url = "http://wiki/%d" % seed
+        ref_urls = ["http://ref/%d/%d" % (seed, j) for j in range(num_refs)]
+        # Every third article has no references.
+        urls[wiki_url] = {"refs": ref_urls if i % 3 else []}
+        for j, ref_url in enumerate(ref_urls):
+          content = "\n".join(
+              _sentence(seed + j + k, length=20 + k) for k in range(4))
+          texts.append(content)
+          record = wikisum.cc_utils.WETRecord(
+              url=tf.compat.as_bytes(ref_url),
+              content=tf.compat.as_bytes(content))
+          ref_writers[shard_id].write(
+              wikisum._make_example_from_record(record).SerializeToString())
+        title = _sentence(seed, length=2)
+        section_texts = [_sentence(seed + k) for k in range(2)]
+        texts.extend([title] + section_texts)
+        features = {
+            "url": _bytes_feature([wiki_url]),
+            "title": _bytes_feature([title]),
+            "section_titles": _bytes_feature(["lead", "history"]),
+            "section_texts": _bytes_feature(section_texts),
+        }
+        wiki_writer.write(tf.train.Example(
+            features=tf.train.Features(feature=features)).SerializeToString())
+    with tf.gfile.Open(
+        os.path.join(urls_dir, wikisum.WIKI_URLS_FILE % shard_id), "w") as f:
+      f.write(json.dumps(urls))
+  for writer in ref_writers:
+    writer.close()
+
+  vocab = text_encoder.SubwordTextEncoder.build_from_generator(
+      texts + [wikisum.EOT], 100)
+  vocab_path = os.path.join(tmp_dir, "vocab")
+  vocab.store_to_file(vocab_path)
+  return wikis_dir, refs_dir, urls_dir, vocab_path
+
+
+def _test_references():
+  """References made of the paragraphs of test_data, in several orders."""
+  paragraphs = []
+  for path in sorted(tf.gfile.Glob(os.path.join(_TESTDATA, "para_*.txt"))):
+    with tf.gfile.Open(path) as f:
+      paragraphs.extend(f.read().split("\n"))
+  return ["\n".join(paragraphs[i::3] + paragraphs[:i]) for i in range(3)]
+
+
+def _rank_reference_paragraphs_loop(wiki_title, references_content):
+  """Scores paragraphs one by one, as rank_reference_paragraphs used to."""
+  normalized_title = wikisum._normalize_text(wiki_title)
+  title_tokens = wikisum._tokens_to_score(
+      set(tokenizer.encode(text_encoder.native_to_unicode(normalized_title))))
+  ref_paragraph_info = []
+  doc_counts = collections.defaultdict(int)
+  for ref in references_content:
+    for paragraph in ref.split("\n"):
+      normalized_paragraph = wikisum._normalize_text(paragraph)
+      if utils.filter_paragraph(normalized_paragraph):
+        continue
+      counts = collections.defaultdict(int)
+      for token in tokenizer.encode(
+          text_encoder.native_to_unicode(normalized_paragraph)):
+        if token in title_tokens:
+          counts[token] += 1
+      for token in title_tokens:
+        if counts[token]:
+          doc_counts[token] += 1
+      ref_paragraph_info.append(
+          {"content": normalized_paragraph, "counts": counts})
+
+  for info in ref_paragraph_info:
+    score = 0.
+    for token in title_tokens:
+      inv_doc_frequency = (
+          float(len(ref_paragraph_info)) / max(doc_counts[token], 1))
+      score += info["counts"][token] * math.log(inv_doc_frequency)
+    info["score"] = score
+
+  ref_paragraph_info.sort(key=lambda el: el["score"], reverse=True)
+  return [info["content"] for info in ref_paragraph_info]
+
+
+_TEST_TITLES = ["Schloss Itter", "The castle", "lee's tank (1945)",
+                "no matching words", ""]
+
+
+def _example_values(serialized):
+  example = tf.train.Example.FromString(serialized)
+  return {key: list(feature.int64_list.value)
+          for key, feature in example.features.feature.items()}
+
+
+class WikisumTest(tf.test.TestCase):
+
+  def testRankReferenceParagraphs(self):
+    references = _test_references()
+    for title in _TEST_TITLES:
+      expected = _rank_reference_paragraphs_loop(title, references)
+      self.assertTrue(expected)
+      self.assertEqual(
+          expected, wikisum.rank_reference_paragraphs(title, references))
+      for max_paragraphs in [0, 1, 3, len(expected), len(expected) + 1]:
+        self.assertEqual(
+            expected[:max_paragraphs],
+            wikisum.rank_reference_paragraphs(
+                title, references, max_paragraphs=max_paragraphs))
+
+  def testRankReferenceParagraphsNoParagraphs(self):
+    self.assertEqual([], wikisum.rank_reference_paragraphs("title", ["a b"]))
+
+  def testProduceExamplesWithWorkers(self):
+    tmp_dir = self.get_temp_dir()
+    shard_ids = [0, 1, 2]
+    wikis_dir, refs_dir, urls_dir, vocab_path = _write_dataset(
+        tmp_dir, shard_ids)
+
+    records = []
+    for num_workers in [1, 3]:
+      out_dir = os.path.join(tmp_dir, "out_%d" % num_workers)
+      tf.gfile.MakeDirs(out_dir)
+      out_filepaths = [os.path.join(out_dir, "examples-%d" % i)
+                       for i in range(2)]
+      wikisum.produce_examples(
+          shard_ids, wikis_dir, refs_dir, urls_dir, vocab_path, out_filepaths,
+          num_workers=num_workers, max_pending=2)
+      records.append([[_example_values(record)
+                       for record in tf.python_io.tf_record_iterator(path)]
+                      for path in out_filepaths])
+      with tf.gfile.Open(os.path.join(out_dir, "stats.0.json")) as f:
+        stats = json.loads(f.read())
+      self.assertEqual(stats["total_original_wikis"], 18)
+      self.assertEqual(stats["wikis_skipped_no_refs"], 6)
+      self.assertEqual(stats["num_wikis_written"], 12)
+
+    self.assertEqual(sum(len(shard) for shard in records[0]), 12)
+    self.assertEqual(records[0], records[1])
+
+  def testExtractReferencesFromWetsWithWorkers(self):
+    tmp_dir = self.get_temp_dir()
+    wet_dir = os.path.join(tmp_dir, "wets")
+    metadata_dir = os.path.join(tmp_dir, "metadata")
+    for d in [wet_dir, metadata_dir]:
+      tf.gfile.MakeDirs(d)
+    wet_files = []
+    for i in range(4):
+      wet_file = os.path.join(wet_dir, "file%d.warc.wet.gz" % i)
+      records = [(tf.compat.as_bytes("http://ref/%d/%d" % (i, j)),
+                  tf.compat.as_bytes(_sentence(i + j))) for j in range(5)]
+      utils_test.write_wet_file(wet_file, records)
+      # References 0 and 2 of every file are in shards i and 7.
+      metadata = {"http://ref/%d/%d" % (i, j): [i, 7] for j in [0, 2]}
+      with tf.gfile.Open(os.path.join(
+          metadata_dir,
+          os.path.basename(wet_file) + utils.METADTA_SUFFIX), "w") as f:
+        f.write(json.dumps(metadata))
+      wet_files.append(wet_file)
+
+    shards = []
+    for num_workers in [1, 3]:
+      out_dir = os.path.join(tmp_dir, "refs_%d" % num_workers)
+      wikisum.extract_references_from_wets(
+          wet_files, metadata_dir, out_dir, num_workers=num_workers,
+          max_pending=2)
+      contents = wikisum._references_content(
+          [os.path.join(out_dir, wikisum.REF_SHARD_FILE % shard_id)
+           for shard_id in [0, 1, 2, 3, 7, 8]])
+      self.assertEqual(8, len(contents))
+      self.assertEqual(_sentence(1 + 2), contents["http://ref/1/2"])
+      shards.append([
+          [tf.train.Example.FromString(record)
+           for record in tf.python_io.tf_record_iterator(
+              os.path.join(out_dir, wikisum.REF_SHARD_FILE % shard_id),
+              tf.python_io.TFRecordOptions(
+                  tf.python_io.TFRecordCompressionType.GZIP))]
+          for shard_id in [0, 3, 7]])
+    self.assertEqual([2, 2, 8], [len(shard) for shard in shards[0]])
+    self.assertEqual(shards[0], shards[1])
+
+
+class RankReferenceParagraphsBenchmark(tf.test.Benchmark):
+  """Run with --benchmarks=RankReferenceParagraphsBenchmark."""
+
+  def _benchmark(self, name, rank_fn, iters=200):
+    references = _test_references() * 10
+    rank_fn(_TEST_TITLES[0], references)
+    start = time.time()
+    for i in range(iters):
+      rank_fn(_TEST_TITLES[i % len(_TEST_TITLES)], references)
+    self.report_benchmark(
+        iters=iters, wall_time=(time.time() - start) / iters, name=name)
+
+  def benchmarkRankReferenceParagraphs(self):
+    self._benchmark("rank_reference_paragraphs",
+                    wikisum.rank_reference_paragraphs)
+
+  def benchmarkRankReferenceParagraphsLoop(self):
+    self._benchmark("rank_reference_paragraphs_loop",
+                    _rank_reference_paragraphs_loop)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -1099,6 +1099,32 @@ def combine_first_two_dimensions(x):
   return ret
 
 
+@expert_utils.add_name_scope()
+def update_preallocated_cache(cache_tensor, x, step):
+  """Writes one position of a preallocated attention cache in place.
+
+  The cache is viewed as a matrix with one row per batch, head and position,
+  so the rows of position step are updated directly, without transposing the
+  cache or touching the other positions.
+
+  Args:
+    cache_tensor: a Tensor with shape [batch, heads, length, channels]. It is
+      updated in place, so it must have no other consumers.
+    x: a Tensor with shape [batch, heads, 1, channels]
+    step: an integer scalar, the position to write.
+
+  Returns:
+    a Tensor with the same shape as cache_tensor.
+  """
+  shape = common_layers.shape_list(cache_tensor)
+  batch, heads, length, channels = shape
+  rows = tf.range(batch * heads) * length + step
+  flat_cache = common_layers.tf_inplace_ops().alias_inplace_update(
+      tf.reshape(cache_tensor, [-1, channels]), rows,
+      tf.reshape(x, [-1, channels]))
+  return tf.reshape(flat_cache, shape)
+
+
 @expert_utils.add_name_scope()
 def split_heads(x, num_heads):
   """Split channels (dimension 2) into multiple heads (becomes dimension 1).
@@ -3232,6 +3258,9 @@ def multihead_attention(query_antecedent,
            should be empty Tensors of the appropriate shape.
                'k' [batch_size, 0, key_channels]
                'v' [batch_size, 0, value_channels]
+           If decode_loop_step or preallocated_cache_step is passed in kwargs,
+           'k' and 'v' are instead preallocated for the full decode length
+           and the current step is written in place at that position.
     gap_size: Integer option for dilated attention to indicate spacing between
               memory blocks.
     num_memory_blocks: Integer option to indicate how many memory blocks to look
@@ -3306,7 +3335,17 @@ def multihead_attention(query_antecedent,
         k = split_heads(k, num_heads)
         v = split_heads(v, num_heads)
         decode_loop_step = kwargs.get("decode_loop_step")
-        if decode_loop_step is None:
+        preallocated_cache_step = kwargs.get("preallocated_cache_step")
+        if preallocated_cache_step is not None:
+          cache["k"] = update_preallocated_cache(
+              cache["k"], k, preallocated_cache_step)
+          cache["v"] = update_preallocated_cache(
+              cache["v"], v, preallocated_cache_step)
+          # Only the positions decoded so far are attended over, so the bias
+          # must cover preallocated_cache_step + 1 positions.
+          k = cache["k"][:, :, :preallocated_cache_step + 1]
+          v = cache["v"][:, :, :preallocated_cache_step + 1]
+        elif decode_loop_step is None:
           k = cache["k"] = tf.concat([cache["k"], k], axis=2)
           v = cache["v"] = tf.concat([cache["v"], v], axis=2)
         else:
@@ -158,6 +158,50 @@ class CommonAttentionTest(tf.test.TestCase):
     self.assertAllClose(dnorm_bias, dnorm_bias_f)
     self.assertAllClose(dx, dx_f)
 
+  def testMultiheadAttentionPreallocatedCache(self):
+    batch = 2
+    num_heads = 2
+    depth = 8
+    decode_length = 16
+    steps = 3
+    x = tf.to_float(np.random.rand(batch, steps, depth))
+    bias = common_attention.attention_bias_lower_triangle(decode_length)
+
+    def attend(i, cache, preallocated, weights):
+      with tf.variable_scope("self_attention", reuse=tf.AUTO_REUSE):
+        return common_attention.multihead_attention(
+            x[:, i:i + 1], None, bias[:, :, i:i + 1, :i + 1], depth, depth,
+            depth, num_heads, 0.0, cache=cache, save_weights_to=weights,
+            preallocated_cache_step=tf.constant(i) if preallocated else None)
+
+    shape = [batch, num_heads, 0, depth // num_heads]
+    concat_cache = {"k": tf.zeros(shape), "v": tf.zeros(shape)}
+    # The preallocated cache is written in place, so it needs fresh buffers.
+    shape[2] = decode_length
+    preallocated_cache = {
+        "k": common_layers.tf_inplace_ops().empty(shape, tf.float32),
+        "v": common_layers.tf_inplace_ops().empty(shape, tf.float32),
+    }
+    concat_outputs = []
+    preallocated_outputs = []
+    preallocated_weights = []
+    for i in range(steps):
+      concat_outputs.append(attend(i, concat_cache, False, {}))
+      weights = {}
+      preallocated_outputs.append(attend(i, preallocated_cache, True, weights))
+      preallocated_weights.extend(
+          w for name, w in weights.items() if not name.endswith("/logits"))
+    self.assertEqual(preallocated_cache["k"].shape.as_list()[2], decode_length)
+    with self.test_session() as session:
+      session.run(tf.global_variables_initializer())
+      concat_res, preallocated_res, weights_res = session.run(
+          [concat_outputs, preallocated_outputs, preallocated_weights])
+    self.assertAllClose(concat_res, preallocated_res)
+    # Step i computes attention logits over the i + 1 positions decoded so far
+    # only, rather than over all decode_length preallocated positions.
+    self.assertEqual([w.shape for w in weights_res],
+                     [(batch, num_heads, 1, i + 1) for i in range(steps)])
+
   def test2dGatherAndScatterInvertibility(self):
     """2d gather and scatter invertibility test."""
     batch_size = 2
@@ -91,6 +91,15 @@ def basic_params1():
       sampling_temp=1.0,  # temperature for sampling
       # expand the logits a piece at a time - saves memory.
       factored_logits=False,
+      # Number of ids sampled per batch by the "sampled_softmax" symbol
+      # modality during training.
+      sampled_softmax_num_samples=8192,
+      # Comma-separated cluster boundaries of the "adaptive_softmax" symbol
+      # modality. Ids below the first cutoff are in the head, the others in
+      # tail clusters. Cutoffs not below the vocab size are ignored.
+      adaptive_softmax_cutoffs="20000,60000",
+      # The i-th tail cluster projects to hidden_size / factor**(i+1).
+      adaptive_softmax_tail_factor=4,
       multiply_embedding_mode="sqrt_depth",
       # Parameters related to mixtures of experts.
       moe_hidden_sizes="2048",  # hidden layer sizes (comma-separated)
@@ -1633,8 +1633,27 @@ def sepconv_relu_sepconv(inputs,
                          padding="LEFT",
                          nonpadding_mask=None,
                          dropout=0.0,
-                         name=None):
-  """Hidden layer with RELU activation followed by linear projection."""
+                         name=None,
+                         cache=None):
+  """Hidden layer with RELU activation followed by linear projection.
+
+  Args:
+    inputs: A tensor.
+    filter_size: An integer.
+    output_size: An integer.
+    first_kernel_size: A pair of integers.
+    second_kernel_size: A pair of integers.
+    padding: A string.
+    nonpadding_mask: A tensor.
+    dropout: A float.
+    name: A string.
+    cache: A dict, containing the last inputs of both convolutions with shapes
+        [batch, length, 1, depth] under "f" and "h", used for fast decoding
+        with "LEFT" padding. inputs then only holds the new positions.
+
+  Returns:
+    A Tensor.
+  """
   with tf.variable_scope(name, "sepconv_relu_sepconv", [inputs]):
     inputs = maybe_zero_out_padding(inputs, first_kernel_size, nonpadding_mask)
     if inputs.get_shape().ndims == 3:
@@ -1642,6 +1661,10 @@ def sepconv_relu_sepconv(inputs,
       inputs = tf.expand_dims(inputs, 2)
     else:
       is_3d = False
+    length = shape_list(inputs)[1]
+    if cache is not None:
+      inputs = tf.concat([cache["f"], inputs], axis=1)
+      cache["f"] = inputs[:, -first_kernel_size[0]:]
     h = separable_conv(
         inputs,
         filter_size,
@@ -1649,11 +1672,18 @@ def sepconv_relu_sepconv(inputs,
         activation=tf.nn.relu,
         padding=padding,
         name="conv1")
+    if cache is not None:
+      h = h[:, -length:]
     if dropout != 0.0:
       h = tf.nn.dropout(h, 1.0 - dropout)
     h = maybe_zero_out_padding(h, second_kernel_size, nonpadding_mask)
+    if cache is not None:
+      h = tf.concat([cache["h"], h], axis=1)
+      cache["h"] = h[:, -second_kernel_size[0]:]
     ret = separable_conv(
         h, output_size, second_kernel_size, padding=padding, name="conv2")
+    if cache is not None:
+      ret = ret[:, -length:]
     if is_3d:
       ret = tf.squeeze(ret, 2)
     return ret
@@ -2834,6 +2864,175 @@ def padded_cross_entropy_factored(factored_logits,
     return tf.reduce_sum(xent * weights), tf.reduce_sum(weights)
 
 
+def padded_sampled_softmax_cross_entropy(factored_logits,
+                                         labels,
+                                         num_samples,
+                                         weights_fn=weights_nonzero,
+                                         reduce_sum=True):
+  """Sampled softmax cross-entropy.
+
+  Only computes the logits of the labels and of num_samples ids sampled from a
+  log-uniform distribution, which assumes ids are sorted by frequency.
+
+  Args:
+    factored_logits: a `FactoredTensor` representing a Tensor
+       with shape `[batch, timesteps, vocab_size]`.
+    labels: an integer `Tensor` with shape `[batch, timesteps]`.
+    num_samples: an integer, the number of ids to sample.
+    weights_fn: A function from labels to weights.
+    reduce_sum: a Boolean, whether to sum at the end or not.
+
+  Returns:
+    loss_numerator: a `Scalar`.  Sum of losses.
+    loss_denominator: a `Scalar.  The number of non-padding target tokens.
+  """
+  a = factored_logits.a
+  b = factored_logits.b
+  vocab_size = shape_list(b)[0]
+  with tf.name_scope("padded_sampled_softmax_cross_entropy",
+                     values=[a, b, labels]):
+    labels_flat = tf.to_int64(tf.reshape(labels, [-1, 1]))
+    a_flat = tf.reshape(a, [-1, shape_list(b)[1]])
+    xent = tf.nn.sampled_softmax_loss(
+        weights=b,
+        biases=tf.zeros([vocab_size]),
+        labels=labels_flat,
+        inputs=a_flat,
+        num_sampled=min(num_samples, vocab_size),
+        num_classes=vocab_size)
+    xent = tf.reshape(xent, shape_list(labels))
+    weights = weights_fn(labels)
+    if not reduce_sum:
+      return xent * weights, weights
+    return tf.reduce_sum(xent * weights), tf.reduce_sum(weights)
+
+
+class AdaptiveSoftmaxTensor(object):
+  """Log-probabilities of an adaptive softmax, https://arxiv.org/abs/1609.04309.
+
+  The vocabulary is split at the cutoffs into a head and tail clusters. The
+  head softmax covers the head ids and one id per tail cluster; the tail
+  clusters have their own softmax on a projection of the inputs to a smaller
+  depth. The log-probability of a tail id is that of its cluster in the head
+  plus its log-probability within the cluster.
+
+  Like `FactoredTensor`, this stores the factors rather than the product, so
+  that the loss can avoid realizing the full [..., vocab_size] Tensor.
+  """
+
+  def __init__(self, a, head, tails, cutoffs):
+    """Creates an AdaptiveSoftmaxTensor.
+
+    Args:
+      a: a Tensor with shape [..., inner_dim].
+      head: a Tensor with shape [cutoffs[0] + len(tails), inner_dim].
+      tails: a list of (projection, weights) pairs of Tensors with shapes
+        [inner_dim, tail_dim] and [cluster_size, tail_dim].
+      cutoffs: a list of len(tails) + 1 integers, the first id of each tail
+        cluster followed by the vocab size.
+    """
+    self._a = a
+    self._head = head
+    self._tails = tails
+    self._cutoffs = cutoffs
+
+  @property
+  def a(self):
+    return self._a
+
+  @property
+  def head(self):
+    return self._head
+
+  @property
+  def tails(self):
+    return self._tails
+
+  @property
+  def cutoffs(self):
+    return self._cutoffs
+
+  def to_tensor(self):
+    """Convert to a Tensor of log-probabilities."""
+    a_shape = shape_list(self.a)
+    flat_a = tf.reshape(self.a, [-1, a_shape[-1]])
+    head_log_probs = log_prob_from_logits(
+        tf.matmul(flat_a, self.head, transpose_b=True))
+    head_size = self.cutoffs[0]
+    parts = [head_log_probs[:, :head_size]]
+    for i, (projection, weights) in enumerate(self.tails):
+      tail_logits = tf.matmul(
+          tf.matmul(flat_a, projection), weights, transpose_b=True)
+      parts.append(
+          log_prob_from_logits(tail_logits) +
+          head_log_probs[:, head_size + i:head_size + i + 1])
+    return tf.reshape(tf.concat(parts, 1), a_shape[:-1] + [self.cutoffs[-1]])
+
+
+def _convert_adaptive_softmax_tensor_to_tensor(value, *args, **kwargs):
+  return ops.internal_convert_to_tensor(value.to_tensor(), *args, **kwargs)
+
+
+tf.register_tensor_conversion_function(
+    AdaptiveSoftmaxTensor, _convert_adaptive_softmax_tensor_to_tensor)
+
+
+def padded_cross_entropy_adaptive(adaptive_logits,
+                                  labels,
+                                  weights_fn=weights_nonzero,
+                                  reduce_sum=True):
+  """Adaptive softmax cross-entropy.
+
+  The logits of each tail cluster are only computed for the positions whose
+  label is in that cluster.
+
+  Args:
+    adaptive_logits: an `AdaptiveSoftmaxTensor` representing a Tensor
+       with shape `[batch, timesteps, vocab_size]`.
+    labels: an integer `Tensor` with shape `[batch, timesteps]`.
+    weights_fn: A function from labels to weights.
+    reduce_sum: a Boolean, whether to sum at the end or not.
+
+  Returns:
+    loss_numerator: a `Scalar`.  Sum of losses.
+    loss_denominator: a `Scalar.  The number of non-padding target tokens.
+  """
+  a = adaptive_logits.a
+  cutoffs = adaptive_logits.cutoffs
+  head_size = cutoffs[0]
+  with tf.name_scope("padded_cross_entropy_adaptive", values=[a, labels]):
+    labels_flat = tf.to_int32(tf.reshape(labels, [-1]))
+    a_flat = tf.reshape(a, [-1, shape_list(a)[-1]])
+    head_labels = labels_flat
+    tail_xents = []
+    for i, (projection, weights) in enumerate(adaptive_logits.tails):
+      in_cluster = tf.logical_and(labels_flat >= cutoffs[i],
+                                  labels_flat < cutoffs[i + 1])
+      head_labels = tf.where(in_cluster,
+                             tf.fill(tf.shape(labels_flat), head_size + i),
+                             head_labels)
+      positions = tf.to_int32(tf.where(in_cluster))
+      tail_logits = tf.matmul(
+          tf.matmul(tf.gather_nd(a_flat, positions), projection),
+          weights,
+          transpose_b=True)
+      tail_xent = tf.nn.sparse_softmax_cross_entropy_with_logits(
+          labels=tf.gather_nd(labels_flat, positions) - cutoffs[i],
+          logits=tail_logits)
+      tail_xents.append(
+          tf.scatter_nd(positions, tail_xent, tf.shape(labels_flat)))
+    head_logits = tf.matmul(a_flat, adaptive_logits.head, transpose_b=True)
+    xent = tf.add_n([
+        tf.nn.sparse_softmax_cross_entropy_with_logits(
+            labels=head_labels, logits=head_logits)
+    ] + tail_xents)
+    xent = tf.reshape(xent, shape_list(labels))
+    weights = weights_fn(labels)
+    if not reduce_sum:
+      return xent * weights, weights
+    return tf.reduce_sum(xent * weights), tf.reduce_sum(weights)
+
+
 def fn_with_custom_grad(grad_fn, use_global_vars=False):
   """Decorator to create a subgraph with a custom gradient function.
 
@@ -3095,6 +3294,71 @@ def sample_with_temperature(logits, temperature):
     return choices
 
 
+def vocab_shortlist(source_ids, num_frequent, lexicon=None):
+  """Builds per-example candidate target ids for a restricted softmax.
+
+  The shortlist of each example starts with the ids 0..num_frequent-1, so that
+  reserved ids such as PAD and EOS keep their values, followed by the source
+  ids, or by their translations in lexicon if it is given. Source ids are used
+  as is without a lexicon, which assumes inputs and targets share a vocabulary.
+  Candidates already in the shortlist are masked out by the returned bias so
+  that no id gets counted twice in the softmax.
+
+  Args:
+    source_ids: an int Tensor with shape [batch, length], 0 for padding.
+    num_frequent: an integer, number of most frequent target ids to include.
+      Assumes ids are sorted by decreasing frequency, as in the vocabularies
+      built by text_encoder.
+    lexicon: an optional int Tensor with shape [source_vocab_size, k] holding
+      the k most likely target ids for each source id.
+
+  Returns:
+    shortlist: an int32 Tensor with shape [batch, shortlist_size].
+    bias: a float Tensor with shape [batch, shortlist_size], 0.0 for valid
+      candidates and -1e9 for duplicates, to be added to the logits.
+  """
+  source_ids = tf.to_int32(source_ids)
+  batch_size = shape_list(source_ids)[0]
+  candidates = source_ids
+  if lexicon is not None:
+    candidates = tf.gather(lexicon, source_ids)
+    # Do not translate padding.
+    candidates *= tf.expand_dims(tf.to_int32(tf.not_equal(source_ids, 0)), -1)
+    candidates = tf.reshape(candidates, [batch_size, -1])
+  # Sort the candidates so that duplicates end up next to each other.
+  candidates, _ = tf.nn.top_k(candidates, k=shape_list(candidates)[1])
+  is_duplicate = tf.concat(
+      [tf.zeros([batch_size, 1], dtype=tf.bool),
+       tf.equal(candidates[:, 1:], candidates[:, :-1])], axis=1)
+  is_valid = tf.logical_and(
+      tf.greater_equal(candidates, num_frequent), tf.logical_not(is_duplicate))
+  shortlist = tf.concat(
+      [tf.tile(tf.expand_dims(tf.range(num_frequent), 0), [batch_size, 1]),
+       candidates], axis=1)
+  bias = tf.concat(
+      [tf.zeros([batch_size, num_frequent]),
+       (1.0 - tf.to_float(is_valid)) * -1e9], axis=1)
+  return shortlist, bias
+
+
+def gather_from_shortlist(shortlist, ids):
+  """Maps ids indexing the shortlist of each example to vocabulary ids.
+
+  Args:
+    shortlist: an int Tensor with shape [batch, shortlist_size].
+    ids: an int Tensor with shape [batch, ...] of indices into shortlist.
+
+  Returns:
+    a Tensor with the shape and dtype of ids.
+  """
+  ids_shape = shape_list(ids)
+  flat_ids = tf.to_int32(tf.reshape(ids, [ids_shape[0], -1]))
+  batch_ids = tf.tile(
+      tf.expand_dims(tf.range(ids_shape[0]), 1), [1, shape_list(flat_ids)[1]])
+  vocab_ids = tf.gather_nd(shortlist, tf.stack([batch_ids, flat_ids], axis=2))
+  return tf.cast(tf.reshape(vocab_ids, ids_shape), ids.dtype)
+
+
 def ones_matrix_band_part(rows, cols, num_lower, num_upper, out_shape=None):
   """Matrix band part of ones."""
   if all([isinstance(el, int) for el in [rows, cols, num_lower, num_upper]]):
@@ -167,6 +167,144 @@ class SymbolModality(modality.Modality):
           return tf.reshape(logits,
                             body_output_shape[:-1] + [1, self._vocab_size])
 
+  def top_with_shortlist(self, body_output, shortlist):
+    """Generate logits for a per-example subset of the vocabulary.
+
+    Only computes the logits of the candidate ids in the shortlist, which is
+    much cheaper than top() at inference time for large vocabularies.
+
+    Args:
+      body_output: A Tensor with shape [batch, p0, p1, body_input_depth]
+      shortlist: An int Tensor with shape [batch, shortlist_size] of candidate
+        ids, see common_layers.vocab_shortlist().
+    Returns:
+      logits: A Tensor with shape [batch, p0, p1, 1, shortlist_size], where the
+        last dimension corresponds to the ids in shortlist.
+    """
+    if self._model_hparams.shared_embedding_and_softmax_weights:
+      scope_name = "shared"
+      reuse = True
+    else:
+      scope_name = "softmax"
+      reuse = False
+
+    with tf.variable_scope(scope_name, reuse=reuse):
+      body_output_shape = common_layers.shape_list(body_output)
+      var = self._get_weights(body_output_shape[-1])
+      shortlist_var = tf.gather(var, shortlist)
+      body_output = tf.reshape(
+          body_output, [body_output_shape[0], -1, body_output_shape[-1]])
+      logits = tf.matmul(body_output, shortlist_var, transpose_b=True)
+      return tf.reshape(
+          logits, body_output_shape[:-1] +
+          [1, common_layers.shape_list(shortlist)[1]])
+
+
+@registry.register_symbol_modality("sampled_softmax")
+class SymbolModalitySampledSoftmax(SymbolModality):
+  """SymbolModality trained with a sampled softmax.
+
+  During training the loss only computes the logits of the targets and of
+  hparams.sampled_softmax_num_samples sampled ids, so the logits for the whole
+  vocabulary are never realized. Ids are sampled log-uniformly, which assumes
+  they are sorted by frequency. Label smoothing is not applied to the sampled
+  loss. Evaluation and inference use the full softmax.
+  """
+
+  def top(self, body_output, targets):
+    if (self._model_hparams.mode != tf.estimator.ModeKeys.TRAIN or
+        self._model_hparams.symbol_modality_skip_top):
+      return super(SymbolModalitySampledSoftmax, self).top(body_output, targets)
+
+    if self._model_hparams.shared_embedding_and_softmax_weights:
+      scope_name = "shared"
+      reuse = True
+    else:
+      scope_name = "softmax"
+      reuse = False
+
+    with tf.variable_scope(scope_name, reuse=reuse):
+      var = self._get_weights(common_layers.shape_list(body_output)[-1])
+      return common_layers.FactoredTensor(tf.expand_dims(body_output, 3), var)
+
+  def loss(self, top_out, targets):
+    if not isinstance(top_out, common_layers.FactoredTensor):
+      return super(SymbolModalitySampledSoftmax, self).loss(top_out, targets)
+    return common_layers.padded_sampled_softmax_cross_entropy(
+        top_out,
+        targets,
+        self._model_hparams.sampled_softmax_num_samples,
+        weights_fn=self.targets_weights_fn)
+
+
+@registry.register_symbol_modality("adaptive_softmax")
+class SymbolModalityAdaptiveSoftmax(SymbolModality):
+  """SymbolModality with an adaptive softmax output.
+
+  The vocabulary is split at hparams.adaptive_softmax_cutoffs into a head and
+  tail clusters with progressively smaller projections, see
+  common_layers.AdaptiveSoftmaxTensor. During training the logits of a tail
+  cluster are only computed for the targets in that cluster. Label smoothing
+  is not applied. The softmax weights are not shared with the embedding.
+  """
+
+  @property
+  def cutoffs(self):
+    cutoffs = [
+        int(c) for c in self._model_hparams.adaptive_softmax_cutoffs.split(",")
+        if c and 0 < int(c) < self._vocab_size
+    ]
+    return cutoffs + [self._vocab_size]
+
+  def top(self, body_output, _):
+    """Generate log-probabilities.
+
+    Args:
+      body_output: A Tensor with shape [batch, p0, p1, body_input_depth]
+    Returns:
+      An AdaptiveSoftmaxTensor during training, otherwise log-probabilities
+      with shape [batch, p0, p1, 1, vocab_size].
+
+    Raises:
+      ValueError: if the softmax weights are shared with the embedding.
+    """
+    if self._model_hparams.symbol_modality_skip_top:
+      return tf.expand_dims(body_output, 3)
+    if self._model_hparams.shared_embedding_and_softmax_weights:
+      raise ValueError("The adaptive softmax can not share its weights with "
+                       "the embedding.")
+
+    cutoffs = self.cutoffs
+    with tf.variable_scope("softmax"):
+      hidden_dim = common_layers.shape_list(body_output)[-1]
+      head = tf.get_variable(
+          "head", [cutoffs[0] + len(cutoffs) - 1, hidden_dim],
+          initializer=tf.random_normal_initializer(0.0, hidden_dim**-0.5))
+      tails = []
+      for i in range(len(cutoffs) - 1):
+        tail_dim = max(
+            1, hidden_dim //
+            (self._model_hparams.adaptive_softmax_tail_factor**(i + 1)))
+        projection = tf.get_variable(
+            "tail_projection_%d" % i, [hidden_dim, tail_dim],
+            initializer=tf.random_normal_initializer(0.0, hidden_dim**-0.5))
+        weights = tf.get_variable(
+            "tail_weights_%d" % i, [cutoffs[i + 1] - cutoffs[i], tail_dim],
+            initializer=tf.random_normal_initializer(0.0, tail_dim**-0.5))
+        tails.append((projection, weights))
+      log_probs = common_layers.AdaptiveSoftmaxTensor(
+          tf.expand_dims(body_output, 3), head, tails, cutoffs)
+      if self._model_hparams.mode == tf.estimator.ModeKeys.TRAIN:
+        return log_probs
+      return log_probs.to_tensor()
+
+  def loss(self, top_out, targets):
+    if not isinstance(top_out, common_layers.AdaptiveSoftmaxTensor):
+      return common_layers.padded_cross_entropy(
+          top_out, targets, 0.0, weights_fn=self.targets_weights_fn)
+    return common_layers.padded_cross_entropy_adaptive(
+        top_out, targets, weights_fn=self.targets_weights_fn)
+
 
 @registry.register_symbol_modality("weights_all")
 class SymbolModalityWeightsAll(SymbolModality):
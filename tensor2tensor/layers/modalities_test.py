@@ -19,6 +19,7 @@ from __future__ import print_function
 import numpy as np
 
 from tensor2tensor.layers import common_hparams
+from tensor2tensor.layers import common_layers
 from tensor2tensor.layers import modalities
 from tensor2tensor.utils import expert_utils
 
@@ -110,6 +111,89 @@ class ModalityTest(tf.test.TestCase):
     self.assertEqual(res1.shape, (batch_size, length, height, 1, vocab_size))
     self.assertEqual(res2.shape, ())
 
+  def testSymbolModalityTopWithShortlist(self):
+    batch_size = 4
+    length = 3
+    hidden_size = 9
+    vocab_size = 11
+    model_hparams = common_hparams.basic_params1()
+    model_hparams.hidden_size = hidden_size
+    model_hparams.mode = tf.estimator.ModeKeys.PREDICT
+    body_output = np.random.random_sample(
+        (batch_size, length, 1, hidden_size)).astype(np.float32)
+    shortlist = np.array(
+        [np.random.permutation(vocab_size)[:5] for _ in range(batch_size)],
+        dtype=np.int32)
+    m = modalities.SymbolModality(model_hparams, vocab_size)
+    with self.test_session() as session:
+      with tf.variable_scope("symbol", reuse=tf.AUTO_REUSE):
+        logits = m.top(tf.constant(body_output), None)
+        shortlist_logits = m.top_with_shortlist(
+            tf.constant(body_output), tf.constant(shortlist))
+      session.run(tf.global_variables_initializer())
+      res1, res2 = session.run((logits, shortlist_logits))
+    self.assertEqual(res2.shape, (batch_size, length, 1, 1, 5))
+    for b in range(batch_size):
+      self.assertAllClose(res1[b][..., shortlist[b]], res2[b])
+
+  def testSymbolModalitySampledSoftmax(self):
+    batch_size = 4
+    length = 6
+    hidden_size = 9
+    vocab_size = 50
+    model_hparams = common_hparams.basic_params1()
+    model_hparams.hidden_size = hidden_size
+    model_hparams.sampled_softmax_num_samples = 10
+    model_hparams.mode = tf.estimator.ModeKeys.TRAIN
+    body_output = np.random.random_sample(
+        (batch_size, length, 1, hidden_size)).astype(np.float32)
+    targets = -1 + np.random.random_integers(
+        vocab_size, size=(batch_size, length, 1, 1))
+    m = modalities.SymbolModalitySampledSoftmax(model_hparams, vocab_size)
+    with self.test_session() as session:
+      with tf.variable_scope("symbol"):
+        top_out = m.top(tf.constant(body_output), None)
+        loss_num, loss_den = m.loss(top_out, tf.constant(targets))
+      model_hparams.mode = tf.estimator.ModeKeys.EVAL
+      with tf.variable_scope("symbol", reuse=True):
+        logits = m.top(tf.constant(body_output), None)
+      session.run(tf.global_variables_initializer())
+      res1, res2, res3 = session.run((loss_num, loss_den, logits))
+    self.assertIsInstance(top_out, common_layers.FactoredTensor)
+    self.assertTrue(np.isfinite(res1))
+    self.assertEqual(res2, np.count_nonzero(targets))
+    self.assertEqual(res3.shape, (batch_size, length, 1, 1, vocab_size))
+
+  def testSymbolModalityAdaptiveSoftmax(self):
+    batch_size = 4
+    length = 6
+    hidden_size = 16
+    vocab_size = 30
+    model_hparams = common_hparams.basic_params1()
+    model_hparams.hidden_size = hidden_size
+    model_hparams.adaptive_softmax_cutoffs = "10,20,100"
+    model_hparams.mode = tf.estimator.ModeKeys.TRAIN
+    body_output = np.random.random_sample(
+        (batch_size, length, 1, hidden_size)).astype(np.float32)
+    targets = -1 + np.random.random_integers(
+        vocab_size, size=(batch_size, length, 1, 1))
+    m = modalities.SymbolModalityAdaptiveSoftmax(model_hparams, vocab_size)
+    self.assertEqual(m.cutoffs, [10, 20, vocab_size])
+    with self.test_session() as session:
+      top_out = m.top(tf.constant(body_output), None)
+      loss_num, loss_den = m.loss(top_out, tf.constant(targets))
+      # The loss matches the cross-entropy of the full log-probabilities.
+      full_loss_num, _ = common_layers.padded_cross_entropy(
+          top_out.to_tensor(), tf.constant(targets), 0.0)
+      session.run(tf.global_variables_initializer())
+      res1, res2, res3, log_probs = session.run(
+          (loss_num, loss_den, full_loss_num, top_out.to_tensor()))
+    self.assertEqual(log_probs.shape, (batch_size, length, 1, 1, vocab_size))
+    self.assertAllClose(np.exp(log_probs).sum(-1),
+                        np.ones((batch_size, length, 1, 1)))
+    self.assertAllClose(res1, res3)
+    self.assertEqual(res2, np.count_nonzero(targets))
+
 
 if __name__ == "__main__":
   tf.test.main()
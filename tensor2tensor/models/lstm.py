@@ -21,11 +21,14 @@ from __future__ import print_function
 import copy
 from tensor2tensor.layers import common_hparams
 from tensor2tensor.layers import common_layers
+from tensor2tensor.utils import beam_search
 from tensor2tensor.utils import registry
 from tensor2tensor.utils import t2t_model
 
 import tensorflow as tf
 
+from tensorflow.python.util import nest
+
 
 def _dropout_lstm_cell(hparams, train):
   return tf.contrib.rnn.DropoutWrapper(
@@ -65,32 +68,24 @@ def lstm(inputs, sequence_length, hparams, train, name, initial_state=None):
         time_major=False)
 
 
-def lstm_attention_decoder(inputs, hparams, train, name, initial_state,
-                           encoder_outputs, encoder_output_length,
-                           decoder_input_length):
-  """Run LSTM cell with attention on inputs of shape [batch x time x size].
+def lstm_attention_cell(hparams, train, encoder_outputs,
+                        encoder_output_length):
+  """Creates a stack of LSTM layers attending to the encoder outputs.
 
   Args:
-    inputs: The decoder input `Tensor`, shaped `[batch_size, decoder_steps,
-        hidden_size]`.
     hparams: tf.contrib.training.HParams; hyperparameters.
     train: bool; `True` when constructing training graph to enable dropout.
-    name: string; Create variable names under this scope.
-    initial_state: Tuple of `LSTMStateTuple`s; the initial state of each layer.
     encoder_outputs: Encoder outputs; a `Tensor` shaped `[batch_size,
         encoder_steps, hidden_size]`.
     encoder_output_length: Lengths of the actual encoder outputs, excluding
         padding; a `Tensor` shaped `[batch_size]`.
-    decoder_input_length: Lengths of the actual decoder inputs, excluding
-        padding; a `Tensor` shaped `[batch_size]`.
 
   Raises:
     ValueError: If the hparams.attention_mechanism is anything other than
         luong or bahdanau.
 
   Returns:
-    The decoder output `Tensor`, shaped `[batch_size, decoder_steps,
-    hidden_size]`.
+    A `tf.contrib.seq2seq.AttentionWrapper`.
   """
   layers = [_dropout_lstm_cell(hparams, train)
             for _ in range(hparams.num_hidden_layers)]
@@ -105,22 +100,38 @@ def lstm_attention_decoder(inputs, hparams, train, name, initial_state,
       hparams.hidden_size, encoder_outputs,
       memory_sequence_length=encoder_output_length)
 
-  cell = tf.contrib.seq2seq.AttentionWrapper(
+  return tf.contrib.seq2seq.AttentionWrapper(
       tf.nn.rnn_cell.MultiRNNCell(layers),
       [attention_mechanism]*hparams.num_heads,
       attention_layer_size=[hparams.attention_layer_size]*hparams.num_heads,
       output_attention=(hparams.output_attention == 1))
 
-  batch_size = common_layers.shape_list(inputs)[0]
 
-  initial_state = cell.zero_state(batch_size, tf.float32).clone(
-      cell_state=initial_state)
+def lstm_attention_rnn(cell, inputs, sequence_length, hparams, name,
+                       initial_state):
+  """Runs an attention cell on inputs of shape [batch x time x size].
+
+  Args:
+    cell: The cell returned by `lstm_attention_cell`.
+    inputs: The decoder input `Tensor`, shaped `[batch_size, decoder_steps,
+        hidden_size]`.
+    sequence_length: Lengths of the actual decoder inputs, excluding padding;
+        a `Tensor` shaped `[batch_size]`.
+    hparams: tf.contrib.training.HParams; hyperparameters.
+    name: string; Create variable names under this scope.
+    initial_state: An `AttentionWrapperState`; the initial state of the cell.
 
+  Returns:
+    A tuple (outputs, state), where:
+      outputs: The output `Tensor`, shaped `[batch_size, decoder_steps,
+        hidden_size]`.
+      state: The final `AttentionWrapperState`.
+  """
   with tf.variable_scope(name):
-    output, _ = tf.nn.dynamic_rnn(
+    output, state = tf.nn.dynamic_rnn(
         cell,
         inputs,
-        decoder_input_length,
+        sequence_length,
         initial_state=initial_state,
         dtype=tf.float32,
         time_major=False)
@@ -133,7 +144,47 @@ def lstm_attention_decoder(inputs, hparams, train, name, initial_state,
     if hparams.output_attention == 1 and hparams.num_heads > 1:
       output = tf.layers.dense(output, hparams.hidden_size)
 
-    return output
+    return output, state
+
+
+def lstm_attention_decoder(inputs, hparams, train, name, initial_state,
+                           encoder_outputs, encoder_output_length,
+                           decoder_input_length):
+  """Run LSTM cell with attention on inputs of shape [batch x time x size].
+
+  Args:
+    inputs: The decoder input `Tensor`, shaped `[batch_size, decoder_steps,
+        hidden_size]`.
+    hparams: tf.contrib.training.HParams; hyperparameters.
+    train: bool; `True` when constructing training graph to enable dropout.
+    name: string; Create variable names under this scope.
+    initial_state: Tuple of `LSTMStateTuple`s; the initial state of each layer.
+    encoder_outputs: Encoder outputs; a `Tensor` shaped `[batch_size,
+        encoder_steps, hidden_size]`.
+    encoder_output_length: Lengths of the actual encoder outputs, excluding
+        padding; a `Tensor` shaped `[batch_size]`.
+    decoder_input_length: Lengths of the actual decoder inputs, excluding
+        padding; a `Tensor` shaped `[batch_size]`.
+
+  Raises:
+    ValueError: If the hparams.attention_mechanism is anything other than
+        luong or bahdanau.
+
+  Returns:
+    The decoder output `Tensor`, shaped `[batch_size, decoder_steps,
+    hidden_size]`.
+  """
+  cell = lstm_attention_cell(hparams, train, encoder_outputs,
+                             encoder_output_length)
+
+  batch_size = common_layers.shape_list(inputs)[0]
+
+  initial_state = cell.zero_state(batch_size, tf.float32).clone(
+      cell_state=initial_state)
+
+  output, _ = lstm_attention_rnn(cell, inputs, decoder_input_length, hparams,
+                                 name, initial_state)
+  return output
 
 
 def lstm_seq2seq_internal(inputs, targets, hparams, train):
@@ -309,8 +360,301 @@ class LSTMEncoder(t2t_model.T2TModel):
     return tf.expand_dims(encoder_output, axis=2)
 
 
+def _tile_to_beam_size(tensor, beam_size):
+  """Tiles a [batch_size, ...] tensor to [batch_size * beam_size, ...]."""
+  shape = common_layers.shape_list(tensor)
+  tensor = tf.tile(tf.expand_dims(tensor, axis=1),
+                   [1, beam_size] + [1] * (len(shape) - 1))
+  return tf.reshape(tensor, [shape[0] * beam_size] + shape[1:])
+
+
+class LSTMSeq2seqBase(t2t_model.T2TModel):
+  """Base class of the LSTM seq2seq models, implements fast decoding.
+
+  Fast decoding runs the encoder once and then the decoder one step at a time,
+  carrying the LSTM states (and the attention state) from step to step in the
+  decoding cache instead of re-running the model on the whole prefix.
+  """
+
+  # Variable scope of the body, see the lstm_seq2seq_internal* functions.
+  scope_name = None
+  bidirectional_encoder = False
+  attention = False
+
+  def encode(self, inputs, hparams, train):
+    """Encodes the embedded inputs like the body does.
+
+    Args:
+      inputs: Embedded inputs, a `Tensor` shaped `[batch_size, time_steps, 1,
+          hidden_size]`.
+      hparams: tf.contrib.training.HParams; hyperparameters.
+      train: bool; `True` when constructing training graph to enable dropout.
+
+    Returns:
+      A tuple (encoder_outputs, final_encoder_state, inputs_length).
+    """
+    inputs_length = common_layers.length_from_embedding(inputs)
+    # Flatten inputs.
+    inputs = common_layers.flatten4d3d(inputs)
+    if self.bidirectional_encoder:
+      encoder_outputs, final_encoder_state = lstm_bid_encoder(
+          inputs, inputs_length, hparams, train, "encoder")
+    else:
+      inputs = tf.reverse_sequence(inputs, inputs_length, seq_axis=1)
+      encoder_outputs, final_encoder_state = lstm(
+          inputs, inputs_length, hparams, train, "encoder")
+    return encoder_outputs, final_encoder_state, inputs_length
+
+  def _greedy_infer(self, features, decode_length, use_tpu=False):
+    """Fast version of greedy decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      use_tpu: A bool. Whether to build the inference graph for TPU.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length]
+          "scores": decoding log probs of the outputs.
+      }
+    """
+    if use_tpu or not self.has_input or self._target_modality_is_real:
+      return super(LSTMSeq2seqBase, self)._greedy_infer(
+          features, decode_length, use_tpu)
+    with tf.variable_scope(self.name):
+      return self._fast_decode(features, decode_length)
+
+  def _beam_decode(self, features, decode_length, beam_size, top_beams, alpha):
+    """Beam search decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      beam_size: number of beams.
+      top_beams: an integer. How many of the beams to return.
+      alpha: Float that controls the length penalty. larger the alpha, stronger
+        the preference for longer translations.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length] if top_beams == 1 or
+              [batch_size, top_beams, <= decode_length]
+          "scores": decoding log probs from the beam search.
+      }
+    """
+    if not self.has_input or self._target_modality_is_real:
+      return self._beam_decode_slow(features, decode_length, beam_size,
+                                    top_beams, alpha)
+    with tf.variable_scope(self.name):
+      return self._fast_decode(features, decode_length, beam_size, top_beams,
+                               alpha)
+
+  def _fast_decode(self,
+                   features,
+                   decode_length,
+                   beam_size=1,
+                   top_beams=1,
+                   alpha=1.0):
+    """Fast decoding.
+
+    Implements both greedy and beam search decoding, uses beam search iff
+    beam_size > 1, otherwise beam search related arguments are ignored.
+
+    Args:
+      features: a map of string to model  features.
+      decode_length: an integer.  How many additional timesteps to decode.
+      beam_size: number of beams.
+      top_beams: an integer. How many of the beams to return.
+      alpha: Float that controls the length penalty. larger the alpha, stronger
+        the preference for longer translations.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length] if top_beams == 1 or
+              [batch_size, top_beams, <= decode_length] otherwise
+          "scores": decoding log probs.
+      }
+
+    Raises:
+      NotImplementedError: If there are multiple data shards.
+    """
+    if self._num_datashards != 1:
+      raise NotImplementedError("Fast decoding only supports a single shard.")
+    dp = self._data_parallelism
+    hparams = self._hparams
+    train = hparams.mode == tf.estimator.ModeKeys.TRAIN
+    target_modality = self._problem_hparams.target_modality
+    decoder_hparams = hparams
+    if self.bidirectional_encoder:
+      decoder_hparams = copy.copy(hparams)
+      decoder_hparams.hidden_size = 2 * hparams.hidden_size
+
+    inputs = features["inputs"]
+    if len(inputs.shape) < 4:
+      inputs = tf.expand_dims(inputs, axis=2)
+    batch_size = common_layers.shape_list(inputs)[0]
+    if target_modality.is_class_modality:
+      decode_length = 1
+    else:
+      decode_length = (
+          common_layers.shape_list(inputs)[1] +
+          features.get("decode_length", decode_length))
+
+    # _shard_features called to ensure that the variable names match
+    inputs = self._shard_features({"inputs": inputs})["inputs"]
+    input_modality = self._problem_hparams.input_modality["inputs"]
+    with tf.variable_scope(input_modality.name):
+      inputs = input_modality.bottom_sharded(inputs, dp)[0]
+    with tf.variable_scope("body"), tf.variable_scope(self.scope_name):
+      encoder_outputs, encoder_state, inputs_length = self.encode(
+          inputs, hparams, train)
+      if self.attention:
+        if beam_size > 1:
+          # The cache is expanded to the beams by the beam search, the memory
+          # is attended to by all of them and is only expanded once here.
+          encoder_outputs = _tile_to_beam_size(encoder_outputs, beam_size)
+          inputs_length = _tile_to_beam_size(inputs_length, beam_size)
+        cell = lstm_attention_cell(decoder_hparams, train, encoder_outputs,
+                                   inputs_length)
+        # The initial attention state is all zeros and does not depend on the
+        # memory, so only keep the rows of the first batch_size entries.
+        initial_state = cell.zero_state(batch_size * beam_size, tf.float32)
+        encoder_state = {
+            "cell_state": encoder_state,
+            "attention": initial_state.attention[:batch_size],
+            "alignments": tuple(
+                a[:batch_size] for a in initial_state.alignments),
+            "attention_state": tuple(
+                a[:batch_size] for a in initial_state.attention_state),
+        }
+
+    cache = {
+        "state": encoder_state,
+        "seen_padding": tf.fill([batch_size], False),
+    }
+
+    def symbols_to_logits_fn(ids, i, cache):
+      """Go from ids to logits for next symbol."""
+      targets = tf.expand_dims(tf.expand_dims(ids[:, -1:], axis=2), axis=3)
+      # _shard_features called to ensure that the variable names match
+      targets = self._shard_features({"targets": targets})["targets"]
+      with tf.variable_scope(target_modality.name):
+        targets = target_modality.targets_bottom_sharded(targets, dp)[0]
+      # The body decodes the targets shifted right, so step 0 is fed zeros.
+      targets = tf.cond(
+          tf.equal(i, 0), lambda: tf.zeros_like(targets), lambda: targets)
+      # The body only runs the decoder over as many steps as there are
+      # non-padding targets, so once a padding id has been decoded its outputs
+      # are zeros. Keep the states and output zeros from then on as well.
+      seen_padding = tf.logical_or(
+          cache["seen_padding"],
+          tf.logical_and(
+              tf.greater(i, 0),
+              tf.equal(common_layers.length_from_embedding(targets), 0)))
+      sequence_length = tf.to_int32(tf.logical_not(seen_padding))
+      targets = common_layers.flatten4d3d(targets)
+
+      with tf.variable_scope("body"), tf.variable_scope(self.scope_name):
+        if self.attention:
+          state = tf.contrib.seq2seq.AttentionWrapperState(
+              time=i,
+              alignment_history=tuple(() for _ in cache["state"]["alignments"]),
+              **cache["state"])
+          body_outputs, state = lstm_attention_rnn(
+              cell, targets, sequence_length, decoder_hparams, "decoder",
+              state)
+          state = {
+              "cell_state": state.cell_state,
+              "attention": state.attention,
+              "alignments": state.alignments,
+              "attention_state": state.attention_state,
+          }
+        else:
+          body_outputs, state = lstm(
+              targets, sequence_length, decoder_hparams, train, "decoder",
+              initial_state=cache["state"])
+      body_outputs = tf.expand_dims(body_outputs, axis=2)
+
+      with tf.variable_scope(target_modality.name):
+        logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+      return tf.squeeze(logits, axis=[1, 2, 3]), {
+          "state": state,
+          "seen_padding": seen_padding,
+      }
+
+    vocab_size = target_modality.top_dimensionality
+    eos_id = beam_search.EOS_ID
+    if beam_size > 1:
+      initial_ids = tf.zeros([batch_size], dtype=tf.int32)
+      decoded_ids, scores = beam_search.beam_search(
+          symbols_to_logits_fn,
+          initial_ids,
+          beam_size,
+          decode_length,
+          vocab_size,
+          alpha,
+          states=cache,
+          eos_id=eos_id,
+          stop_early=(top_beams == 1))
+      if top_beams == 1:
+        decoded_ids = decoded_ids[:, 0, 1:]
+        scores = scores[:, 0]
+      else:
+        decoded_ids = decoded_ids[:, :top_beams, 1:]
+        scores = scores[:, :top_beams]
+      return {"outputs": decoded_ids, "scores": scores}
+
+    def inner_loop(i, hit_eos, next_id, decoded_ids, cache, log_prob):
+      """One step of greedy decoding."""
+      logits, cache = symbols_to_logits_fn(next_id, i, cache)
+      log_probs = common_layers.log_prob_from_logits(logits)
+      temperature = (0.0 if hparams.sampling_method == "argmax" else
+                     hparams.sampling_temp)
+      next_id = common_layers.sample_with_temperature(logits, temperature)
+      hit_eos |= tf.equal(next_id, eos_id)
+
+      log_prob_indices = tf.stack(
+          [tf.range(tf.to_int64(common_layers.shape_list(next_id)[0])),
+           next_id], axis=1)
+      log_prob += tf.gather_nd(log_probs, log_prob_indices)
+
+      next_id = tf.expand_dims(next_id, axis=1)
+      decoded_ids = tf.concat([decoded_ids, next_id], axis=1)
+      return i + 1, hit_eos, next_id, decoded_ids, cache, log_prob
+
+    def is_not_finished(i, hit_eos, *_):
+      return tf.logical_not(
+          tf.logical_or(i >= decode_length, tf.reduce_all(hit_eos)))
+
+    _, _, _, decoded_ids, _, log_prob = tf.while_loop(
+        is_not_finished,
+        inner_loop, [
+            tf.constant(0),
+            tf.fill([batch_size], False),
+            tf.zeros([batch_size, 1], dtype=tf.int64),
+            tf.zeros([batch_size, 0], dtype=tf.int64),
+            cache,
+            tf.zeros([batch_size], dtype=tf.float32),
+        ],
+        shape_invariants=[
+            tf.TensorShape([]),
+            tf.TensorShape([None]),
+            tf.TensorShape([None, None]),
+            tf.TensorShape([None, None]),
+            nest.map_structure(beam_search.get_state_shape_invariants, cache),
+            tf.TensorShape([None]),
+        ])
+    return {"outputs": decoded_ids, "scores": log_prob}
+
+
 @registry.register_model
-class LSTMSeq2seq(t2t_model.T2TModel):
+class LSTMSeq2seq(LSTMSeq2seqBase):
+
+  scope_name = "lstm_seq2seq"
 
   def body(self, features):
     # TODO(lukaszkaiser): investigate this issue and repair.
@@ -322,7 +666,10 @@ class LSTMSeq2seq(t2t_model.T2TModel):
 
 
 @registry.register_model
-class LSTMSeq2seqAttention(t2t_model.T2TModel):
+class LSTMSeq2seqAttention(LSTMSeq2seqBase):
+
+  scope_name = "lstm_seq2seq_attention"
+  attention = True
 
   def body(self, features):
     # TODO(lukaszkaiser): investigate this issue and repair.
@@ -334,7 +681,10 @@ class LSTMSeq2seqAttention(t2t_model.T2TModel):
 
 
 @registry.register_model
-class LSTMSeq2seqBidirectionalEncoder(t2t_model.T2TModel):
+class LSTMSeq2seqBidirectionalEncoder(LSTMSeq2seqBase):
+
+  scope_name = "lstm_seq2seq_bid_encoder"
+  bidirectional_encoder = True
 
   def body(self, features):
     # TODO(lukaszkaiser): investigate this issue and repair.
@@ -346,7 +696,11 @@ class LSTMSeq2seqBidirectionalEncoder(t2t_model.T2TModel):
 
 
 @registry.register_model
-class LSTMSeq2seqAttentionBidirectionalEncoder(t2t_model.T2TModel):
+class LSTMSeq2seqAttentionBidirectionalEncoder(LSTMSeq2seqBase):
+
+  scope_name = "lstm_seq2seq_attention_bid_encoder"
+  bidirectional_encoder = True
+  attention = True
 
   def body(self, features):
     # TODO(lukaszkaiser): investigate this issue and repair.
@@ -107,6 +107,56 @@ class LSTMTest(tf.test.TestCase):
       res = session.run(logits)
     self.assertEqual(res.shape, (3, 6, 1, 1, vocab_size))
 
+  def _testSlowVsFast(self, model_cls, hparams):
+    vocab_size = 9
+    decode_length = 3
+    x = np.random.random_integers(1, high=vocab_size - 1, size=(3, 5, 1, 1))
+    x[0, 3:] = 0
+    y = np.random.random_integers(1, high=vocab_size - 1, size=(3, 6, 1, 1))
+    p_hparams = problem_hparams.test_problem_hparams(vocab_size, vocab_size)
+    features = {
+        "inputs": tf.constant(x, dtype=tf.int32),
+        "targets": tf.constant(y, dtype=tf.int32),
+    }
+    model = model_cls(hparams, tf.estimator.ModeKeys.TRAIN, p_hparams)
+    model(features)
+    model.set_mode(tf.estimator.ModeKeys.PREDICT)
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      greedy_result = model._slow_greedy_infer(
+          features, decode_length)["outputs"]
+      greedy_result = tf.squeeze(greedy_result, axis=[2, 3])
+      fast_result = model._greedy_infer(features, decode_length)["outputs"]
+      beam_result = model._beam_decode_slow(
+          features, decode_length, beam_size=3, top_beams=1,
+          alpha=1.0)["outputs"]
+      fast_beam_result = model._beam_decode(
+          features, decode_length, beam_size=3, top_beams=1,
+          alpha=1.0)["outputs"]
+
+    with self.test_session() as session:
+      session.run(tf.global_variables_initializer())
+      greedy_res, fast_res, beam_res, fast_beam_res = session.run(
+          [greedy_result, fast_result, beam_result, fast_beam_result])
+    # Fast greedy decoding stops once all sequences have decoded EOS.
+    self.assertAllEqual(greedy_res[:, :fast_res.shape[1]], fast_res)
+    self.assertAllEqual(beam_res, fast_beam_res)
+
+  def testLSTMSeq2SeqSlowVsFast(self):
+    self._testSlowVsFast(lstm.LSTMSeq2seq, lstm.lstm_seq2seq())
+
+  def testLSTMSeq2SeqAttentionSlowVsFast(self):
+    self._testSlowVsFast(lstm.LSTMSeq2seqAttention,
+                         lstm.lstm_luong_attention_multi())
+
+  def testLSTMSeq2seqBidirectionalEncoderSlowVsFast(self):
+    self._testSlowVsFast(lstm.LSTMSeq2seqBidirectionalEncoder,
+                         lstm.lstm_seq2seq())
+
+  def testLSTMSeq2seqAttentionBidirectionalEncoderSlowVsFast(self):
+    self._testSlowVsFast(lstm.LSTMSeq2seqAttentionBidirectionalEncoder,
+                         lstm.lstm_attention())
+
 
 if __name__ == "__main__":
   tf.test.main()
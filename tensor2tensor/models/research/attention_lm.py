@@ -23,11 +23,14 @@ decoder: [Self-Attention, Feed-forward] x n
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+
+import copy
 from six.moves import range  # pylint: disable=redefined-builtin
 
 from tensor2tensor.layers import common_attention
 from tensor2tensor.layers import common_hparams
 from tensor2tensor.layers import common_layers
+from tensor2tensor.models import transformer
 from tensor2tensor.utils import registry
 from tensor2tensor.utils import t2t_model
 
@@ -55,6 +58,205 @@ class AttentionLM(t2t_model.T2TModel):
 
     return decoder_output
 
+  def _greedy_infer(self, features, decode_length, use_tpu=False):
+    """Fast version of greedy decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      use_tpu: A bool. Whether to build the inference graph for TPU.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length]
+          "scores": decoding log probs of the outputs.
+      }
+    """
+    if use_tpu or not attention_lm_fast_decoding_supported(self):
+      return super(AttentionLM, self)._greedy_infer(
+          features, decode_length, use_tpu)
+    with tf.variable_scope(self.name):
+      return attention_lm_fast_decode(self, features, decode_length,
+                                      self.decode)
+
+  def _beam_decode(self, features, decode_length, beam_size, top_beams, alpha):
+    """Beam search decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      beam_size: number of beams.
+      top_beams: an integer. How many of the beams to return.
+      alpha: Float that controls the length penalty. larger the alpha, stronger
+        the preference for longer translations.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length] if top_beams == 1 or
+              [batch_size, top_beams, <= decode_length]
+          "scores": decoding log probs from the beam search.
+      }
+    """
+    if not attention_lm_fast_decoding_supported(self):
+      return self._beam_decode_slow(features, decode_length, beam_size,
+                                    top_beams, alpha)
+    with tf.variable_scope(self.name):
+      return attention_lm_fast_decode(self, features, decode_length,
+                                      self.decode, beam_size, top_beams, alpha)
+
+  def decode(self, decoder_input, decoder_self_attention_bias, cache):
+    """Runs the decoder stack on new positions, see attention_lm_fast_decode."""
+    with tf.variable_scope("body"):
+      return attention_lm_decoder(decoder_input, decoder_self_attention_bias,
+                                  self._hparams, cache=cache)
+
+
+def attention_lm_fast_decoding_supported(model):
+  """Whether attention_lm_fast_decode can decode with the given model."""
+  # pylint: disable=protected-access
+  return (not model.has_input and not model._target_modality_is_real and
+          model.hparams.prepend_mode != "prepend_inputs_full_attention")
+
+
+def attention_lm_fast_decode(model,
+                             features,
+                             decode_length,
+                             decode_fn,
+                             beam_size=1,
+                             top_beams=1,
+                             alpha=1.0,
+                             num_layers=None):
+  """Fast decoding for the self-attention language models.
+
+  The decoded sequences are forced to begin with the partial targets, which
+  are run through the decoder in a single pass. Then every decoding step only
+  runs the decoder on the last position, attending to the keys and values of
+  the previous positions kept in a per-layer cache.
+
+  Args:
+    model: a T2TModel.
+    features: a map of string to model features.
+    decode_length: an integer.  How many additional timesteps to decode.
+    decode_fn: function mapping `(decoder_input, decoder_self_attention_bias,
+      cache)` to the output of the decoder stack for the positions of
+      decoder_input, a Tensor of shape [batch_size, length, hidden_size],
+      with the variable names of the model body. It must append the keys and
+      values of these positions to cache["layer_%d" % layer] of each
+      self-attention layer.
+    beam_size: number of beams.
+    top_beams: an integer. How many of the beams to return.
+    alpha: Float that controls the length penalty. larger the alpha, stronger
+      the preference for longer translations.
+    num_layers: an integer, the number of self-attention layers of decode_fn.
+      Defaults to hparams.num_hidden_layers.
+
+  Returns:
+    A dict of decoding results {
+        "outputs": integer `Tensor` of decoded ids of shape
+            [batch_size, <= decode_length] if top_beams == 1 or
+            [batch_size, top_beams, <= decode_length] otherwise
+        "scores": decoding log probs.
+    }
+
+  Raises:
+    NotImplementedError: If there are multiple data shards.
+  """
+  # pylint: disable=protected-access
+  if model._num_datashards != 1:
+    raise NotImplementedError("Fast decoding only supports a single shard.")
+  dp = model._data_parallelism
+  hparams = model._hparams
+  decode_hparams = model._decode_hparams
+  target_modality = model._problem_hparams.target_modality
+  cache_hparams = hparams
+  if num_layers is not None:
+    # transformer.fast_decode creates a cache for every decoder layer.
+    cache_hparams = copy.copy(hparams)
+    cache_hparams.num_hidden_layers = num_layers
+
+  # In either features["inputs"] or features["targets"].
+  partial_targets = features.get("inputs")
+  if partial_targets is None:
+    partial_targets = features["targets"]
+  partial_targets = common_layers.expand_squeeze_to_nd(partial_targets, 2)
+  partial_targets = tf.to_int64(partial_targets)
+  partial_targets_shape = common_layers.shape_list(partial_targets)
+  partial_targets_length = partial_targets_shape[1]
+  batch_size = partial_targets_shape[0]
+  decode_length = (
+      partial_targets_length + features.get("decode_length", decode_length))
+
+  timing_signal = None
+  if hparams.pos == "timing":
+    timing_signal = common_attention.get_timing_signal_1d(
+        decode_length + 1, hparams.hidden_size)
+  decoder_self_attention_bias = (
+      common_attention.attention_bias_lower_triangle(decode_length))
+
+  def embed(ids):
+    """Embeds ids of shape [batch_size, length] like the model bottom."""
+    targets = tf.expand_dims(tf.expand_dims(ids, axis=2), axis=3)
+    # _shard_features called to ensure that the variable names match
+    targets = model._shard_features({"targets": targets})["targets"]
+    with tf.variable_scope(target_modality.name):
+      targets = target_modality.targets_bottom_sharded(targets, dp)[0]
+    return common_layers.flatten4d3d(targets)
+
+  def prefill_fn(ids, cache):
+    """Runs the decoder over the partial targets to fill the cache."""
+    length = common_layers.shape_list(ids)[1]
+    # Position i is fed the id decoded at step i - 1, and zeros at step 0.
+    decoder_input = common_layers.shift_right_3d(embed(ids))
+    if timing_signal is not None:
+      decoder_input += timing_signal[:, :length]
+    decode_fn(decoder_input,
+              decoder_self_attention_bias[:, :, :length, :length], cache)
+    return cache
+
+  def symbols_to_logits_fn(ids, i, cache):
+    """Go from ids to logits for next symbol."""
+    decoder_input = embed(ids[:, -1:])
+    decoder_input = tf.cond(
+        tf.equal(i, 0), lambda: tf.zeros_like(decoder_input),
+        lambda: decoder_input)
+    if timing_signal is not None:
+      decoder_input += timing_signal[:, i:i + 1]
+    body_outputs = decode_fn(
+        decoder_input, decoder_self_attention_bias[:, :, i:i + 1, :i + 1],
+        cache)
+    with tf.variable_scope(target_modality.name):
+      logits = target_modality.top_sharded(
+          [tf.expand_dims(body_outputs, axis=2)], None, dp)[0]
+    return tf.squeeze(logits, axis=[1, 2, 3]), cache
+
+  # The decoder is built twice, once for the partial targets and once inside
+  # the decoding loop, so its variables must be shared.
+  with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
+    ret = transformer.fast_decode(
+        encoder_output=None,
+        encoder_decoder_attention_bias=None,
+        symbols_to_logits_fn=symbols_to_logits_fn,
+        hparams=cache_hparams,
+        decode_length=decode_length,
+        vocab_size=target_modality.top_dimensionality,
+        beam_size=beam_size,
+        top_beams=top_beams,
+        alpha=alpha,
+        batch_size=batch_size,
+        force_decode_length=decode_hparams.force_decode_length,
+        partial_targets=partial_targets,
+        prefill_fn=prefill_fn,
+        compact_batch_every=decode_hparams.compact_batch_every,
+        per_beam_topk=decode_hparams.per_beam_topk)
+  # pylint: enable=protected-access
+  if beam_size <= 1 or top_beams <= 1:
+    ret["outputs"] = ret["outputs"][:, partial_targets_length:]
+  else:
+    ret["outputs"] = ret["outputs"][:, :, partial_targets_length:]
+  return ret
+
 
 def attention_lm_prepare_decoder(targets, hparams):
   """Prepare one shard of the model for the decoder.
@@ -85,7 +287,8 @@ def attention_lm_prepare_decoder(targets, hparams):
 def attention_lm_decoder(decoder_input,
                          decoder_self_attention_bias,
                          hparams,
-                         name="decoder"):
+                         name="decoder",
+                         cache=None):
   """A stack of attention_lm layers.
 
   Args:
@@ -94,6 +297,8 @@ def attention_lm_decoder(decoder_input,
       (see common_attention.attention_bias())
     hparams: hyperparameters for model
     name: a string
+    cache: optional dict, mapping "layer_%d" to the self-attention keys and
+      values of the previous positions, used for fast decoding.
 
   Returns:
     y: a Tensors
@@ -101,14 +306,17 @@ def attention_lm_decoder(decoder_input,
   x = decoder_input
   with tf.variable_scope(name):
     for layer in range(hparams.num_hidden_layers):
-      with tf.variable_scope("layer_%d" % layer):
+      layer_name = "layer_%d" % layer
+      layer_cache = cache[layer_name] if cache is not None else None
+      with tf.variable_scope(layer_name):
         with tf.variable_scope("self_attention"):
           y = common_attention.multihead_attention(
               common_layers.layer_preprocess(
                   x, hparams), None, decoder_self_attention_bias,
               hparams.attention_key_channels or hparams.hidden_size,
               hparams.attention_value_channels or hparams.hidden_size,
-              hparams.hidden_size, hparams.num_heads, hparams.attention_dropout)
+              hparams.hidden_size, hparams.num_heads, hparams.attention_dropout,
+              cache=layer_cache)
           x = common_layers.layer_postprocess(x, y, hparams)
         with tf.variable_scope("ffn"):
           y = common_layers.conv_hidden_relu(
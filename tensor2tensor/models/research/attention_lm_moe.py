@@ -30,6 +30,7 @@ from six.moves import range  # pylint: disable=redefined-builtin
 from tensor2tensor.layers import common_attention
 from tensor2tensor.layers import common_hparams
 from tensor2tensor.layers import common_layers
+from tensor2tensor.models.research import attention_lm
 from tensor2tensor.utils import diet
 from tensor2tensor.utils import expert_utils
 from tensor2tensor.utils import registry
@@ -106,17 +107,6 @@ class AttentionLmMoe(t2t_model.T2TModel):
     x = dp(tf.nn.dropout, decoder_input,
            1.0 - hparams.layer_prepostprocess_dropout)
     extra_loss = 0.0
-    moe_hidden_sizes = [int(s) for s in hparams.moe_hidden_sizes.split(",")]
-    if hparams.diet_experts:
-      hsize, = moe_hidden_sizes
-
-      def _diet_expert(x):
-        return diet.diet_expert(x, hsize, diet.diet_adam_optimizer_params())
-
-      expert_fn = _diet_expert
-    else:
-      expert_fn = expert_utils.ffn_expert_fn(
-          hparams.hidden_size, moe_hidden_sizes, hparams.hidden_size)
 
     if not hparams.use_inputs:
       # As preprocess and postprocess are called with batch of size one (all
@@ -176,17 +166,8 @@ class AttentionLmMoe(t2t_model.T2TModel):
 
     assert hparams.batch_size >= hparams.max_length
 
-    num_hidden_layers = (
-        len(hparams.attention_layers) or hparams.num_hidden_layers)
-    for layer in range(num_hidden_layers):
+    for layer, attention_type in enumerate(layer_attention_types(hparams)):
       with tf.variable_scope("layer_%d" % layer):
-
-        # Use the layer type defined in attention_layers
-        if hparams.attention_layers:
-          attention_type = LAYER_SYMBOLS[hparams.attention_layers[layer]]
-        else:
-          attention_type = hparams.attention_type
-
         with tf.variable_scope(
             "attention_{}".format(attention_type)):
           if attention_type in [
@@ -312,47 +293,204 @@ class AttentionLmMoe(t2t_model.T2TModel):
                 AttentionType.get_choices()))
           x = postprocess(x, y)
         with tf.variable_scope("ffn"):
-          if str(layer) in hparams.moe_layers.split(","):
-            y, loss = expert_utils.distributed_moe(
-                dp,
-                self._ps_devices,
-                preprocess(x),
-                hparams.mode == ModeKeys.TRAIN,
-                input_size=hparams.hidden_size,
-                expert_fn=expert_fn,
-                num_experts=hparams.moe_num_experts,
-                k=hparams.moe_k,
-                loss_coef=hparams.moe_loss_coef)
-            extra_loss += loss
-          elif hparams.memory_efficient_ffn:
-            assert hparams.layer_preprocess_sequence == "n"
-            y = dp(
-                common_layers.conv_hidden_relu_memory_efficient,
-                x,
-                hparams.filter_size)
-          else:
-            additional_conv_params = dict()
-            if hparams.use_sepconv:
-              additional_conv_params = dict(
-                  padding="LEFT",
-                  # Parameters copied from the transformer model
-                  kernel_size=(3, 1),
-                  second_kernel_size=(31, 1),
-              )
-            y = dp(
-                common_layers.conv_hidden_relu,
-                preprocess(x),
-                hparams.filter_size,
-                hparams.hidden_size,
-                dropout=hparams.relu_dropout,
-                **additional_conv_params
-            )
+          y, loss = self._ffn_layer(layer, x)
+          extra_loss += loss
           x = postprocess(x, y)
     x = preprocess(x)
 
     decoder_output = dp(tf.expand_dims, x, 2)
     return decoder_output, extra_loss
 
+  def _ffn_layer(self, layer, x):
+    """Feed-forward part of a layer of body_sharded.
+
+    Args:
+      layer: an integer, the index of the layer.
+      x: a list of Tensors, the input of the layer for every data shard.
+
+    Returns:
+      A tuple (y, extra_loss), where y is a list of Tensors.
+    """
+    hparams = self._hparams
+    dp = self._data_parallelism
+
+    def preprocess(x):
+      return dp(common_layers.layer_preprocess, x, hparams)
+
+    if str(layer) in hparams.moe_layers.split(","):
+      return expert_utils.distributed_moe(
+          dp,
+          self._ps_devices,
+          preprocess(x),
+          hparams.mode == ModeKeys.TRAIN,
+          input_size=hparams.hidden_size,
+          expert_fn=moe_expert_fn(hparams),
+          num_experts=hparams.moe_num_experts,
+          k=hparams.moe_k,
+          loss_coef=hparams.moe_loss_coef)
+    elif hparams.memory_efficient_ffn:
+      assert hparams.layer_preprocess_sequence == "n"
+      y = dp(
+          common_layers.conv_hidden_relu_memory_efficient,
+          x,
+          hparams.filter_size)
+    else:
+      additional_conv_params = dict()
+      if hparams.use_sepconv:
+        additional_conv_params = dict(
+            padding="LEFT",
+            # Parameters copied from the transformer model
+            kernel_size=(3, 1),
+            second_kernel_size=(31, 1),
+        )
+      y = dp(
+          common_layers.conv_hidden_relu,
+          preprocess(x),
+          hparams.filter_size,
+          hparams.hidden_size,
+          dropout=hparams.relu_dropout,
+          **additional_conv_params
+      )
+    return y, 0.0
+
+  def _greedy_infer(self, features, decode_length, use_tpu=False):
+    """Fast version of greedy decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      use_tpu: A bool. Whether to build the inference graph for TPU.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length]
+          "scores": decoding log probs of the outputs.
+      }
+    """
+    if use_tpu or not self._fast_decoding_supported:
+      return super(AttentionLmMoe, self)._greedy_infer(
+          features, decode_length, use_tpu)
+    with tf.variable_scope(self.name):
+      return attention_lm.attention_lm_fast_decode(
+          self, features, decode_length, self.decode,
+          num_layers=len(layer_attention_types(self._hparams)))
+
+  def _beam_decode(self, features, decode_length, beam_size, top_beams, alpha):
+    """Beam search decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      beam_size: number of beams.
+      top_beams: an integer. How many of the beams to return.
+      alpha: Float that controls the length penalty. larger the alpha, stronger
+        the preference for longer translations.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length] if top_beams == 1 or
+              [batch_size, top_beams, <= decode_length]
+          "scores": decoding log probs from the beam search.
+      }
+    """
+    if not self._fast_decoding_supported:
+      return self._beam_decode_slow(features, decode_length, beam_size,
+                                    top_beams, alpha)
+    with tf.variable_scope(self.name):
+      return attention_lm.attention_lm_fast_decode(
+          self, features, decode_length, self.decode, beam_size, top_beams,
+          alpha, num_layers=len(layer_attention_types(self._hparams)))
+
+  @property
+  def _fast_decoding_supported(self):
+    """Whether all the layers can be computed one position at a time.
+
+    The self-attention layers must be full dot-product attention, which caches
+    the keys and values of the previous positions. The feed-forward layers must
+    be position-wise, the experts are then chosen for every new position by the
+    same gating as in body_sharded.
+    """
+    hparams = self._hparams
+    if (hparams.use_inputs or hparams.use_sepconv or
+        not attention_lm.attention_lm_fast_decoding_supported(self)):
+      return False
+    for attention_type in layer_attention_types(hparams):
+      if attention_type == AttentionType.MULTIHEAD and hparams.attention_local:
+        return False
+      if attention_type not in [
+          AttentionType.MULTIHEAD, AttentionType.MULTIHEAD_FULL]:
+        return False
+    return True
+
+  def decode(self, decoder_input, decoder_self_attention_bias, cache):
+    """Runs the layers of body_sharded on new positions.
+
+    Args:
+      decoder_input: a Tensor of shape [batch_size, length, hidden_size].
+      decoder_self_attention_bias: bias Tensor for self-attention.
+      cache: dict, mapping "layer_%d" to the self-attention keys and values of
+        the previous positions.
+
+    Returns:
+      a Tensor of shape [batch_size, length, hidden_size].
+    """
+    hparams = self._hparams
+    dp = self._data_parallelism
+
+    def preprocess(x):
+      return dp(common_layers.layer_preprocess, x, hparams)
+
+    def postprocess(x, y):
+      return dp(common_layers.layer_postprocess, x, y, hparams)
+
+    x = [decoder_input]
+    for layer, attention_type in enumerate(layer_attention_types(hparams)):
+      layer_name = "layer_%d" % layer
+      with tf.variable_scope(layer_name):
+        with tf.variable_scope("attention_{}".format(attention_type)):
+          y = dp(
+              common_attention.multihead_attention,
+              preprocess(x),
+              None,
+              decoder_self_attention_bias,
+              hparams.attention_key_channels or hparams.hidden_size,
+              hparams.attention_value_channels or hparams.hidden_size,
+              hparams.hidden_size,
+              hparams.num_heads,
+              hparams.attention_dropout,
+              block_length=hparams.attention_block_length,
+              name="decoder_self_attention",
+              cache=cache[layer_name])
+          x = postprocess(x, y)
+        with tf.variable_scope("ffn"):
+          y, _ = self._ffn_layer(layer, x)
+          x = postprocess(x, y)
+    return preprocess(x)[0]
+
+
+def layer_attention_types(hparams):
+  """Returns the AttentionType of every layer."""
+  # Use the layer type defined in attention_layers
+  if hparams.attention_layers:
+    return [LAYER_SYMBOLS[symbol] for symbol in hparams.attention_layers]
+  return [hparams.attention_type] * hparams.num_hidden_layers
+
+
+def moe_expert_fn(hparams):
+  """Returns the expert function of the mixture of experts layers."""
+  moe_hidden_sizes = [int(s) for s in hparams.moe_hidden_sizes.split(",")]
+  if hparams.diet_experts:
+    hsize, = moe_hidden_sizes
+
+    def _diet_expert(x):
+      return diet.diet_expert(x, hsize, diet.diet_adam_optimizer_params())
+
+    return _diet_expert
+  return expert_utils.ffn_expert_fn(
+      hparams.hidden_size, moe_hidden_sizes, hparams.hidden_size)
+
 
 def attention_lm_moe_prepare_decoder(targets, hparams):
   """Prepare one shard of the model for the decoder.
@@ -0,0 +1,118 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for AttentionLM."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+
+from tensor2tensor.data_generators import problem_hparams
+from tensor2tensor.models.research import attention_lm
+from tensor2tensor.models.research import attention_lm_moe
+
+import tensorflow as tf
+
+
+BATCH_SIZE = 3
+TARGET_LENGTH = 5
+VOCAB_SIZE = 10
+
+
+def get_model(hparams, model_cls=attention_lm.AttentionLM):
+  hparams.hidden_size = 16
+  hparams.filter_size = 32
+  hparams.num_heads = 2
+  hparams.num_hidden_layers = 2
+  hparams.layer_prepostprocess_dropout = 0.0
+
+  p_hparams = problem_hparams.test_problem_hparams(VOCAB_SIZE, VOCAB_SIZE)
+  p_hparams.input_modality = {}
+  hparams.problem_hparams = p_hparams
+
+  targets = np.random.random_integers(
+      1, high=VOCAB_SIZE - 1, size=(BATCH_SIZE, TARGET_LENGTH, 1, 1))
+  features = {
+      "targets": tf.constant(targets, dtype=tf.int32, name="targets"),
+      "target_space_id": tf.constant(1, dtype=tf.int32)
+  }
+  return model_cls(hparams, tf.estimator.ModeKeys.TRAIN, p_hparams), features
+
+
+def decode_slow_and_fast(test_case, model, features, decode_length):
+  """Returns the slow and fast greedy and beam search decodings."""
+  model(features)
+  model.set_mode(tf.estimator.ModeKeys.PREDICT)
+
+  with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+    slow_greedy = model._slow_greedy_infer(features, decode_length)["outputs"]
+    slow_greedy = tf.squeeze(slow_greedy, axis=[2, 3])
+    fast_greedy = model._greedy_infer(features, decode_length)["outputs"]
+    # The slow beam search expects the caller to provide the partial targets.
+    beam_features = dict(features)
+    beam_features["inputs"] = features["targets"]
+    beam_features["partial_targets"] = tf.squeeze(
+        features["targets"], axis=[2, 3])
+    slow_beam = model._beam_decode_slow(
+        beam_features, decode_length, beam_size=3, top_beams=1,
+        alpha=1.0)["outputs"]
+    fast_beam = model._beam_decode(
+        features, decode_length, beam_size=3, top_beams=1,
+        alpha=1.0)["outputs"]
+
+  with test_case.test_session() as session:
+    session.run(tf.global_variables_initializer())
+    return session.run([slow_greedy, fast_greedy, slow_beam, fast_beam])
+
+
+class AttentionLMTest(tf.test.TestCase):
+
+  def testAttentionLM(self):
+    model, features = get_model(attention_lm.attention_lm_base())
+    logits, _ = model(features)
+    with self.test_session() as session:
+      session.run(tf.global_variables_initializer())
+      res = session.run(logits)
+    self.assertEqual(res.shape, (BATCH_SIZE, TARGET_LENGTH, 1, 1, VOCAB_SIZE))
+
+  def testSlowVsFast(self):
+    model, features = get_model(attention_lm.attention_lm_base())
+    decode_length = 4
+    slow_greedy, fast_greedy, slow_beam, fast_beam = decode_slow_and_fast(
+        self, model, features, decode_length)
+    self.assertEqual(slow_greedy.shape, (BATCH_SIZE, decode_length))
+    # Fast greedy decoding stops once all sequences have decoded EOS.
+    self.assertAllEqual(slow_greedy[:, :fast_greedy.shape[1]], fast_greedy)
+    self.assertAllEqual(slow_beam, fast_beam)
+
+  def testSlowVsFastMoe(self):
+    hparams = attention_lm_moe.attention_lm_moe_base()
+    hparams.moe_num_experts = 4
+    hparams.moe_hidden_sizes = "32"
+    hparams.moe_layers = "1"
+    # More layers than hparams.num_hidden_layers.
+    hparams.attention_layers = "hfh"
+    model, features = get_model(hparams, attention_lm_moe.AttentionLmMoe)
+    self.assertTrue(model._fast_decoding_supported)
+    decode_length = 4
+    slow_greedy, fast_greedy, slow_beam, fast_beam = decode_slow_and_fast(
+        self, model, features, decode_length)
+    self.assertEqual(slow_greedy.shape, (BATCH_SIZE, decode_length))
+    self.assertAllEqual(slow_greedy[:, :fast_greedy.shape[1]], fast_greedy)
+    self.assertAllEqual(slow_beam, fast_beam)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -30,12 +30,21 @@ class SimilarityTransformer(t2t_model.T2TModel):
   calculated as a Binary Cross-Entropy loss. Normalized
   Dot Product is used as the distance measure between two
   string embeddings.
+
+  At inference the model embeds the inputs, or the targets with the code
+  network when there are no inputs; see utils/embedding_index.py to export
+  and search the embeddings of a corpus.
   """
 
   def top(self, body_output, _):
     return body_output
 
   def body(self, features):
+    if 'inputs' not in features:
+      # Only the code side is given, e.g. to embed a corpus of code.
+      with tf.variable_scope('code_embedding'):
+        return self.encode(features, 'targets')
+
     with tf.variable_scope('string_embedding'):
       string_embedding = self.encode(features, 'inputs')
 
@@ -94,7 +94,8 @@ class UniversalTransformer(transformer.Transformer):
              hparams,
              cache=None,
              nonpadding=None,
-             losses=None):
+             losses=None,
+             decode_position=None):
     """Decode Universal Transformer outputs from encoder representation.
 
     It is similar to "transformer.decode", but it uses
@@ -111,9 +112,12 @@ class UniversalTransformer(transformer.Transformer):
       decoder_self_attention_bias: Bias and mask weights for decoder
         self-attention. [batch_size, decoder_length]
       hparams: hyperparmeters for model.
-      cache: Unimplemented.
+      cache: optional dict of Tensors for incremental decoding, see
+        universal_transformer_util.universal_transformer_decoder_cache.
       nonpadding: optional Tensor with shape [batch_size, decoder_length]
       losses: Unused.
+      decode_position: scalar Tensor, the position of the first entry of
+        decoder_input when decoding with a cache.
 
     Returns:
        Tuple of:
@@ -124,13 +128,10 @@ class UniversalTransformer(transformer.Transformer):
 
     """
     del losses
-    # TODO(dehghani): enable caching.
-    del cache
 
     decoder_input = tf.nn.dropout(decoder_input,
                                   1.0 - hparams.layer_prepostprocess_dropout)
 
-    # No caching in Universal Transformers!
     (decoder_output, dec_extra_output) = (
         universal_transformer_util.universal_transformer_decoder(
             decoder_input,
@@ -139,7 +140,9 @@ class UniversalTransformer(transformer.Transformer):
             encoder_decoder_attention_bias,
             hparams,
             nonpadding=nonpadding,
-            save_weights_to=self.attention_weights))
+            save_weights_to=self.attention_weights,
+            cache=cache,
+            decode_position=decode_position))
 
     # Expand since t2t expects 4d tensors.
     return tf.expand_dims(decoder_output, axis=2), dec_extra_output
@@ -236,8 +239,12 @@ class UniversalTransformer(transformer.Transformer):
     Raises:
       NotImplementedError: If there are multiple data shards.
     """
-    return (self._slow_greedy_infer_tpu(features, decode_length) if use_tpu else
-            self._slow_greedy_infer(features, decode_length))
+    if use_tpu:
+      return self._slow_greedy_infer_tpu(features, decode_length)
+    if not self._fast_decoding_supported:
+      return self._slow_greedy_infer(features, decode_length)
+    with tf.variable_scope(self.name):
+      return self._fast_decode(features, decode_length)
 
   def _beam_decode(self, features, decode_length, beam_size, top_beams, alpha):
     """Beam search decoding.
@@ -259,10 +266,214 @@ class UniversalTransformer(transformer.Transformer):
               None if using greedy decoding (beam_size=1)
       }
     """
-    # Caching is not ebabled in Universal Transformer
-    # TODO(dehghani): Support fast decoding for Universal Transformer
-    return self._beam_decode_slow(features, decode_length, beam_size,
-                                  top_beams, alpha)
+    if not self._fast_decoding_supported:
+      return self._beam_decode_slow(features, decode_length, beam_size,
+                                    top_beams, alpha)
+    with tf.variable_scope(self.name):
+      return self._fast_decode(features, decode_length, beam_size, top_beams,
+                               alpha)
+
+  @property
+  def _fast_decoding_supported(self):
+    if self._target_modality_is_real:
+      return False
+    return universal_transformer_util.incremental_decoding_supported(
+        self._hparams)
+
+  def _fast_decode(self,
+                   features,
+                   decode_length,
+                   beam_size=1,
+                   top_beams=1,
+                   alpha=1.0):
+    """Fast decoding.
+
+    Like Transformer._fast_decode, but each decoding step only runs the
+    recurrence (and the ACT halting) over the new position, using the cache of
+    universal_transformer_util.universal_transformer_decoder_cache. The
+    partial targets of problems without inputs are decoded in one pass.
+
+    Args:
+      features: a map of string to model  features.
+      decode_length: an integer.  How many additional timesteps to decode.
+      beam_size: number of beams.
+      top_beams: an integer. How many of the beams to return.
+      alpha: Float that controls the length penalty. larger the alpha, stronger
+        the preference for longer translations.
+
+    Returns:
+      A dict of decoding results {
+          "outputs": integer `Tensor` of decoded ids of shape
+              [batch_size, <= decode_length] if beam_size == 1 or
+              [batch_size, top_beams, <= decode_length]
+          "scores": decoding log probs from the beam search,
+              None if using greedy decoding (beam_size=1)
+      }
+
+    Raises:
+      NotImplementedError: If there are multiple data shards.
+    """
+    if self._num_datashards != 1:
+      raise NotImplementedError("Fast decoding only supports a single shard.")
+    if "targets_segmentation" in features:
+      raise NotImplementedError(
+          "Decoding not supported on packed datasets "
+          " If you want to decode from a dataset, use the non-packed version"
+          " of the dataset when decoding.")
+    dp = self._data_parallelism
+    hparams = self._hparams
+    target_modality = self._problem_hparams.target_modality
+    if hparams.add_position_timing_signal:
+      # The position timing signal is added at every step, see body.
+      hparams.pos = None
+
+    if self.has_input:
+      inputs = features["inputs"]
+      if target_modality.is_class_modality:
+        decode_length = 1
+      else:
+        decode_length = (
+            common_layers.shape_list(inputs)[1] + features.get(
+                "decode_length", decode_length))
+
+      inputs = tf.expand_dims(inputs, axis=1)
+      if len(inputs.shape) < 5:
+        inputs = tf.expand_dims(inputs, axis=4)
+      s = common_layers.shape_list(inputs)
+      batch_size = s[0]
+      inputs = tf.reshape(inputs, [s[0] * s[1], s[2], s[3], s[4]])
+      # _shard_features called to ensure that the variable names match
+      inputs = self._shard_features({"inputs": inputs})["inputs"]
+      input_modality = self._problem_hparams.input_modality["inputs"]
+      with tf.variable_scope(input_modality.name):
+        inputs = input_modality.bottom_sharded(inputs, dp)
+      with tf.variable_scope("body"):
+        encoder_output, encoder_decoder_attention_bias, _ = dp(
+            self.encode,
+            inputs,
+            features["target_space_id"],
+            hparams,
+            features=features)
+      encoder_output = encoder_output[0]
+      encoder_decoder_attention_bias = encoder_decoder_attention_bias[0]
+      partial_targets = None
+    else:
+      # The problem has no inputs.
+      encoder_output = None
+      encoder_decoder_attention_bias = None
+
+      # Prepare partial targets.
+      # In either features["inputs"] or features["targets"].
+      # We force the outputs to begin with these sequences.
+      partial_targets = features.get("inputs")
+      if partial_targets is None:
+        partial_targets = features["targets"]
+      assert partial_targets is not None
+      partial_targets = common_layers.expand_squeeze_to_nd(partial_targets, 2)
+      partial_targets = tf.to_int64(partial_targets)
+      partial_targets_shape = common_layers.shape_list(partial_targets)
+      partial_targets_length = partial_targets_shape[1]
+      decode_length = (
+          partial_targets_length + features.get("decode_length", decode_length))
+      batch_size = partial_targets_shape[0]
+
+    if hparams.pos == "timing":
+      positional_encoding = common_attention.get_timing_signal_1d(
+          decode_length + 1, hparams.hidden_size)
+    else:
+      positional_encoding = None
+
+    decoder_self_attention_bias = (
+        common_attention.attention_bias_lower_triangle(decode_length))
+    if hparams.proximity_bias:
+      decoder_self_attention_bias += common_attention.attention_bias_proximal(
+          decode_length)
+
+    def embed_targets(ids):
+      """Embeds target ids [batch_size, length] to [batch_size, length, dim]."""
+      targets = tf.expand_dims(tf.expand_dims(ids, axis=2), axis=3)
+      # _shard_features called to ensure that the variable names match
+      targets = self._shard_features({"targets": targets})["targets"]
+      with tf.variable_scope(target_modality.name):
+        targets = target_modality.targets_bottom_sharded(targets, dp)[0]
+      return common_layers.flatten4d3d(targets)
+
+    def decode_positions(targets, position, cache):
+      """Runs the decoder over targets, which start at position."""
+      length = common_layers.shape_list(targets)[1]
+      if positional_encoding is not None:
+        targets += positional_encoding[:, position:position + length]
+      bias = decoder_self_attention_bias[:, :, position:position + length,
+                                         :position + length]
+      with tf.variable_scope("body"):
+        body_outputs, _ = dp(
+            self.decode,
+            targets,
+            cache.get("encoder_output"),
+            cache.get("encoder_decoder_attention_bias"),
+            bias,
+            hparams,
+            cache,
+            decode_position=position)
+      return body_outputs
+
+    def prefill_fn(ids, cache):
+      """Runs the decoder over the partial targets to fill the cache."""
+      # Position i is fed the id decoded at step i - 1, and zeros at step 0.
+      decode_positions(
+          common_layers.shift_right_3d(embed_targets(ids)), 0, cache)
+      return cache
+
+    def symbols_to_logits_fn(ids, i, cache):
+      """Go from ids to logits for next symbol."""
+      targets = embed_targets(ids[:, -1:])
+      targets = tf.cond(
+          tf.equal(i, 0), lambda: tf.zeros_like(targets), lambda: targets)
+      body_outputs = decode_positions(targets, i, cache)
+      with tf.variable_scope(target_modality.name):
+        logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+      return tf.squeeze(logits, axis=[1, 2, 3]), cache
+
+    with tf.variable_scope("body"):
+      cache = universal_transformer_util.universal_transformer_decoder_cache(
+          batch_size, hparams, encoder_output=encoder_output)
+    if encoder_output is not None:
+      cache["encoder_output"] = encoder_output
+      cache["encoder_decoder_attention_bias"] = encoder_decoder_attention_bias
+
+    # With ACT the number of steps depends on all the batch entries, so
+    # finished ones can not be removed from the decoding loop.
+    compact_batch_every = (0 if hparams.recurrence_type == "act" else
+                           self._decode_hparams.compact_batch_every)
+
+    # The decoder is built twice when prefilling, once for the partial targets
+    # and once inside the decoding loop, so its variables must be shared.
+    with tf.variable_scope(
+        tf.get_variable_scope(),
+        reuse=tf.AUTO_REUSE if partial_targets is not None else None):
+      ret = transformer.fast_decode(
+          encoder_output=None,
+          encoder_decoder_attention_bias=None,
+          symbols_to_logits_fn=symbols_to_logits_fn,
+          hparams=hparams,
+          decode_length=decode_length,
+          vocab_size=target_modality.top_dimensionality,
+          beam_size=beam_size,
+          top_beams=top_beams,
+          alpha=alpha,
+          batch_size=batch_size,
+          force_decode_length=self._decode_hparams.force_decode_length,
+          partial_targets=partial_targets,
+          prefill_fn=prefill_fn,
+          compact_batch_every=compact_batch_every,
+          per_beam_topk=self._decode_hparams.per_beam_topk,
+          cache_extras=cache)
+    if partial_targets is not None:
+      if beam_size <= 1 or top_beams <= 1:
+        ret["outputs"] = ret["outputs"][:, partial_targets_length:]
+      else:
+        ret["outputs"] = ret["outputs"][:, :, partial_targets_length:]
+    return ret
 
 
 @registry.register_model
@@ -21,7 +21,9 @@ from __future__ import print_function
 import numpy as np
 
 from tensor2tensor.data_generators import problem_hparams
+from tensor2tensor.layers import common_attention
 from tensor2tensor.models.research import universal_transformer
+from tensor2tensor.models.research import universal_transformer_util
 
 import tensorflow as tf
 
@@ -67,6 +69,128 @@ class UniversalTransformerTest(tf.test.TestCase):
       res = session.run(logits)
     self.assertEqual(res.shape, (BATCH_SIZE, TARGET_LENGTH, 1, 1, VOCAB_SIZE))
 
+  def _testDecoderWithCache(self, act_type):
+    hparams = universal_transformer.adaptive_universal_transformer_tiny()
+    hparams.act_type = act_type
+    hparams.act_max_steps = 6
+    hparams.act_halting_bias_init = 0.0
+    hparams.hidden_size = 8
+    hparams.filter_size = 16
+    hparams.num_heads = 2
+    hparams.pos = None
+    hparams.add_hparam("mode", tf.estimator.ModeKeys.PREDICT)
+    for key, value in hparams.values().items():
+      if key.endswith("dropout"):
+        setattr(hparams, key, 0.0)
+
+    length = 6
+    np.random.seed(0)
+    decoder_input = tf.constant(
+        3.0 * np.random.randn(BATCH_SIZE, length, 8), dtype=tf.float32)
+    encoder_output = tf.constant(
+        np.random.randn(BATCH_SIZE, INPUT_LENGTH, 8), dtype=tf.float32)
+    encoder_decoder_attention_bias = tf.zeros([BATCH_SIZE, 1, 1, INPUT_LENGTH])
+    bias = common_attention.attention_bias_lower_triangle(length)
+
+    # Without a cache, position i is decoded from the whole prefix.
+    slow_outputs = []
+    for i in range(length):
+      with tf.variable_scope("body", reuse=tf.AUTO_REUSE):
+        output, _ = universal_transformer_util.universal_transformer_decoder(
+            decoder_input[:, :i + 1], encoder_output,
+            bias[:, :, :i + 1, :i + 1], encoder_decoder_attention_bias,
+            hparams)
+      slow_outputs.append(output[:, -1])
+
+    with tf.variable_scope("body", reuse=True):
+      cache = universal_transformer_util.universal_transformer_decoder_cache(
+          BATCH_SIZE, hparams, encoder_output=encoder_output)
+      fast_outputs = []
+      for i in range(length):
+        output, _ = universal_transformer_util.universal_transformer_decoder(
+            decoder_input[:, i:i + 1], encoder_output,
+            bias[:, :, i:i + 1, :i + 1], encoder_decoder_attention_bias,
+            hparams, cache=cache, decode_position=tf.constant(i))
+        fast_outputs.append(output[:, -1])
+
+    with self.test_session() as session:
+      session.run(tf.global_variables_initializer())
+      slow_res, fast_res = session.run(
+          [tf.stack(slow_outputs, axis=1), tf.stack(fast_outputs, axis=1)])
+    self.assertAllClose(slow_res, fast_res, atol=1e-5)
+
+  def testDecoderWithCacheAct(self):
+    self._testDecoderWithCache("basic")
+
+  def testDecoderWithCacheActAccumulated(self):
+    self._testDecoderWithCache("accumulated")
+
+  def _testSlowVsFast(self, hparams, has_input=True):
+    hparams.num_rec_steps = 2
+    hparams.act_max_steps = 4
+    model, features = self.get_model(hparams, has_input=has_input)
+
+    decode_length = 3
+    beam_size = 2
+
+    out_logits, _ = model(features)
+    out_logits = tf.squeeze(out_logits, axis=[2, 3])
+    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+        logits=tf.reshape(out_logits, [-1, VOCAB_SIZE]),
+        labels=tf.reshape(features["targets"], [-1]))
+    loss = tf.reduce_mean(loss)
+    apply_grad = tf.train.AdamOptimizer(0.001).minimize(loss)
+
+    with self.test_session():
+      tf.global_variables_initializer().run()
+      for _ in range(50):
+        apply_grad.run()
+
+    model.set_mode(tf.estimator.ModeKeys.PREDICT)
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      slow_greedy = model._slow_greedy_infer(features, decode_length)["outputs"]
+      slow_greedy = tf.squeeze(slow_greedy, axis=[2, 3])
+      fast_greedy = model._greedy_infer(features, decode_length)["outputs"]
+      if not has_input:
+        # The slow beam search takes the batch size from the inputs and
+        # expects the caller to provide the partial targets.
+        features["inputs"] = features["targets"]
+        features["partial_targets"] = tf.squeeze(features["targets"],
+                                                 axis=[2, 3])
+      slow_beam = model._beam_decode_slow(features, decode_length, beam_size,
+                                          top_beams=1, alpha=1.0)["outputs"]
+      fast_beam = model._beam_decode(features, decode_length, beam_size,
+                                     top_beams=1, alpha=1.0)["outputs"]
+
+    with self.test_session():
+      slow_greedy_res, fast_greedy_res, slow_beam_res, fast_beam_res = (
+          tf.get_default_session().run(
+              [slow_greedy, fast_greedy, slow_beam, fast_beam]))
+
+    if has_input:
+      self.assertEqual(fast_greedy_res.shape,
+                       (BATCH_SIZE, INPUT_LENGTH + decode_length))
+    else:
+      self.assertEqual(fast_greedy_res.shape, (BATCH_SIZE, decode_length))
+    self.assertAllClose(slow_greedy_res, fast_greedy_res)
+    self.assertAllClose(slow_beam_res, fast_beam_res)
+
+  def testSlowVsFast(self):
+    self._testSlowVsFast(universal_transformer.universal_transformer_base())
+
+  def testSlowVsFastFc(self):
+    self._testSlowVsFast(universal_transformer.universal_transformer_fc_base())
+
+  def testSlowVsFastAct(self):
+    self._testSlowVsFast(
+        universal_transformer.adaptive_universal_transformer_base())
+
+  def testSlowVsFastActAccumulatedNoInput(self):
+    self._testSlowVsFast(
+        universal_transformer.adaptive_universal_transformer_accumulated_tiny(),
+        has_input=False)
+
 
 if __name__ == "__main__":
   tf.test.main()
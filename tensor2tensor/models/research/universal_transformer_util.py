@@ -135,7 +135,9 @@ def universal_transformer_decoder(decoder_input,
                                   name="decoder",
                                   nonpadding=None,
                                   save_weights_to=None,
-                                  make_image_summary=True):
+                                  make_image_summary=True,
+                                  cache=None,
+                                  decode_position=None):
   """Universal Transformer decoder function.
 
   Prepares all the arguments and the inputs and passes it to a
@@ -159,6 +161,11 @@ def universal_transformer_decoder(decoder_input,
       for vizualization; the weights tensor will be appended there under
       a string key created from the variable scope (including name).
     make_image_summary: Whether to make an attention image summary.
+    cache: optional dict of Tensors, see universal_transformer_decoder_cache.
+      If given, decoder_input only holds the new positions and the decoder
+      runs incrementally using the states cached for the previous ones.
+    decode_position: scalar Tensor, the position of the first entry of
+      decoder_input. Required with cache.
 
   Returns:
     y: the output Tensors
@@ -184,12 +191,102 @@ def universal_transformer_decoder(decoder_input,
         save_weights_to=save_weights_to,
         make_image_summary=make_image_summary)
 
-    x, extra_output = universal_transformer_layer(
-        x, hparams, ffn_unit, attention_unit)
+    if cache is not None:
+      x, extra_output = universal_transformer_layer_with_cache(
+          x, hparams, ffn_unit, attention_unit, cache, decode_position)
+    else:
+      x, extra_output = universal_transformer_layer(
+          x, hparams, ffn_unit, attention_unit)
 
     return common_layers.layer_preprocess(x, hparams), extra_output
 
 
+def incremental_decoding_supported(hparams):
+  """Whether the decoder can run incrementally with a cache.
+
+  Args:
+    hparams: model hyper-parameters
+
+  Returns:
+    a boolean.
+  """
+  if hparams.recurrence_type == "act":
+    # Global halting depends on the whole sequence and random halting is
+    # not reproducible, so only position-wise ACT can be decoded with a cache.
+    recurrence_supported = hparams.act_type in ("basic", "accumulated")
+  else:
+    recurrence_supported = hparams.recurrence_type == "basic"
+  if hparams.transformer_ffn_type == "fc":
+    ffn_supported = hparams.ffn_layer == "dense_relu_dense"
+  else:
+    ffn_supported = hparams.transformer_ffn_type == "sepconv"
+  return (recurrence_supported and ffn_supported and
+          hparams.self_attention_type == "dot_product" and
+          not hparams.position_start_index and not hparams.add_sru and
+          not hparams.mix_with_transformer and
+          hparams.pos in (None, "timing"))
+
+
+def universal_transformer_decoder_cache(batch_size,
+                                        hparams,
+                                        encoder_output=None,
+                                        name="decoder"):
+  """Creates the initial cache for incremental decoding.
+
+  The cache holds the self-attention keys and values (and the inputs of the
+  separable convolutions) of every recurrence step under "step_%d", since the
+  steps share their weights but not their states. With ACT, "act_steps" is the
+  number of steps the decoded positions of every batch entry needed. Must be
+  called in the variable scope of the model body.
+
+  Args:
+    batch_size: an integer scalar.
+    hparams: model hyper-parameters
+    encoder_output: optional Tensor with shape [batch_size, input_length,
+      hidden_dim], the keys and values of the encoder-decoder attention
+      are computed from it once.
+    name: a string, the variable scope of the decoder.
+
+  Returns:
+    a dict of Tensors.
+  """
+  key_channels = hparams.attention_key_channels or hparams.hidden_size
+  value_channels = hparams.attention_value_channels or hparams.hidden_size
+  if hparams.recurrence_type == "act":
+    num_steps = hparams.act_max_steps
+  else:
+    num_steps = hparams.num_rec_steps
+
+  cache = {}
+  for step in range(num_steps):
+    step_cache = {
+        "k": common_attention.split_heads(
+            tf.zeros([batch_size, 0, key_channels]), hparams.num_heads),
+        "v": common_attention.split_heads(
+            tf.zeros([batch_size, 0, value_channels]), hparams.num_heads),
+    }
+    if hparams.transformer_ffn_type == "sepconv":
+      step_cache["f"] = tf.zeros([batch_size, 0, 1, hparams.hidden_size])
+      step_cache["h"] = tf.zeros([batch_size, 0, 1, hparams.filter_size])
+    cache["step_%d" % step] = step_cache
+  if hparams.recurrence_type == "act":
+    cache["act_steps"] = tf.zeros([batch_size], dtype=tf.int32)
+
+  if encoder_output is not None:
+    with tf.variable_scope(
+        "%s/universal_transformer_%s/encdec_attention/multihead_attention" %
+        (name, hparams.recurrence_type)):
+      k_encdec = common_attention.compute_attention_component(
+          encoder_output, key_channels, name="k")
+      v_encdec = common_attention.compute_attention_component(
+          encoder_output, value_channels, name="v")
+    cache["k_encdec"] = common_attention.split_heads(k_encdec,
+                                                     hparams.num_heads)
+    cache["v_encdec"] = common_attention.split_heads(v_encdec,
+                                                     hparams.num_heads)
+  return cache
+
+
 def universal_transformer_layer(x,
                                 hparams,
                                 ffn_unit,
@@ -258,6 +355,134 @@ def universal_transformer_layer(x,
     return output, extra_output
 
 
+def universal_transformer_layer_with_cache(x,
+                                           hparams,
+                                           ffn_unit,
+                                           attention_unit,
+                                           cache,
+                                           position):
+  """Applies the universal transformer layer to new positions only.
+
+  Every recurrence step attends to the keys and values it computed for the
+  previous positions, which are read from and appended to the cache. With
+  ACT, universal_transformer_act keeps updating all positions as long as one
+  of them is still running, so the new positions are updated for as many
+  steps as the previous positions needed (cache["act_steps"]) or they need
+  themselves. The states of all act_max_steps steps are computed regardless,
+  as later positions may run longer.
+
+  Args:
+    x: input with the new positions, [batch_size, length, hidden_size]
+    hparams: model hyper-parameters
+    ffn_unit: feed-forward unit
+    attention_unit: multi-head attention unit
+    cache: dict of Tensors, see universal_transformer_decoder_cache.
+    position: scalar Tensor, the position of the first entry of x.
+
+  Returns:
+    the output tensor,  extra output (can be memory, ponder time, etc.)
+
+  Raises:
+    ValueError: Recurrence type without support for caching.
+  """
+  if not incremental_decoding_supported(hparams):
+    raise ValueError("Caching is not supported for recurrence type %s." %
+                     hparams.recurrence_type)
+
+  def transform(state, step):
+    """Applies attention_unit and ffn_unit with the cache of the step."""
+    step_name = "step_%d" % step
+    layer_cache = dict(cache[step_name])
+    if "k_encdec" in cache:
+      layer_cache["k_encdec"] = cache["k_encdec"]
+      layer_cache["v_encdec"] = cache["v_encdec"]
+    state = ffn_unit(attention_unit(state, cache=layer_cache),
+                     cache=layer_cache)
+    cache[step_name] = {key: layer_cache[key] for key in cache[step_name]}
+    return state
+
+  # The scope is entered anew for every step, so that the layers without an
+  # explicit name get the same variables in all the steps, as in the tf.foldl
+  # or tf.while_loop body of universal_transformer_layer.
+  scope_name = "universal_transformer_%s" % hparams.recurrence_type
+
+  if hparams.recurrence_type == "basic":
+    state = x
+    for step in range(hparams.num_rec_steps):
+      with tf.variable_scope(scope_name, reuse=tf.AUTO_REUSE):
+        state = step_preprocess(state, step, hparams, position=position)
+        state = transform(state, step)
+    return state, x
+
+  act_max_steps = hparams.act_max_steps
+  threshold = 1.0 - hparams.act_epsilon
+  batch_size, length = common_layers.shape_list(x)[:2]
+  halting_probability = tf.zeros([batch_size, length])
+  remainders = tf.zeros([batch_size, length])
+  n_updates = tf.zeros([batch_size, length])
+  new_state = tf.zeros_like(x)
+  act_steps = tf.zeros([batch_size, length], dtype=tf.int32)
+  previous_act_steps = tf.reduce_max(cache["act_steps"])
+
+  state = x
+  for step in range(act_max_steps):
+    running = tf.logical_and(
+        tf.less(halting_probability, threshold),
+        tf.less(n_updates, act_max_steps))
+    act_steps += tf.to_int32(running)
+    # Whether the tf.while_loop of universal_transformer_act over all the
+    # positions would run this step.
+    update = tf.logical_or(
+        tf.less(step, previous_act_steps), tf.reduce_any(running))
+
+    with tf.variable_scope(scope_name, reuse=tf.AUTO_REUSE):
+      state = step_preprocess(state, step, hparams, position=position)
+
+      with tf.variable_scope("sigmoid_activation_for_pondering"):
+        p = common_layers.dense(
+            state,
+            1,
+            activation=tf.nn.sigmoid,
+            use_bias=True,
+            bias_initializer=tf.constant_initializer(
+                hparams.act_halting_bias_init))
+        p = tf.squeeze(p, axis=-1)
+
+      state = transform(state, step)
+
+    # Same updates as in universal_transformer_act_basic and
+    # universal_transformer_act_accumulated.
+    still_running = tf.cast(tf.less(halting_probability, 1.0), tf.float32)
+    new_halted = tf.cast(
+        tf.greater(halting_probability + p * still_running, threshold),
+        tf.float32) * still_running
+    still_running = tf.cast(
+        tf.less_equal(halting_probability + p * still_running, threshold),
+        tf.float32) * still_running
+    updated_halting_probability = halting_probability + p * still_running
+    updated_remainders = remainders + new_halted * (
+        1 - updated_halting_probability)
+    updated_halting_probability += new_halted * updated_remainders
+    updated_n_updates = n_updates + still_running + new_halted
+    update_weights = tf.expand_dims(
+        p * still_running + new_halted * updated_remainders, -1)
+    if hparams.act_type == "basic":
+      updated_state = ((state * update_weights) +
+                       (new_state * 1 - update_weights))
+    else:
+      updated_state = new_state + state * update_weights
+
+    halting_probability = tf.where(update, updated_halting_probability,
+                                   halting_probability)
+    remainders = tf.where(update, updated_remainders, remainders)
+    n_updates = tf.where(update, updated_n_updates, n_updates)
+    new_state = tf.where(update, updated_state, new_state)
+
+  cache["act_steps"] = tf.maximum(cache["act_steps"],
+                                  tf.reduce_max(act_steps, axis=1))
+  return new_state, (n_updates, remainders)
+
+
 def get_ut_layer(x,
                  hparams,
                  ffn_unit,
@@ -447,7 +672,8 @@ def transformer_encoder_attention_unit(x,
 
 def transformer_decoder_ffn_unit(x,
                                  hparams,
-                                 nonpadding_mask=None):
+                                 nonpadding_mask=None,
+                                 cache=None):
   """Applies a feed-forward function which is parametrised for decoding.
 
   Args:
@@ -458,6 +684,8 @@ def transformer_decoder_ffn_unit(x,
     to mask out padding in convoltutional layers.  We generally only
     need this mask for "packed" datasets, because for ordinary datasets,
     no padding is ever followed by nonpadding.
+    cache: optional dict with the previous inputs of the separable
+      convolutions, used for fast decoding.
 
   Returns:
     the output tensor
@@ -481,7 +709,8 @@ def transformer_decoder_ffn_unit(x,
           second_kernel_size=(5, 1),
           padding="LEFT",
           nonpadding_mask=nonpadding_mask,
-          dropout=hparams.relu_dropout)
+          dropout=hparams.relu_dropout,
+          cache=cache)
 
     x = common_layers.layer_postprocess(x, y, hparams)
 
@@ -495,7 +724,8 @@ def transformer_decoder_attention_unit(x,
                                        encoder_decoder_attention_bias,
                                        attention_dropout_broadcast_dims,
                                        save_weights_to=None,
-                                       make_image_summary=True):
+                                       make_image_summary=True,
+                                       cache=None):
   """Applies multihead attention function which is parametrised for decoding.
 
   Args:
@@ -513,6 +743,9 @@ def transformer_decoder_attention_unit(x,
       visualization; the weights tensor will be appended there under a string
       key created from the variable scope (including name).
     make_image_summary: Whether to make an attention image summary.
+    cache: optional dict with the self-attention keys and values of the
+      previous positions and the encoder-decoder attention keys and values,
+      used for fast decoding.
 
   Returns:
     The output tensor
@@ -531,7 +764,7 @@ def transformer_decoder_attention_unit(x,
         attention_type=hparams.self_attention_type,
         save_weights_to=save_weights_to,
         max_relative_position=hparams.max_relative_position,
-        cache=None,
+        cache=cache,
         make_image_summary=make_image_summary,
         dropout_broadcast_dims=attention_dropout_broadcast_dims)
     x = common_layers.layer_postprocess(x, y, hparams)
@@ -547,6 +780,7 @@ def transformer_decoder_attention_unit(x,
           hparams.num_heads,
           hparams.attention_dropout,
           save_weights_to=save_weights_to,
+          cache=cache,
           make_image_summary=make_image_summary,
           dropout_broadcast_dims=attention_dropout_broadcast_dims)
       x = common_layers.layer_postprocess(x, y, hparams)
@@ -1161,7 +1395,7 @@ def universal_transformer_act_basic(x, hparams, ffn_unit, attention_unit):
           use_bias=True,
           bias_initializer=tf.constant_initializer(
               hparams.act_halting_bias_init))
-      p = tf.squeeze(p)
+      p = tf.squeeze(p, axis=-1)
 
     # Mask for inputs which have not halted yet
     still_running = tf.cast(tf.less(halting_probability, 1.0), tf.float32)
@@ -1313,7 +1547,7 @@ def universal_transformer_act_accumulated(x, hparams, ffn_unit, attention_unit):
           use_bias=True,
           bias_initializer=tf.constant_initializer(
               hparams.act_halting_bias_init))
-      p = tf.squeeze(p)
+      p = tf.squeeze(p, axis=-1)
 
     # Mask for inputs which have not halted yet
     still_running = tf.cast(tf.less(halting_probability, 1.0), tf.float32)
@@ -1838,13 +2072,15 @@ def add_depth_embedding(x):
   return x
 
 
-def step_preprocess(x, step, hparams):
+def step_preprocess(x, step, hparams, position=None):
   """Preprocess the input at the beginning of each step.
 
   Args:
     x: input tensor
     step: step
     hparams: model hyper-parameters
+    position: optional scalar Tensor, the position of the first entry of x
+      when decoding incrementally.
 
   Returns:
     preprocessed input.
@@ -1853,7 +2089,7 @@ def step_preprocess(x, step, hparams):
   original_channel_size = common_layers.shape_list(x)[-1]
 
   if hparams.add_position_timing_signal:
-    x = add_position_timing_signal(x, step, hparams)
+    x = add_position_timing_signal(x, step, hparams, position=position)
 
   if hparams.add_step_timing_signal:
     x = add_step_timing_signal(x, step, hparams)
@@ -1870,13 +2106,15 @@ def step_preprocess(x, step, hparams):
   return x
 
 
-def add_position_timing_signal(x, step, hparams):
+def add_position_timing_signal(x, step, hparams, position=None):
   """Add n-dimensional embedding as the position (horizontal) timing signal.
 
   Args:
     x: a tensor with shape [batch, length, depth]
     step: step
     hparams: model hyper parameters
+    position: optional scalar Tensor, the position of the first entry of x
+      when decoding incrementally. Only supported without position shifting.
 
   Returns:
     a Tensor with the same shape as x.
@@ -1884,7 +2122,7 @@ def add_position_timing_signal(x, step, hparams):
   """
 
   if not hparams.position_start_index:
-    index = 0
+    index = 0 if position is None else position
 
   elif hparams.position_start_index == "random":
     # Shift all positions randomly
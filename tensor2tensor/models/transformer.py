@@ -25,6 +25,7 @@ description of the model and the results obtained with its early version.
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import numpy as np
 from six.moves import range  # pylint: disable=redefined-builtin
 
 from tensor2tensor.data_generators import librispeech
@@ -96,7 +97,8 @@ class Transformer(t2t_model.T2TModel):
              cache=None,
              decode_loop_step=None,
              nonpadding=None,
-             losses=None):
+             losses=None,
+             preallocated_cache_step=None):
     """Decode Transformer outputs from encoder representation.
 
     Args:
@@ -115,6 +117,8 @@ class Transformer(t2t_model.T2TModel):
           Only used for inference on TPU.
       nonpadding: optional Tensor with shape [batch_size, decoder_length]
       losses: optional list onto which to append extra training losses
+      preallocated_cache_step: An integer, step number of the decoding loop
+          when the self-attention cache is preallocated for all positions.
 
     Returns:
       Final decoder representation. [batch_size, decoder_length, hidden_dim]
@@ -132,7 +136,8 @@ class Transformer(t2t_model.T2TModel):
         decode_loop_step=decode_loop_step,
         nonpadding=nonpadding,
         save_weights_to=self.attention_weights,
-        losses=losses)
+        losses=losses,
+        preallocated_cache_step=preallocated_cache_step)
 
     if (common_layers.is_on_tpu() and
         hparams.mode == tf.estimator.ModeKeys.TRAIN):
@@ -503,6 +508,8 @@ class Transformer(t2t_model.T2TModel):
           "Decoding not supported on packed datasets "
           " If you want to decode from a dataset, use the non-packed version"
           " of the dataset when decoding.")
+    decode_hparams = self._decode_hparams
+    shortlist = None
     if self.has_input:
       inputs = features["inputs"]
       if target_modality.is_class_modality:
@@ -512,6 +519,18 @@ class Transformer(t2t_model.T2TModel):
             common_layers.shape_list(inputs)[1] + features.get(
                 "decode_length", decode_length))
 
+      if decode_hparams.vocab_shortlist_size:
+        # Restrict the softmax to a per-example set of candidate ids.
+        if decode_hparams.vocab_shortlist_size <= beam_search.EOS_ID:
+          raise ValueError("vocab_shortlist_size must include the EOS id.")
+        lexicon = None
+        if decode_hparams.vocab_shortlist_lexicon:
+          lexicon = _vocab_shortlist_lexicon(
+              decode_hparams.vocab_shortlist_lexicon)
+        shortlist, shortlist_bias = common_layers.vocab_shortlist(
+            tf.reshape(inputs, [common_layers.shape_list(inputs)[0], -1]),
+            decode_hparams.vocab_shortlist_size, lexicon)
+
       # TODO(llion): Clean up this reshaping logic.
       inputs = tf.expand_dims(inputs, axis=1)
       if len(inputs.shape) < 5:
@@ -599,9 +618,49 @@ class Transformer(t2t_model.T2TModel):
       decoder_self_attention_bias += common_attention.attention_bias_proximal(
           decode_length)
 
+    preallocate_cache = self._decode_hparams.preallocate_cache
+    # conv_relu_conv only keeps the last position when a cache is given, so it
+    # can not process the partial targets in one pass.
+    prefill_partial_targets = (
+        partial_targets is not None and hparams.ffn_layer != "conv_relu_conv")
+    # Forcing the partial targets in the loop needs them for every batch entry.
+    compact_batch_every = (
+        self._decode_hparams.compact_batch_every
+        if partial_targets is None or prefill_partial_targets else 0)
+
+    def prefill_fn(ids, cache):
+      """Runs the decoder over the partial targets to fill the cache."""
+      length = common_layers.shape_list(ids)[1]
+      targets = tf.expand_dims(tf.expand_dims(ids, axis=2), axis=3)
+      # _shard_features called to ensure that the variable names match
+      targets = self._shard_features({"targets": targets})["targets"]
+      with tf.variable_scope(target_modality.name):
+        targets = target_modality.targets_bottom_sharded(targets, dp)[0]
+      targets = common_layers.flatten4d3d(targets)
+      # Position i is fed the id decoded at step i - 1, and zeros at step 0.
+      targets = common_layers.shift_right_3d(targets)
+      if positional_encoding is not None:
+        targets += positional_encoding[:, :length]
+
+      bias = decoder_self_attention_bias[:, :, :length, :length]
+
+      with tf.variable_scope("body"):
+        dp(self.decode,
+           targets,
+           cache.get("encoder_output"),
+           cache.get("encoder_decoder_attention_bias"),
+           bias,
+           hparams,
+           cache,
+           nonpadding=features_to_nonpadding(features, "targets"))
+      return cache
+
     def symbols_to_logits_fn(ids, i, cache):
       """Go from ids to logits for next symbol."""
       ids = ids[:, -1:]
+      if shortlist is not None:
+        # The decoded ids index into the shortlist of each example.
+        ids = common_layers.gather_from_shortlist(cache["shortlist"], ids)
       targets = tf.expand_dims(tf.expand_dims(ids, axis=2), axis=3)
       targets = preprocess_targets(targets, i)
 
@@ -616,18 +675,22 @@ class Transformer(t2t_model.T2TModel):
             bias,
             hparams,
             cache,
+            preallocated_cache_step=i if preallocate_cache else None,
             nonpadding=features_to_nonpadding(features, "targets"))
 
       with tf.variable_scope(target_modality.name):
-        logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+        if shortlist is None:
+          logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+        else:
+          logits = dp(target_modality.top_with_shortlist, body_outputs,
+                      cache["shortlist"])[0]
 
       ret = tf.squeeze(logits, axis=[1, 2, 3])
-      if partial_targets is not None:
+      if shortlist is not None:
+        ret += cache["shortlist_bias"]
+      if partial_targets is not None and not prefill_partial_targets:
         # If the position is within the given partial targets, we alter the
         # logits to always return those values.
-        # A faster approach would be to process the partial targets in one
-        # iteration in order to fill the corresponding parts of the cache.
-        # This would require broader changes, though.
         vocab_size = tf.shape(ret)[1]
 
         def forced_logits():
@@ -639,18 +702,37 @@ class Transformer(t2t_model.T2TModel):
             tf.less(i, partial_targets_length), forced_logits, lambda: ret)
       return ret, cache
 
-    ret = fast_decode(
-        encoder_output=encoder_output,
-        encoder_decoder_attention_bias=encoder_decoder_attention_bias,
-        symbols_to_logits_fn=symbols_to_logits_fn,
-        hparams=hparams,
-        decode_length=decode_length,
-        vocab_size=target_modality.top_dimensionality,
-        beam_size=beam_size,
-        top_beams=top_beams,
-        alpha=alpha,
-        batch_size=batch_size,
-        force_decode_length=self._decode_hparams.force_decode_length)
+    # The decoder is built twice when prefilling, once for the partial targets
+    # and once inside the decoding loop, so its variables must be shared.
+    with tf.variable_scope(
+        tf.get_variable_scope(),
+        reuse=tf.AUTO_REUSE if prefill_partial_targets else None):
+      ret = fast_decode(
+          encoder_output=encoder_output,
+          encoder_decoder_attention_bias=encoder_decoder_attention_bias,
+          symbols_to_logits_fn=symbols_to_logits_fn,
+          hparams=hparams,
+          decode_length=decode_length,
+          vocab_size=(target_modality.top_dimensionality if shortlist is None
+                      else common_layers.shape_list(shortlist)[1]),
+          beam_size=beam_size,
+          top_beams=top_beams,
+          alpha=alpha,
+          batch_size=batch_size,
+          force_decode_length=self._decode_hparams.force_decode_length,
+          preallocate_cache=preallocate_cache,
+          partial_targets=(
+              partial_targets if prefill_partial_targets else None),
+          prefill_fn=prefill_fn,
+          compact_batch_every=compact_batch_every,
+          per_beam_topk=self._decode_hparams.per_beam_topk,
+          cache_extras=(None if shortlist is None else {
+              "shortlist": shortlist,
+              "shortlist_bias": shortlist_bias
+          }))
+    if shortlist is not None:
+      ret["outputs"] = common_layers.gather_from_shortlist(
+          shortlist, ret["outputs"])
     if partial_targets is not None:
       if beam_size <= 1 or top_beams <= 1:
         ret["outputs"] = ret["outputs"][:, partial_targets_length:]
@@ -798,6 +880,46 @@ def fast_decode_tpu(encoder_output,
   return {"outputs": decoded_ids, "scores": scores}
 
 
+def _vocab_shortlist_lexicon(path):
+  """Loads the lexicon of common_layers.vocab_shortlist from a .npy file.
+
+  The lexicon is held in a local variable initialized by reading the file in
+  the graph rather than in a constant, so that it is neither embedded in the
+  GraphDef, whose size is limited to 2GB, nor looked up in checkpoints. The
+  file is an asset of the exported SavedModels.
+
+  Args:
+    path: str, path of a C-ordered little-endian int32 or int64 array with
+      shape [source_vocab_size, k], as written by np.save.
+
+  Returns:
+    an int32 Tensor with shape [source_vocab_size, k].
+
+  Raises:
+    ValueError: if the array can not be read in the graph.
+  """
+  with tf.gfile.Open(path, "rb") as f:
+    if np.lib.format.read_magic(f) == (1, 0):
+      shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+      shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    offset = f.tell()
+  if fortran_order or dtype.str not in ("<i4", "<i8") or len(shape) != 2:
+    raise ValueError("The vocab_shortlist_lexicon must be a 2-D C-ordered "
+                     "little-endian int32 or int64 array, got %s." % path)
+  path = tf.constant(path, name="vocab_shortlist_lexicon_path")
+  tf.add_to_collection(tf.GraphKeys.ASSET_FILEPATHS, path)
+  values = tf.decode_raw(
+      tf.substr(tf.read_file(path), offset,
+                int(np.prod(shape)) * dtype.itemsize),
+      tf.as_dtype(dtype))
+  return tf.Variable(
+      tf.to_int32(tf.reshape(values, shape)),
+      trainable=False,
+      collections=[tf.GraphKeys.LOCAL_VARIABLES],
+      name="vocab_shortlist_lexicon")
+
+
 def fast_decode(encoder_output,
                 encoder_decoder_attention_bias,
                 symbols_to_logits_fn,
@@ -811,7 +933,13 @@ def fast_decode(encoder_output,
                 eos_id=beam_search.EOS_ID,
                 batch_size=None,
                 force_decode_length=False,
-                scope_prefix="body/"):
+                scope_prefix="body/",
+                preallocate_cache=False,
+                partial_targets=None,
+                prefill_fn=None,
+                compact_batch_every=0,
+                per_beam_topk=False,
+                cache_extras=None):
   """Given encoder output and a symbols to logits function, does fast decoding.
 
   Implements both greedy and beam search decoding, uses beam search iff
@@ -836,6 +964,28 @@ def fast_decode(encoder_output,
     force_decode_length: bool, whether to force the full decode length, or if
       False, stop when all beams hit eos_id.
     scope_prefix: str, prefix for decoder layer variable scopes.
+    preallocate_cache: bool, whether to allocate the self-attention keys and
+      values for all decode_length positions up front and write step i into
+      them, rather than growing them with a concat at every step.
+      symbols_to_logits_fn must then pass the step number as
+      preallocated_cache_step to the decoder.
+    partial_targets: optional int64 Tensor of shape [batch_size,
+      partial_targets_length] with ids the outputs are forced to begin with.
+      Requires prefill_fn. The returned outputs include these ids.
+    prefill_fn: function mapping `(partial_targets, cache)` to the cache
+      obtained by running the decoder over all of partial_targets in a single
+      pass. Decoding then starts at step partial_targets_length.
+    compact_batch_every: int, if positive, every compact_batch_every steps the
+      finished batch entries are removed from the decoding loop together with
+      their cache, so that the remaining steps only compute logits for the
+      unfinished ones. symbols_to_logits_fn must then not depend on per-batch
+      tensors other than the cache. With greedy decoding, the outputs are then
+      padded with 0s after EOS and the scores stop at EOS.
+    per_beam_topk: bool, whether beam search prunes the candidates of every
+      beam to the top 2*beam_size before merging them across beams.
+    cache_extras: optional dict of Tensors with shape [batch_size, ...] to add
+      to the cache, so that they are expanded to the beams and compacted along
+      with it.
 
   Returns:
       A dict of decoding results {
@@ -854,18 +1004,26 @@ def fast_decode(encoder_output,
 
   key_channels = hparams.attention_key_channels or hparams.hidden_size
   value_channels = hparams.attention_value_channels or hparams.hidden_size
-  num_layers = hparams.num_decoder_layers or hparams.num_hidden_layers
+  num_layers = hparams.get("num_decoder_layers") or hparams.num_hidden_layers
   vars_3d_num_heads = (
       hparams.num_heads if hparams.get("attention_variables_3d") else 0)
 
+  def self_attention_cache(channels):
+    """Initial self-attention keys or values of a decoder layer."""
+    if preallocate_cache and partial_targets is None:
+      # The decoder writes the keys and values of step i in place at position
+      # i (see common_attention.update_preallocated_cache), so every run needs
+      # a fresh buffer rather than a constant.
+      return common_layers.tf_inplace_ops().empty(
+          [batch_size, hparams.num_heads, decode_length,
+           channels // hparams.num_heads], tf.float32, init=True)
+    return common_attention.split_heads(
+        tf.zeros([batch_size, 0, channels]), hparams.num_heads)
+
   cache = {
       "layer_%d" % layer: {
-          "k":
-              common_attention.split_heads(
-                  tf.zeros([batch_size, 0, key_channels]), hparams.num_heads),
-          "v":
-              common_attention.split_heads(
-                  tf.zeros([batch_size, 0, value_channels]), hparams.num_heads),
+          "k": self_attention_cache(key_channels),
+          "v": self_attention_cache(value_channels),
           "f":
               tf.zeros([batch_size, 0, hparams.hidden_size]),
       } for layer in range(num_layers)
@@ -891,8 +1049,35 @@ def fast_decode(encoder_output,
     cache["encoder_output"] = encoder_output
     cache["encoder_decoder_attention_bias"] = encoder_decoder_attention_bias
 
+  if cache_extras:
+    cache.update(cache_extras)
+
+  if partial_targets is not None:
+    # Fill the cache for the whole prefix at once instead of feeding it one
+    # token per decoding step.
+    partial_targets_length = common_layers.shape_list(partial_targets)[1]
+    cache = prefill_fn(partial_targets, cache)
+    if preallocate_cache:
+
+      def pad_to_decode_length(tensor):
+        """Pads the time axis of a self-attention cache tensor."""
+        time_axis = tensor.shape.ndims - 2
+        paddings = [[0, 0]] * tensor.shape.ndims
+        paddings[time_axis] = [
+            0, decode_length - common_layers.shape_list(tensor)[time_axis]]
+        return tf.pad(tensor, paddings)
+
+      for layer in range(num_layers):
+        layer_cache = cache["layer_%d" % layer]
+        for key in ["k", "v"]:
+          layer_cache[key] = pad_to_decode_length(layer_cache[key])
+
   if beam_size > 1:  # Beam Search
     initial_ids = sos_id * tf.ones([batch_size], dtype=tf.int32)
+    if partial_targets is not None:
+      initial_ids = tf.concat(
+          [tf.expand_dims(initial_ids, axis=1),
+           tf.to_int32(partial_targets)], axis=1)
     decoded_ids, scores = beam_search.beam_search(
         symbols_to_logits_fn,
         initial_ids,
@@ -902,7 +1087,9 @@ def fast_decode(encoder_output,
         alpha,
         states=cache,
         eos_id=eos_id,
-        stop_early=(top_beams == 1))
+        stop_early=(top_beams == 1),
+        compact_batch_every=compact_batch_every,
+        per_beam_topk=per_beam_topk)
 
     if top_beams == 1:
       decoded_ids = decoded_ids[:, 0, 1:]
@@ -911,23 +1098,72 @@ def fast_decode(encoder_output,
       decoded_ids = decoded_ids[:, :top_beams, 1:]
       scores = scores[:, :top_beams]
   else:  # Greedy
-
-    def inner_loop(i, hit_eos, next_id, decoded_ids, cache, log_prob):
+    compact = compact_batch_every > 0 and not force_decode_length
+
+    def compact_finished(hit_eos, next_id, decoded_ids, cache, log_prob,
+                         compacted):
+      """Stores the results of the finished batch entries and removes them."""
+      done_indices = tf.where(hit_eos)[:, 0]
+      keep_indices = tf.where(tf.logical_not(hit_eos))[:, 0]
+      done_row_ids = beam_search.compact_batch(compacted["row_ids"],
+                                               done_indices)
+      done_ids = beam_search.compact_batch(decoded_ids, done_indices)
+      done_ids = tf.pad(
+          done_ids,
+          [[0, 0], [0, decode_length - common_layers.shape_list(done_ids)[1]]])
+      compacted = {
+          "row_ids": beam_search.compact_batch(compacted["row_ids"],
+                                               keep_indices),
+          "ids": compacted["ids"] + beam_search.scatter_batch(
+              done_ids, done_row_ids, batch_size),
+          "scores": compacted["scores"] + beam_search.scatter_batch(
+              beam_search.compact_batch(log_prob, done_indices),
+              done_row_ids, batch_size),
+      }
+      cache = nest.map_structure(
+          lambda t: beam_search.compact_batch(t, keep_indices), cache)
+      return (beam_search.compact_batch(hit_eos, keep_indices),
+              beam_search.compact_batch(next_id, keep_indices),
+              beam_search.compact_batch(decoded_ids, keep_indices),
+              cache,
+              beam_search.compact_batch(log_prob, keep_indices),
+              compacted)
+
+    def inner_loop(i, hit_eos, next_id, decoded_ids, cache, log_prob,
+                   compacted):
       """One step of greedy decoding."""
       logits, cache = symbols_to_logits_fn(next_id, i, cache)
       log_probs = common_layers.log_prob_from_logits(logits)
       temperature = (0.0 if hparams.sampling_method == "argmax" else
                      hparams.sampling_temp)
       next_id = common_layers.sample_with_temperature(logits, temperature)
+      finished = hit_eos
       hit_eos |= tf.equal(next_id, eos_id)
 
       log_prob_indices = tf.stack(
-          [tf.range(tf.to_int64(batch_size)), next_id], axis=1)
-      log_prob += tf.gather_nd(log_probs, log_prob_indices)
+          [tf.range(tf.to_int64(common_layers.shape_list(next_id)[0])),
+           next_id], axis=1)
+      step_log_prob = tf.gather_nd(log_probs, log_prob_indices)
+      decoded_id = next_id
+      if compact:
+        # Entries are only removed every compact_batch_every steps, so ignore
+        # whatever they decode after EOS in the meantime.
+        step_log_prob *= 1. - tf.to_float(finished)
+        decoded_id = tf.where(finished, tf.zeros_like(next_id), next_id)
+      log_prob += step_log_prob
 
       next_id = tf.expand_dims(next_id, axis=1)
-      decoded_ids = tf.concat([decoded_ids, next_id], axis=1)
-      return i + 1, hit_eos, next_id, decoded_ids, cache, log_prob
+      decoded_ids = tf.concat(
+          [decoded_ids, tf.expand_dims(decoded_id, axis=1)], axis=1)
+      if compact:
+        loop_vars = (hit_eos, next_id, decoded_ids, cache, log_prob, compacted)
+        hit_eos, next_id, decoded_ids, cache, log_prob, compacted = tf.cond(
+            tf.logical_and(
+                tf.equal(tf.mod(i + 1, compact_batch_every), 0),
+                tf.reduce_any(hit_eos)),
+            lambda: compact_finished(*loop_vars),
+            lambda: loop_vars)
+      return i + 1, hit_eos, next_id, decoded_ids, cache, log_prob, compacted
 
     def is_not_finished(i, hit_eos, *_):
       finished = i >= decode_length
@@ -939,21 +1175,50 @@ def fast_decode(encoder_output,
     hit_eos = tf.fill([batch_size], False)
     next_id = sos_id * tf.ones([batch_size, 1], dtype=tf.int64)
     initial_log_prob = tf.zeros([batch_size], dtype=tf.float32)
-    _, _, _, decoded_ids, _, log_prob = tf.while_loop(
+    initial_step = tf.constant(0)
+    if partial_targets is not None:
+      decoded_ids = partial_targets
+      hit_eos = tf.reduce_any(tf.equal(partial_targets, eos_id), axis=1)
+      next_id = tf.concat([next_id, partial_targets], axis=1)[:, -1:]
+      initial_step = tf.convert_to_tensor(partial_targets_length)
+
+    # Results of the batch entries removed by compaction, in their original
+    # rows.
+    compacted = {}
+    cache_shape_invariants = beam_search.get_state_shape_invariants
+    if compact:
+      compacted = {
+          "row_ids": tf.range(batch_size),
+          "ids": tf.zeros([batch_size, decode_length], dtype=tf.int64),
+          "scores": tf.zeros([batch_size], dtype=tf.float32),
+      }
+      cache_shape_invariants = beam_search.get_compacted_state_shape_invariants
+    _, _, _, decoded_ids, _, log_prob, compacted = tf.while_loop(
         is_not_finished,
         inner_loop, [
-            tf.constant(0), hit_eos, next_id, decoded_ids, cache,
-            initial_log_prob
+            initial_step, hit_eos, next_id, decoded_ids, cache,
+            initial_log_prob, compacted
         ],
         shape_invariants=[
             tf.TensorShape([]),
             tf.TensorShape([None]),
             tf.TensorShape([None, None]),
             tf.TensorShape([None, None]),
-            nest.map_structure(beam_search.get_state_shape_invariants, cache),
+            nest.map_structure(cache_shape_invariants, cache),
             tf.TensorShape([None]),
+            nest.map_structure(
+                lambda t: tf.TensorShape([None] * t.shape.ndims), compacted),
         ])
     scores = log_prob
+    if compact:
+      # Merge the entries still in the loop with the ones removed earlier.
+      length = common_layers.shape_list(decoded_ids)[1]
+      decoded_ids = tf.pad(decoded_ids, [[0, 0], [0, decode_length - length]])
+      decoded_ids = compacted["ids"] + beam_search.scatter_batch(
+          decoded_ids, compacted["row_ids"], batch_size)
+      decoded_ids = decoded_ids[:, :length]
+      scores = compacted["scores"] + beam_search.scatter_batch(
+          scores, compacted["row_ids"], batch_size)
 
   return {"outputs": decoded_ids, "scores": scores}
 
@@ -1255,7 +1520,8 @@ def transformer_decoder(decoder_input,
                         nonpadding=None,
                         save_weights_to=None,
                         make_image_summary=True,
-                        losses=None):
+                        losses=None,
+                        preallocated_cache_step=None):
   """A stack of transformer layers.
 
   Args:
@@ -1281,6 +1547,8 @@ def transformer_decoder(decoder_input,
       a string key created from the variable scope (including name).
     make_image_summary: Whether to make an attention image summary.
     losses: optional list onto which to append extra training losses
+    preallocated_cache_step: An integer, step number of the decoding loop when
+        the self-attention cache is preallocated for all positions.
 
   Returns:
     y: a Tensors
@@ -1312,6 +1580,7 @@ def transformer_decoder(decoder_input,
               dropout_broadcast_dims=attention_dropout_broadcast_dims,
               max_length=hparams.get("max_length"),
               decode_loop_step=decode_loop_step,
+              preallocated_cache_step=preallocated_cache_step,
               vars_3d=hparams.get("attention_variables_3d"))
           x = common_layers.layer_postprocess(x, y, hparams)
         if encoder_output is not None:
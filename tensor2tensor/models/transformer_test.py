@@ -17,6 +17,8 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import os
+
 import numpy as np
 
 from tensor2tensor.data_generators import problem_hparams
@@ -152,6 +154,92 @@ class TransformerTest(tf.test.TestCase):
     self.assertEqual(slow_res.shape, (BATCH_SIZE, decode_length))
     self.assertAllClose(slow_res, fast_res)
 
+  def testSlowVsFastNoInputPreallocatedCache(self):
+    if not tf_version_has_inplace_ops():
+      return
+
+    model, features = get_model(
+        transformer.transformer_small(), has_input=False)
+
+    decode_length = 3
+
+    out_logits, _ = model(features)
+    out_logits = tf.squeeze(out_logits, axis=[2, 3])
+    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+        logits=tf.reshape(out_logits, [-1, VOCAB_SIZE]),
+        labels=tf.reshape(features["targets"], [-1]))
+    loss = tf.reduce_mean(loss)
+    apply_grad = tf.train.AdamOptimizer(0.001).minimize(loss)
+
+    with self.test_session():
+      tf.global_variables_initializer().run()
+      for _ in range(100):
+        apply_grad.run()
+
+    model.set_mode(tf.estimator.ModeKeys.PREDICT)
+    model._decode_hparams.preallocate_cache = True
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      slow_result = model._slow_greedy_infer(
+          features, decode_length)["outputs"]
+      slow_result = tf.squeeze(slow_result, axis=[2, 3])
+
+      fast_result = model._greedy_infer(features, decode_length)["outputs"]
+
+    with self.test_session():
+      slow_res = slow_result.eval()
+      fast_res = fast_result.eval()
+
+    self.assertEqual(fast_res.shape, (BATCH_SIZE, decode_length))
+    self.assertAllClose(slow_res, fast_res)
+
+  def testBeamVsFastNoInput(self):
+    model, features = get_model(
+        transformer.transformer_small(), has_input=False)
+
+    decode_length = 2
+
+    out_logits, _ = model(features)
+    out_logits = tf.squeeze(out_logits, axis=[2, 3])
+    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+        logits=tf.reshape(out_logits, [-1, VOCAB_SIZE]),
+        labels=tf.reshape(features["targets"], [-1]))
+    loss = tf.reduce_mean(loss)
+    apply_grad = tf.train.AdamOptimizer(0.001).minimize(loss)
+
+    with self.test_session():
+      tf.global_variables_initializer().run()
+      for _ in range(100):
+        apply_grad.run()
+
+    model.set_mode(tf.estimator.ModeKeys.PREDICT)
+    # The slow beam search takes the batch size from the inputs and expects
+    # the caller to provide the partial targets.
+    features["inputs"] = features["targets"]
+    features["partial_targets"] = tf.squeeze(features["targets"], axis=[2, 3])
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      beam_result = model._beam_decode_slow(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=1,
+          alpha=1.0)["outputs"]
+
+      fast_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=1,
+          alpha=1.0)["outputs"]
+
+    with self.test_session():
+      beam_res = beam_result.eval()
+      fast_res = fast_result.eval()
+
+    self.assertEqual(fast_res.shape, (BATCH_SIZE, decode_length))
+    self.assertAllClose(beam_res, fast_res)
+
   def testBeamDecodeWithRelativeAttention(self):
     decode_length = 2
     model, features = get_model(transformer.transformer_relative_tiny())
@@ -213,6 +301,245 @@ class TransformerTest(tf.test.TestCase):
                      (BATCH_SIZE, INPUT_LENGTH + decode_length))
     self.assertAllClose(beam_res, fast_res)
 
+  def testGreedyFastVsPreallocatedCache(self):
+    if not tf_version_has_inplace_ops():
+      return
+
+    decode_length = 3
+
+    model, features = self._create_greedy_infer_model()
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._greedy_infer(features, decode_length)["outputs"]
+      model._decode_hparams.preallocate_cache = True
+      preallocated_result = model._greedy_infer(
+          features, decode_length)["outputs"]
+
+    with self.test_session():
+      fast_res = fast_result.eval()
+      preallocated_res = preallocated_result.eval()
+
+    self.assertEqual(preallocated_res.shape,
+                     (BATCH_SIZE, INPUT_LENGTH + decode_length))
+    self.assertAllClose(fast_res, preallocated_res)
+
+  def testBeamFastVsPreallocatedCache(self):
+    if not tf_version_has_inplace_ops():
+      return
+
+    decode_length = 2
+
+    model, features = self._create_greedy_infer_model()
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=1,
+          alpha=1.0)["outputs"]
+      model._decode_hparams.preallocate_cache = True
+      preallocated_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=1,
+          alpha=1.0)["outputs"]
+
+    with self.test_session():
+      fast_res = fast_result.eval()
+      preallocated_res = preallocated_result.eval()
+
+    self.assertEqual(preallocated_res.shape,
+                     (BATCH_SIZE, INPUT_LENGTH + decode_length))
+    self.assertAllClose(fast_res, preallocated_res)
+
+  def testGreedyFastVsCompactBatch(self):
+    decode_length = 6
+
+    model, features = self._create_greedy_infer_model(early_eos=True)
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._greedy_infer(features, decode_length)["outputs"]
+      model._decode_hparams.compact_batch_every = 1
+      compact_result = model._greedy_infer(features, decode_length)["outputs"]
+
+    with self.test_session():
+      fast_res = fast_result.eval()
+      compact_res = compact_result.eval()
+
+    # Compacted outputs are padded with 0s after EOS.
+    self.assertEqual(compact_res.shape[0], BATCH_SIZE)
+    self.assertEqual(fast_res[0][0], 1)
+    for fast_ids, compact_ids in zip(fast_res, compact_res):
+      fast_ids = list(fast_ids)
+      length = fast_ids.index(1) + 1 if 1 in fast_ids else len(fast_ids)
+      self.assertAllEqual(fast_ids[:length], compact_ids[:length])
+      self.assertAllEqual([0] * (len(compact_ids) - length),
+                          compact_ids[length:])
+
+  def testBeamFastVsCompactBatch(self):
+    decode_length = 6
+
+    model, features = self._create_greedy_infer_model(early_eos=True)
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=1,
+          alpha=1.0)
+      model._decode_hparams.compact_batch_every = 1
+      compact_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=1,
+          alpha=1.0)
+
+    with self.test_session():
+      fast_res = fast_result["outputs"].eval()
+      fast_scores = fast_result["scores"].eval()
+      compact_res = compact_result["outputs"].eval()
+      compact_scores = compact_result["scores"].eval()
+
+    self.assertAllEqual(fast_res, compact_res)
+    self.assertAllClose(fast_scores, compact_scores)
+
+  def testBeamFastVsPerBeamTopk(self):
+    decode_length = 2
+
+    model, features = self._create_greedy_infer_model()
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=2,
+          alpha=1.0)
+      model._decode_hparams.per_beam_topk = True
+      topk_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=2,
+          alpha=1.0)
+
+    with self.test_session():
+      fast_res = fast_result["outputs"].eval()
+      fast_scores = fast_result["scores"].eval()
+      topk_res = topk_result["outputs"].eval()
+      topk_scores = topk_result["scores"].eval()
+
+    self.assertAllEqual(fast_res, topk_res)
+    self.assertAllClose(fast_scores, topk_scores)
+
+  def testGreedyFastVsVocabShortlist(self):
+    decode_length = 3
+
+    model, features = self._create_greedy_infer_model()
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._greedy_infer(features, decode_length)["outputs"]
+      # A shortlist of the whole vocabulary gives the same outputs.
+      model._decode_hparams.vocab_shortlist_size = VOCAB_SIZE
+      shortlist_result = model._greedy_infer(
+          features, decode_length)["outputs"]
+
+    with self.test_session():
+      fast_res = fast_result.eval()
+      shortlist_res = shortlist_result.eval()
+
+    self.assertAllEqual(fast_res, shortlist_res)
+
+  def testBeamFastVsVocabShortlist(self):
+    decode_length = 2
+
+    model, features = self._create_greedy_infer_model()
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=2,
+          alpha=1.0)["outputs"]
+      model._decode_hparams.vocab_shortlist_size = VOCAB_SIZE
+      shortlist_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=2,
+          alpha=1.0)["outputs"]
+
+    with self.test_session():
+      fast_res = fast_result.eval()
+      shortlist_res = shortlist_result.eval()
+
+    self.assertAllEqual(fast_res, shortlist_res)
+
+  def testGreedyFastVsVocabShortlistLexicon(self):
+    decode_length = 3
+
+    model, features = self._create_greedy_infer_model()
+    lexicon_path = os.path.join(self.get_temp_dir(), "lexicon.npy")
+    np.save(lexicon_path, np.arange(VOCAB_SIZE).reshape([VOCAB_SIZE, 1]))
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._greedy_infer(features, decode_length)["outputs"]
+      model._decode_hparams.vocab_shortlist_size = VOCAB_SIZE
+      model._decode_hparams.vocab_shortlist_lexicon = lexicon_path
+      lexicon_result = model._greedy_infer(
+          features, decode_length)["outputs"]
+
+    # The lexicon is a local variable read from its file, not a constant of
+    # the graph, and the graph can be serialized.
+    self.assertEqual(
+        ["vocab_shortlist_lexicon"],
+        [v.op.name.split("/")[-1] for v in tf.local_variables()
+         if "lexicon" in v.op.name])
+    self.assertNotIn("PyFunc", [op.type for op in
+                                tf.get_default_graph().get_operations()])
+    self.assertEqual(1, len(tf.get_collection(tf.GraphKeys.ASSET_FILEPATHS)))
+    with self.test_session() as session:
+      session.run(tf.local_variables_initializer())
+      fast_res, lexicon_res = session.run([fast_result, lexicon_result])
+
+    self.assertAllEqual(fast_res, lexicon_res)
+
+  def testBeamFastVsVocabShortlistPerBeamTopk(self):
+    decode_length = 2
+
+    model, features = self._create_greedy_infer_model()
+    # With inputs of unknown length, the size of the shortlist is only known
+    # when running the graph.
+    features["inputs"] = tf.placeholder_with_default(
+        features["inputs"], shape=[BATCH_SIZE, None, 1, 1])
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      fast_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=2,
+          alpha=1.0)["outputs"]
+      model._decode_hparams.vocab_shortlist_size = VOCAB_SIZE
+      model._decode_hparams.per_beam_topk = True
+      shortlist_result = model._beam_decode(
+          features,
+          decode_length,
+          beam_size=4,
+          top_beams=2,
+          alpha=1.0)["outputs"]
+
+    with self.test_session():
+      fast_res = fast_result.eval()
+      shortlist_res = shortlist_result.eval()
+
+    self.assertAllEqual(fast_res, shortlist_res)
+
   def testTransformerWithoutProblem(self):
     hparams = transformer.transformer_test()
 
@@ -246,14 +573,23 @@ class TransformerTest(tf.test.TestCase):
       res = session.run(extra_loss["attention_loss"])
     self.assertEqual(res.shape, ())
 
-  def _create_greedy_infer_model(self):
+  def _create_greedy_infer_model(self, early_eos=False):
     """Creates model for greedy inference testing.
 
+    Args:
+      early_eos: A bool, whether to train the model to output EOS right away
+        for the first batch entry.
+
     Returns:
       model: A t2t model.
       features: An map of string to tensor.
     """
     model, features = get_model(transformer.transformer_small())
+    if early_eos:
+      targets = -1 + np.random.random_integers(
+          VOCAB_SIZE, size=(BATCH_SIZE, TARGET_LENGTH, 1, 1))
+      targets[0] = 1
+      features["targets"] = tf.constant(targets, dtype=tf.int32)
 
     out_logits, _ = model(features)
     out_logits = tf.squeeze(out_logits, axis=[2, 3])
@@ -85,6 +85,52 @@ def get_state_shape_invariants(tensor):
   return tf.TensorShape(shape)
 
 
+def get_compacted_state_shape_invariants(tensor):
+  """Returns the shape of the tensor but sets all dims except the last to None.
+
+  Used for loop variables whose batch dimension shrinks during decoding.
+
+  Args:
+    tensor: Tensor whose shape invariants to compute.
+
+  Returns:
+    TensorShape with unknown batch and middle dimensions.
+  """
+  shape = tensor.shape.as_list()
+  for i in range(len(shape) - 1):
+    shape[i] = None
+  return tf.TensorShape(shape)
+
+
+def compact_batch(tensor, indices):
+  """Gathers the batch entries of tensor at indices.
+
+  Args:
+    tensor: Tensor of shape [batch_size, ...].
+    indices: int Tensor of shape [new_batch_size] of batch entries to keep.
+
+  Returns:
+    Tensor of shape [new_batch_size, ...].
+  """
+  return tf.gather(tensor, indices)
+
+
+def scatter_batch(tensor, row_ids, batch_size):
+  """Scatters the batch entries of tensor back to their original rows.
+
+  Args:
+    tensor: Tensor of shape [new_batch_size, ...].
+    row_ids: int Tensor of shape [new_batch_size], the original row of each
+      batch entry.
+    batch_size: int, the original batch size.
+
+  Returns:
+    Tensor of shape [batch_size, ...], zero in the rows not in row_ids.
+  """
+  shape = [batch_size] + common_layers.shape_list(tensor)[1:]
+  return tf.scatter_nd(tf.expand_dims(row_ids, axis=1), tensor, shape)
+
+
 def compute_batch_indices(batch_size, beam_size):
   """Computes the i'th coordinate that contains the batch index for gathers.
 
@@ -177,7 +223,9 @@ def beam_search(symbols_to_logits_fn,
                 alpha,
                 states=None,
                 eos_id=EOS_ID,
-                stop_early=True):
+                stop_early=True,
+                compact_batch_every=0,
+                per_beam_topk=False):
   """Beam search with length penalties.
 
   Requires a function that can take the currently decoded symbols and return
@@ -209,7 +257,9 @@ def beam_search(symbols_to_logits_fn,
         Shoud take [batch_size, decoded_ids] and return [batch_size, vocab_size]
     initial_ids: Ids to start off the decoding, this will be the first thing
         handed to symbols_to_logits_fn (after expanding to beam size)
-        [batch_size]
+        [batch_size]. May also be a prefix of ids [batch_size, prefix_length],
+        in which case decoding starts at step prefix_length - 1 and `states`
+        must already account for the prefix.
     beam_size: Size of the beam.
     decode_length: Number of steps to decode for.
     vocab_size: Size of the vocab, must equal the size of the logits returned by
@@ -218,12 +268,31 @@ def beam_search(symbols_to_logits_fn,
     states: dict (possibly nested) of decoding states.
     eos_id: ID for end of sentence.
     stop_early: a boolean - stop once best sequence is provably determined.
+    compact_batch_every: an integer. If positive and stop_early is set, every
+        compact_batch_every steps the batch entries whose best sequences are
+        provably determined are removed from the loop, so the remaining steps
+        only compute logits for the others. As with stop_early, only the top
+        beam of each batch entry is guaranteed to be the same as without
+        compaction. The batch dimension of `states` is then not invariant
+        either, and symbols_to_logits_fn must not depend on any other
+        per-batch tensors.
+    per_beam_topk: a boolean - if set, each step first takes the top
+        2*beam_size extensions of every beam and only then merges these
+        beam_size * 2*beam_size candidates, instead of sorting the scores of
+        all beam_size * vocab_size extensions. The result is the same up to
+        ties; this is cheaper for large beams.
   Returns:
     Tuple of
     (decoded beams [batch_size, beam_size, decode_length]
      decoding probabilities [batch_size, beam_size])
+
+  Raises:
+    ValueError: if compact_batch_every is set without states.
   """
   batch_size = common_layers.shape_list(initial_ids)[0]
+  compact = compact_batch_every > 0 and stop_early
+  if compact and not states:
+    raise ValueError("Batch compaction requires the decoding states.")
 
   # Assume initial_ids are prob 1.0
   initial_log_probs = tf.constant([[0.] + [-float("inf")] * (beam_size - 1)])
@@ -232,7 +301,9 @@ def beam_search(symbols_to_logits_fn,
 
   # Expand each batch and state to beam_size
   alive_seq = _expand_to_beam_size(initial_ids, beam_size)
-  alive_seq = tf.expand_dims(alive_seq, axis=2)  # (batch_size, beam_size, 1)
+  if initial_ids.shape.ndims == 1:
+    alive_seq = tf.expand_dims(alive_seq, axis=2)  # (batch_size, beam_size, 1)
+  initial_step = common_layers.shape_list(alive_seq)[2] - 1
   if states:
     states = nest.map_structure(
         lambda state: _expand_to_beam_size(state, beam_size), states)
@@ -247,6 +318,10 @@ def beam_search(symbols_to_logits_fn,
   finished_scores = tf.ones([batch_size, beam_size]) * -INF
   finished_flags = tf.zeros([batch_size, beam_size], tf.bool)
 
+  def get_batch_size(tensor):
+    """Returns the batch size inside the loop, which shrinks if compacting."""
+    return common_layers.shape_list(tensor)[0] if compact else batch_size
+
   def grow_finished(finished_seq, finished_scores, finished_flags, curr_seq,
                     curr_scores, curr_finished):
     """Given sequences and scores, will gather the top k=beam size sequences.
@@ -269,6 +344,7 @@ def beam_search(symbols_to_logits_fn,
          log probs of these sequences,
          Finished flags of these sequences)
     """
+    batch_size = get_batch_size(finished_seq)
     # First append a column of 0'ids to finished to make the same length with
     # finished scores
     finished_seq = tf.concat(
@@ -304,6 +380,7 @@ def beam_search(symbols_to_logits_fn,
          log probs of these sequences,
          Finished flags of these sequences)
     """
+    batch_size = get_batch_size(curr_seq)
     # Set the scores of the finished seq in curr_seq to large negative
     # values
     curr_scores += tf.to_float(curr_finished) * -INF
@@ -337,6 +414,7 @@ def beam_search(symbols_to_logits_fn,
          Flags indicating which of these sequences have finished decoding,
          dict of transformed decoding states)
     """
+    batch_size = get_batch_size(alive_seq)
     # Get the logits for all the possible next symbols
     flat_ids = tf.reshape(alive_seq, [batch_size * beam_size, -1])
 
@@ -351,33 +429,54 @@ def beam_search(symbols_to_logits_fn,
 
     logits = tf.reshape(flat_logits, [batch_size, beam_size, -1])
 
-    # Convert logits to normalized log probs
-    candidate_log_probs = common_layers.log_prob_from_logits(logits)
+    length_penalty = tf.pow(((5. + tf.to_float(i + 1)) / 6.), alpha)
 
-    # Multiply the probabilities by the current probabilities of the beam.
-    # (batch_size, beam_size, vocab_size) + (batch_size, beam_size, 1)
-    log_probs = candidate_log_probs + tf.expand_dims(alive_log_probs, axis=2)
+    # The next steps create coordinates for tf.gather_nd to pull out the
+    # correct sequences from id's that we need to grow.
+    # We will also use the coordinates to gather the booleans of the beam items
+    # that survived.
+    batch_pos = compute_batch_indices(batch_size, beam_size * 2)
 
-    length_penalty = tf.pow(((5. + tf.to_float(i + 1)) / 6.), alpha)
+    if per_beam_topk:
+      # The top 2*beams over all beams are among the top 2*beams of each beam,
+      # so only these are normalized and merged.
+      if isinstance(vocab_size, int):
+        beam_k = min(beam_size * 2, vocab_size)
+      else:
+        # The vocabulary is a per-example shortlist of dynamic size.
+        beam_k = tf.minimum(beam_size * 2, vocab_size)
+      beam_logits, beam_ids = tf.nn.top_k(logits, k=beam_k)
+      candidate_log_probs = beam_logits - tf.reduce_logsumexp(
+          logits, axis=2, keepdims=True)
+      log_probs = candidate_log_probs + tf.expand_dims(alive_log_probs, axis=2)
+      flat_curr_scores = tf.reshape(log_probs / length_penalty,
+                                    [-1, beam_size * beam_k])
+
+      topk_scores, topk_index = tf.nn.top_k(flat_curr_scores, k=beam_size * 2)
+      topk_beam_index = topk_index // beam_k
+      topk_ids = tf.gather_nd(
+          beam_ids,
+          tf.stack([batch_pos, topk_beam_index, topk_index % beam_k], axis=2))
+    else:
+      # Convert logits to normalized log probs
+      candidate_log_probs = common_layers.log_prob_from_logits(logits)
 
-    curr_scores = log_probs / length_penalty
-    # Flatten out (beam_size, vocab_size) probs in to a list of possibilities
-    flat_curr_scores = tf.reshape(curr_scores, [-1, beam_size * vocab_size])
+      # Multiply the probabilities by the current probabilities of the beam.
+      # (batch_size, beam_size, vocab_size) + (batch_size, beam_size, 1)
+      log_probs = candidate_log_probs + tf.expand_dims(alive_log_probs, axis=2)
 
-    topk_scores, topk_ids = tf.nn.top_k(flat_curr_scores, k=beam_size * 2)
+      curr_scores = log_probs / length_penalty
+      # Flatten out (beam_size, vocab_size) probs in to a list of possibilities
+      flat_curr_scores = tf.reshape(curr_scores, [-1, beam_size * vocab_size])
 
-    # Recovering the log probs because we will need to send them back
-    topk_log_probs = topk_scores * length_penalty
+      topk_scores, topk_ids = tf.nn.top_k(flat_curr_scores, k=beam_size * 2)
 
-    # Work out what beam the top probs are in.
-    topk_beam_index = topk_ids // vocab_size
-    topk_ids %= vocab_size  # Unflatten the ids
+      # Work out what beam the top probs are in.
+      topk_beam_index = topk_ids // vocab_size
+      topk_ids %= vocab_size  # Unflatten the ids
 
-    # The next three steps are to create coordinates for tf.gather_nd to pull
-    # out the correct sequences from id's that we need to grow.
-    # We will also use the coordinates to gather the booleans of the beam items
-    # that survived.
-    batch_pos = compute_batch_indices(batch_size, beam_size * 2)
+    # Recovering the log probs because we will need to send them back
+    topk_log_probs = topk_scores * length_penalty
 
     # top beams will give us the actual coordinates to do the gather.
     # stacking will create a tensor of dimension batch * beam * 2, where the
@@ -398,8 +497,106 @@ def beam_search(symbols_to_logits_fn,
 
     return topk_seq, topk_log_probs, topk_scores, topk_finished, states
 
+  def get_batch_done(alive_log_probs, finished_scores, finished_in_finished):
+    """Computes which batch entries have their best sequences determined.
+
+    This is the case when the lowest scoring item in finished has a greater
+    score than the highest prob item in alive divided by the max length
+    penalty.
+
+    Args:
+      alive_log_probs: probabilities of the beams. [batch_size, beam_size]
+      finished_scores: scores for each of these sequences.
+        [batch_size, beam_size]
+      finished_in_finished: finished bools for each of these sequences.
+        [batch_size, beam_size]
+
+    Returns:
+      Bool Tensor of shape [batch_size].
+    """
+    max_length_penalty = tf.pow(((5. + tf.to_float(decode_length)) / 6.), alpha)
+    # The best possible score of the most likely alive sequence.
+    lower_bound_alive_scores = alive_log_probs[:, 0] / max_length_penalty
+
+    # Now to compute the lowest score of a finished sequence in finished
+    # If the sequence isn't finished, we multiply it's score by 0. since
+    # scores are all -ve, taking the min will give us the score of the lowest
+    # finished item.
+    lowest_score_of_finished_in_finished = tf.reduce_min(
+        finished_scores * tf.to_float(finished_in_finished), axis=1)
+    # If none of the sequences have finished, then the min will be 0 and
+    # we have to replace it by -ve INF if it is. The score of any seq in alive
+    # will be much higher than -ve INF and the termination condition will not
+    # be met.
+    lowest_score_of_finished_in_finished += (
+        (1. - tf.to_float(tf.reduce_any(finished_in_finished, 1))) * -INF)
+
+    return tf.greater(lowest_score_of_finished_in_finished,
+                      lower_bound_alive_scores)
+
+  def get_final_seq_and_scores(alive_seq, alive_log_probs, finished_seq,
+                               finished_scores, finished_flags):
+    """Picks the finished sequences, or the alive ones if none finished."""
+    # Accounting for corner case: It's possible that no sequence in alive for a
+    # particular batch item ever reached EOS. In that case, we should just copy
+    # the contents of alive for that batch item. tf.reduce_any(finished_flags,
+    # 1) if 0, means that no sequence for that batch index had reached EOS. We
+    # need to do the same for the scores as well.
+    any_finished = tf.reduce_any(finished_flags, 1)
+    return (tf.where(any_finished, finished_seq, alive_seq),
+            tf.where(any_finished, finished_scores, alive_log_probs))
+
+  # Maximum length of the decoded sequences, including the initial id.
+  max_length = decode_length + 1
+
+  def compact_done(batch_done, alive_seq, alive_log_probs, finished_seq,
+                   finished_scores, finished_flags, states, compacted):
+    """Stores the results of the done batch entries and removes them.
+
+    Args:
+      batch_done: bools indicating which batch entries are done. [batch_size]
+      alive_seq: Topk sequences decoded so far [batch_size, beam_size, i+1]
+      alive_log_probs: probabilities of the beams. [batch_size, beam_size]
+      finished_seq: Current finished sequences.
+        [batch_size, beam_size, i+1]
+      finished_scores: scores for each of these sequences.
+        [batch_size, beam_size]
+      finished_flags: finished bools for each of these sequences.
+        [batch_size, beam_size]
+      states: dict (possibly nested) of decoding states.
+      compacted: dict with the original row of each batch entry and the
+        results of the batch entries removed so far.
+
+    Returns:
+      Tuple of the arguments after compaction, excluding batch_done.
+    """
+    done_indices = tf.where(batch_done)[:, 0]
+    keep_indices = tf.where(tf.logical_not(batch_done))[:, 0]
+
+    seq, scores = get_final_seq_and_scores(
+        alive_seq, alive_log_probs, finished_seq, finished_scores,
+        finished_flags)
+    # Done sequences only get 0s appended, so pad them to the final length.
+    seq = tf.pad(seq, [[0, 0], [0, 0],
+                       [0, max_length - common_layers.shape_list(seq)[2]]])
+    done_row_ids = compact_batch(compacted["row_ids"], done_indices)
+    compacted = {
+        "row_ids": compact_batch(compacted["row_ids"], keep_indices),
+        "seq": compacted["seq"] + scatter_batch(
+            compact_batch(seq, done_indices), done_row_ids, batch_size),
+        "scores": compacted["scores"] + scatter_batch(
+            compact_batch(scores, done_indices), done_row_ids, batch_size),
+    }
+    states = nest.map_structure(
+        lambda state: compact_batch(state, keep_indices), states)
+    return (compact_batch(alive_seq, keep_indices),
+            compact_batch(alive_log_probs, keep_indices),
+            compact_batch(finished_seq, keep_indices),
+            compact_batch(finished_scores, keep_indices),
+            compact_batch(finished_flags, keep_indices), states, compacted)
+
   def inner_loop(i, alive_seq, alive_log_probs, finished_seq, finished_scores,
-                 finished_flags, states):
+                 finished_flags, states, compacted):
     """Inner beam search loop.
 
     There are three groups of tensors, alive, finished, and topk.
@@ -432,6 +629,7 @@ def beam_search(symbols_to_logits_fn,
       finished_flags: finished bools for each of these sequences.
         [batch_size, beam_size]
       states: dict (possibly nested) of decoding states.
+      compacted: dict of batch compaction results, empty unless compacting.
 
     Returns:
       Tuple of
@@ -441,7 +639,8 @@ def beam_search(symbols_to_logits_fn,
          New finished sequences,
          Scores of the new finished sequences,
          Flags indicating which sequence in finished as reached EOS,
-         dict of final decoding states)
+         dict of final decoding states,
+         dict of batch compaction results)
     """
 
     # Each inner loop, we carry out three steps:
@@ -456,11 +655,25 @@ def beam_search(symbols_to_logits_fn,
         finished_seq, finished_scores, finished_flags, topk_seq, topk_scores,
         topk_finished)
 
+    if compact:
+      batch_done = get_batch_done(alive_log_probs, finished_scores,
+                                  finished_flags)
+      loop_vars = (alive_seq, alive_log_probs, finished_seq, finished_scores,
+                   finished_flags, states, compacted)
+      (alive_seq, alive_log_probs, finished_seq, finished_scores,
+       finished_flags, states, compacted) = tf.cond(
+           tf.logical_and(
+               tf.equal(tf.mod(i + 1, compact_batch_every), 0),
+               tf.reduce_any(batch_done)),
+           lambda: compact_done(batch_done, *loop_vars),
+           lambda: loop_vars)
+
     return (i + 1, alive_seq, alive_log_probs, finished_seq, finished_scores,
-            finished_flags, states)
+            finished_flags, states, compacted)
 
   def _is_finished(i, unused_alive_seq, alive_log_probs, unused_finished_seq,
-                   finished_scores, finished_in_finished, unused_states):
+                   finished_scores, finished_in_finished, unused_states,
+                   unused_compacted):
     """Checking termination condition.
 
     We terminate when we decoded up to decode_length or the lowest scoring item
@@ -480,45 +693,48 @@ def beam_search(symbols_to_logits_fn,
     """
     if not stop_early:
       return tf.less(i, decode_length)
-    max_length_penalty = tf.pow(((5. + tf.to_float(decode_length)) / 6.), alpha)
-    # The best possible score of the most likely alive sequence.
-    lower_bound_alive_scores = alive_log_probs[:, 0] / max_length_penalty
-
-    # Now to compute the lowest score of a finished sequence in finished
-    # If the sequence isn't finished, we multiply it's score by 0. since
-    # scores are all -ve, taking the min will give us the score of the lowest
-    # finished item.
-    lowest_score_of_finished_in_finished = tf.reduce_min(
-        finished_scores * tf.to_float(finished_in_finished), axis=1)
-    # If none of the sequences have finished, then the min will be 0 and
-    # we have to replace it by -ve INF if it is. The score of any seq in alive
-    # will be much higher than -ve INF and the termination condition will not
-    # be met.
-    lowest_score_of_finished_in_finished += (
-        (1. - tf.to_float(tf.reduce_any(finished_in_finished, 1))) * -INF)
-
     bound_is_met = tf.reduce_all(
-        tf.greater(lowest_score_of_finished_in_finished,
-                   lower_bound_alive_scores))
+        get_batch_done(alive_log_probs, finished_scores, finished_in_finished))
 
     return tf.logical_and(
         tf.less(i, decode_length), tf.logical_not(bound_is_met))
 
+  # Results of the batch entries removed by compaction, in their original rows.
+  compacted = {}
+  if compact:
+    compacted = {
+        "row_ids": tf.range(batch_size),
+        "seq": tf.zeros([batch_size, beam_size, max_length], tf.int32),
+        "scores": tf.zeros([batch_size, beam_size]),
+    }
+    compacted_shape_invariants = {
+        "row_ids": tf.TensorShape([None]),
+        "seq": compacted["seq"].get_shape(),
+        "scores": compacted["scores"].get_shape(),
+    }
+    batch_shape_invariants = tf.TensorShape([None, beam_size])
+    state_shape_invariants = get_compacted_state_shape_invariants
+  else:
+    compacted_shape_invariants = {}
+    batch_shape_invariants = alive_log_probs.get_shape()
+    state_shape_invariants = get_state_shape_invariants
+
   (_, alive_seq, alive_log_probs, finished_seq, finished_scores,
-   finished_flags, _) = tf.while_loop(
+   finished_flags, _, compacted) = tf.while_loop(
        _is_finished,
        inner_loop, [
-           tf.constant(0), alive_seq, alive_log_probs, finished_seq,
-           finished_scores, finished_flags, states
+           tf.convert_to_tensor(initial_step), alive_seq, alive_log_probs,
+           finished_seq, finished_scores, finished_flags, states, compacted
        ],
        shape_invariants=[
            tf.TensorShape([]),
            tf.TensorShape([None, None, None]),
-           alive_log_probs.get_shape(),
+           batch_shape_invariants,
            tf.TensorShape([None, None, None]),
-           finished_scores.get_shape(),
-           finished_flags.get_shape(),
-           nest.map_structure(get_state_shape_invariants, states),
+           batch_shape_invariants,
+           batch_shape_invariants,
+           nest.map_structure(state_shape_invariants, states),
+           compacted_shape_invariants,
        ],
        parallel_iterations=1,
        back_prop=False)
@@ -526,13 +742,17 @@ def beam_search(symbols_to_logits_fn,
   alive_seq.set_shape((None, beam_size, None))
   finished_seq.set_shape((None, beam_size, None))
 
-  # Accounting for corner case: It's possible that no sequence in alive for a
-  # particular batch item ever reached EOS. In that case, we should just copy
-  # the contents of alive for that batch item. tf.reduce_any(finished_flags, 1)
-  # if 0, means that no sequence for that batch index had reached EOS. We need
-  # to do the same for the scores as well.
-  finished_seq = tf.where(
-      tf.reduce_any(finished_flags, 1), finished_seq, alive_seq)
-  finished_scores = tf.where(
-      tf.reduce_any(finished_flags, 1), finished_scores, alive_log_probs)
+  finished_seq, finished_scores = get_final_seq_and_scores(
+      alive_seq, alive_log_probs, finished_seq, finished_scores,
+      finished_flags)
+  if compact:
+    # Merge the entries still in the loop with the ones removed earlier.
+    length = common_layers.shape_list(finished_seq)[2]
+    finished_seq = tf.pad(finished_seq,
+                          [[0, 0], [0, 0], [0, max_length - length]])
+    finished_seq = compacted["seq"] + scatter_batch(
+        finished_seq, compacted["row_ids"], batch_size)
+    finished_seq = finished_seq[:, :, :length]
+    finished_scores = compacted["scores"] + scatter_batch(
+        finished_scores, compacted["row_ids"], batch_size)
   return finished_seq, finished_scores
@@ -369,5 +369,80 @@ class BeamSearchTest(tf.test.TestCase):
       except tf.errors.InvalidArgumentError as e:
         raise AssertionError(e.message)
 
+  def testCompactBatch(self):
+    batch_size = 4
+    beam_size = 2
+    vocab_size = 5
+    decode_length = 10
+
+    initial_ids = tf.constant([0] * batch_size)  # GO
+    rng = np.random.RandomState(0)
+    all_logits = rng.randn(batch_size, decode_length, vocab_size)
+    # Make the first batch entry finish right away so that it gets compacted.
+    all_logits[0, 0, 1] = 10.
+
+    def symbols_to_logits(_, i, states):
+      logits = tf.to_float(states["logits"][:, i])
+      return logits, states
+
+    results = []
+    for compact_batch_every in [0, 1, 3]:
+      states = {"logits": tf.constant(all_logits)}
+      results.append(beam_search.beam_search(
+          symbols_to_logits,
+          initial_ids,
+          beam_size,
+          decode_length,
+          vocab_size,
+          0.6,
+          eos_id=1,
+          states=states,
+          compact_batch_every=compact_batch_every))
+
+    with self.test_session() as sess:
+      (ids, scores), (compact_ids, compact_scores), (ids_3, scores_3) = (
+          sess.run(results))
+
+    # Like stop_early, compaction only determines the top beam exactly.
+    self.assertAllEqual(ids[:, 0], compact_ids[:, 0])
+    self.assertAllClose(scores[:, 0], compact_scores[:, 0])
+    self.assertAllEqual(ids[:, 0], ids_3[:, 0])
+    self.assertAllClose(scores[:, 0], scores_3[:, 0])
+
+  def testPerBeamTopk(self):
+    batch_size = 3
+    decode_length = 6
+
+    initial_ids = tf.constant([0] * batch_size)  # GO
+    rng = np.random.RandomState(0)
+
+    def symbols_to_logits(_, i, states):
+      logits = tf.to_float(states["logits"][:, i])
+      return logits, states
+
+    # The second case has fewer ids than 2 * beam_size.
+    for beam_size, vocab_size in [(3, 20), (4, 5)]:
+      all_logits = rng.randn(batch_size, decode_length, vocab_size)
+      results = []
+      for per_beam_topk in [False, True]:
+        states = {"logits": tf.constant(all_logits)}
+        results.append(beam_search.beam_search(
+            symbols_to_logits,
+            initial_ids,
+            beam_size,
+            decode_length,
+            vocab_size,
+            0.6,
+            eos_id=1,
+            states=states,
+            per_beam_topk=per_beam_topk))
+
+      with self.test_session() as sess:
+        (ids, scores), (topk_ids, topk_scores) = sess.run(results)
+
+      self.assertAllEqual(ids, topk_ids)
+      self.assertAllClose(scores, topk_scores)
+
+
 if __name__ == "__main__":
   tf.test.main()
@@ -75,12 +75,9 @@ def compute_bleu(reference_corpus,
   """
   reference_length = 0
   translation_length = 0
-  bp = 1.0
-  geo_mean = 0
 
   matches_by_order = [0] * max_order
   possible_matches_by_order = [0] * max_order
-  precisions = []
 
   for (references, translations) in zip(reference_corpus, translation_corpus):
     reference_length += len(references)
@@ -96,6 +93,16 @@ def compute_bleu(reference_corpus,
       matches_by_order[len(ngram) - 1] += overlap[ngram]
     for ngram in translation_ngram_counts:
       possible_matches_by_order[len(ngram)-1] += translation_ngram_counts[ngram]
+  return _bleu_from_counts(matches_by_order, possible_matches_by_order,
+                           reference_length, translation_length, use_bp)
+
+
+def _bleu_from_counts(matches_by_order, possible_matches_by_order,
+                      reference_length, translation_length, use_bp):
+  """Computes BLEU score from the n-gram match counts of a corpus."""
+  bp = 1.0
+  geo_mean = 0
+  max_order = len(matches_by_order)
   precisions = [0] * max_order
   smooth = 1.0
   for i in range(0, max_order):
@@ -128,6 +135,98 @@ def compute_bleu(reference_corpus,
   return np.float32(bleu)
 
 
+def batch_ngram_ids(sequences, max_order):
+  """Numbers the n-grams of batches of id sequences.
+
+  Args:
+    sequences: list of 2-D int arrays with shapes [batch_k, length_k].
+    max_order: maximum n-gram order.
+
+  Yields:
+    For each order n from 1 to max_order, a tuple (ngrams, num_ngrams) where
+    ngrams is a list of int64 arrays with shapes
+    [batch_k, max(0, length_k - n + 1)] and equal n-grams across all of the
+    arrays get the same id in [0, num_ngrams).
+  """
+  sequences = [np.asarray(s, dtype=np.int64) for s in sequences]
+
+  def renumber(arrays):
+    flat_ids = np.concatenate([a.ravel() for a in arrays])
+    unique_ids, flat_ids = np.unique(flat_ids, return_inverse=True)
+    splits = np.cumsum([a.size for a in arrays])[:-1]
+    return ([ids.reshape(a.shape)
+             for ids, a in zip(np.split(flat_ids, splits), arrays)],
+            max(1, unique_ids.size))
+
+  tokens, num_tokens = renumber(sequences)
+  ngrams, num_ngrams = tokens, num_tokens
+  for order in range(1, max_order + 1):
+    if order > 1:
+      # Extend the (n-1)-grams by one token, then renumber to keep the ids
+      # small enough for the next order.
+      ngrams, num_ngrams = renumber([
+          g[:, :-1] * num_tokens + t[:, order - 1:]
+          for g, t in zip(ngrams, tokens)
+      ])
+    yield ngrams, num_ngrams
+
+
+def batch_row_ngram_counts(ngrams, num_ngrams):
+  """Counts the n-grams of each row.
+
+  Args:
+    ngrams: int64 array [batch, width] of n-gram ids from batch_ngram_ids.
+    num_ngrams: number of distinct n-gram ids.
+
+  Returns:
+    a tuple of sorted unique keys row * num_ngrams + ngram and their counts.
+  """
+  rows = np.repeat(np.arange(ngrams.shape[0], dtype=np.int64), ngrams.shape[1])
+  return np.unique(rows * num_ngrams + ngrams.ravel(), return_counts=True)
+
+
+def sorted_intersection_indices(a, b):
+  """Returns the indices of the common values of sorted unique arrays a, b."""
+  a_indices = np.minimum(np.searchsorted(a, b), max(0, a.size - 1))
+  b_indices = np.flatnonzero(a[a_indices] == b) if a.size else np.array(
+      [], dtype=np.int64)
+  return a_indices[b_indices], b_indices
+
+
+def compute_batch_bleu(reference_ids, translation_ids, max_order=4,
+                       use_bp=True):
+  """Computes BLEU score of padded batches of ids, see compute_bleu.
+
+  Gives the same result as compute_bleu on the rows of the arrays, but counts
+  the n-grams of the whole batch at once with NumPy.
+
+  Args:
+    reference_ids: int array [batch, reference_length] of references.
+    translation_ids: int array [batch, translation_length] of translations.
+    max_order: Maximum n-gram order to use when computing BLEU score.
+    use_bp: boolean, whether to apply brevity penalty.
+
+  Returns:
+    BLEU score.
+  """
+  batch_size = min(len(reference_ids), len(translation_ids))
+  reference_ids = np.asarray(reference_ids)[:batch_size]
+  translation_ids = np.asarray(translation_ids)[:batch_size]
+  matches_by_order = []
+  possible_matches_by_order = []
+  for (ref_ngrams, trans_ngrams), num_ngrams in batch_ngram_ids(
+      [reference_ids, translation_ids], max_order):
+    ref_keys, ref_counts = batch_row_ngram_counts(ref_ngrams, num_ngrams)
+    trans_keys, trans_counts = batch_row_ngram_counts(trans_ngrams, num_ngrams)
+    ref_indices, trans_indices = sorted_intersection_indices(
+        ref_keys, trans_keys)
+    matches_by_order.append(
+        np.minimum(ref_counts[ref_indices], trans_counts[trans_indices]).sum())
+    possible_matches_by_order.append(trans_ngrams.size)
+  return _bleu_from_counts(matches_by_order, possible_matches_by_order,
+                           reference_ids.size, translation_ids.size, use_bp)
+
+
 def bleu_score(predictions, labels, **unused_kwargs):
   """BLEU score computation between labels and predictions.
 
@@ -147,7 +246,7 @@ def bleu_score(predictions, labels, **unused_kwargs):
   outputs = tf.squeeze(outputs, axis=[-1, -2])
   labels = tf.squeeze(labels, axis=[-1, -2])
 
-  bleu = tf.py_func(compute_bleu, (labels, outputs), tf.float32)
+  bleu = tf.py_func(compute_batch_bleu, (labels, outputs), tf.float32)
   return bleu, tf.constant(1.0)
 
 
@@ -18,6 +18,7 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import numpy as np
 from tensor2tensor.utils import bleu_hook
 
 import tensorflow as tf
@@ -54,6 +55,16 @@ class BleuHookTest(tf.test.TestCase):
     actual_bleu = 0.3436
     self.assertAllClose(bleu, actual_bleu, atol=1e-03)
 
+  def testComputeBatchBleu(self):
+    rng = np.random.RandomState(0)
+    for length in [1, 3, 12]:
+      translations = rng.randint(0, 4, size=(5, length))
+      references = rng.randint(0, 4, size=(5, length + 2))
+      references[0, :length] = translations[0]
+      self.assertAllClose(
+          bleu_hook.compute_batch_bleu(references, translations),
+          bleu_hook.compute_bleu(references, translations))
+
   def testBleuTokenize(self):
     self.assertEqual(bleu_hook.bleu_tokenize(u"hi, “there”"),
                      [u"hi", u",", u"“", u"there", u"”"])
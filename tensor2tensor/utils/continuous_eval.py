@@ -0,0 +1,315 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Continuous evaluation of checkpoints with a persistent graph."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing.pool
+import os
+import threading
+
+import six
+from six.moves import queue
+
+import tensorflow as tf
+
+from tensorflow.python.estimator import estimator as estimator_lib
+from tensorflow.python.training import monitored_session
+
+
+def new_checkpoints(model_dir, timeout_mins=120, seconds_to_sleep=60):
+  """Yields the checkpoints written to model_dir since the last ones yielded.
+
+  Unlike trainer_lib.next_checkpoint, which only yields the latest checkpoint,
+  this also yields the checkpoints written in between that are still listed
+  in the checkpoint state of model_dir.
+
+  Args:
+    model_dir: str, directory of the checkpoints.
+    timeout_mins: int, stop when no new checkpoint was written for that long.
+    seconds_to_sleep: int, time between two looks for a new checkpoint.
+
+  Yields:
+    list<str>, paths of the new checkpoints, oldest first.
+  """
+  last_ckpt = None
+  seen = set()
+  while True:
+    last_ckpt = tf.contrib.training.wait_for_new_checkpoint(
+        model_dir, last_ckpt, seconds_to_sleep=seconds_to_sleep,
+        timeout=60 * timeout_mins)
+
+    if last_ckpt is None:
+      tf.logging.info(
+          "Eval timeout: no new checkpoints within %dm" % timeout_mins)
+      break
+
+    state = tf.train.get_checkpoint_state(model_dir)
+    ckpts = list(state.all_model_checkpoint_paths) if state else []
+    if last_ckpt not in ckpts:
+      ckpts.append(last_ckpt)
+    ckpts = [ckpt for ckpt in ckpts if ckpt not in seen]
+    seen.update(ckpts)
+    yield ckpts
+
+
+class _LockedHook(tf.train.SessionRunHook):
+  """Calls a SessionRunHook while holding a lock shared with other hooks."""
+
+  def __init__(self, hook, lock):
+    self._hook = hook
+    self._lock = lock
+
+  def begin(self):
+    with self._lock:
+      self._hook.begin()
+
+  def after_create_session(self, session, coord):
+    with self._lock:
+      self._hook.after_create_session(session, coord)
+
+  def before_run(self, run_context):
+    with self._lock:
+      return self._hook.before_run(run_context)
+
+  def after_run(self, run_context, run_values):
+    with self._lock:
+      self._hook.after_run(run_context, run_values)
+
+  def end(self, session):
+    with self._lock:
+      self._hook.end(session)
+
+
+class ContinuousEvaluator(object):
+  """Evaluates the checkpoints of an Estimator as they are written.
+
+  Estimator.evaluate builds the graph and the input pipeline again for every
+  checkpoint. Here they are built once, and every checkpoint is restored into
+  the same session, whose dataset iterator and metrics are reset before each
+  evaluation. The results are written to the same summaries as
+  Estimator.evaluate.
+
+  By default only the latest checkpoint is evaluated when several were written
+  during an evaluation, and the others are recorded in skipped_checkpoints.
+  With evaluate_all_checkpoints, every checkpoint is evaluated, num_workers at
+  a time, each worker restoring checkpoints into its own session of the graph.
+  Checkpoints deleted before they could be evaluated are skipped too.
+  """
+
+  def __init__(self,
+               estimator,
+               input_fn,
+               steps=None,
+               hooks=None,
+               name=None,
+               evaluate_all_checkpoints=False,
+               num_workers=1):
+    """Creates a ContinuousEvaluator.
+
+    Args:
+      estimator: tf.estimator.Estimator, not a TPUEstimator.
+      input_fn: function returning a tf.data.Dataset of (features, labels).
+      steps: int, maximum number of batches per evaluation, None to evaluate
+        the whole dataset.
+      hooks: list of SessionRunHooks, called for every evaluation. With
+        num_workers > 1 their calls never overlap, but the hooks see the
+        evaluations of several checkpoints interleaved.
+      name: str, name of the evaluation, as in Estimator.evaluate.
+      evaluate_all_checkpoints: bool, whether to evaluate every new checkpoint
+        rather than only the latest one.
+      num_workers: int, number of checkpoints evaluated at the same time when
+        evaluate_all_checkpoints.
+    """
+    self._estimator = estimator
+    self._input_fn = input_fn
+    self._steps = steps
+    self._hooks = list(hooks or [])
+    self._eval_dir = os.path.join(estimator.model_dir,
+                                  "eval_" + name if name else "eval")
+    self._evaluate_all_checkpoints = evaluate_all_checkpoints
+    self._num_workers = num_workers if evaluate_all_checkpoints else 1
+    self._graph = None
+    self._sessions = queue.Queue()
+    for _ in range(self._num_workers):
+      self._sessions.put(None)
+    self.evaluated_checkpoints = []
+    self.skipped_checkpoints = []
+
+  @property
+  def eval_dir(self):
+    return self._eval_dir
+
+  def _build_graph(self):
+    """Builds the evaluation graph, as Estimator.evaluate does."""
+    estimator = self._estimator
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      tf.set_random_seed(estimator.config.tf_random_seed)
+      global_step = tf.train.create_global_step()
+      # pylint: disable=protected-access
+      features, labels, input_hooks = (
+          estimator._get_features_and_labels_from_input_fn(
+              self._input_fn, tf.estimator.ModeKeys.EVAL))
+      if not input_hooks:
+        raise ValueError("input_fn must return a tf.data.Dataset so that it "
+                         "can be evaluated again for every checkpoint.")
+      spec = estimator._call_model_fn(
+          features, labels, tf.estimator.ModeKeys.EVAL, estimator.config)
+      # pylint: enable=protected-access
+
+      eval_metric_ops = dict(spec.eval_metric_ops)
+      if "loss" in eval_metric_ops:
+        raise ValueError("Metric with name \"loss\" is not allowed, because "
+                         "Estimator already defines a default metric with the "
+                         "same name.")
+      eval_metric_ops["loss"] = tf.metrics.mean(spec.loss)
+      update_ops = []
+      self._final_ops = {}
+      # Sort metrics lexicographically so graph is identical every time.
+      for name, (value_op, update_op) in sorted(
+          six.iteritems(eval_metric_ops)):
+        self._final_ops[name] = value_op
+        update_ops.append(update_op)
+      self._final_ops[tf.GraphKeys.GLOBAL_STEP] = global_step
+      self._update_op = tf.group(*update_ops)
+
+      hooks = self._hooks + list(spec.evaluation_hooks or [])
+      if self._num_workers > 1:
+        # The input hooks only initialize the dataset iterator of the session
+        # they are given, the other hooks are shared by the workers.
+        lock = threading.Lock()
+        hooks = [_LockedHook(hook, lock) for hook in hooks]
+      self._all_hooks = input_hooks + hooks
+      for hook in self._all_hooks:
+        hook.begin()
+      self._scaffold = spec.scaffold
+      self._scaffold.finalize()
+
+  def _new_session(self):
+    config = self._estimator.config
+    return tf.Session(config.evaluation_master, graph=self._graph,
+                      config=config.session_config)
+
+  def evaluate_checkpoint(self, checkpoint_path):
+    """Evaluates a checkpoint.
+
+    Args:
+      checkpoint_path: str, path of the checkpoint.
+
+    Returns:
+      dict of the metrics, the loss and the global step, as returned by
+      Estimator.evaluate, or None if the checkpoint does not exist anymore.
+    """
+    if self._graph is None:
+      self._build_graph()
+    session = self._sessions.get()
+    try:
+      if session is None:
+        session = self._new_session()
+      try:
+        self._scaffold.saver.restore(session, checkpoint_path)
+      except (tf.errors.NotFoundError, ValueError):
+        # The checkpoint was deleted, e.g. because of keep_checkpoint_max.
+        tf.logging.warning("Could not restore %s, skipping it.",
+                           checkpoint_path)
+        return None
+      session.run(self._scaffold.local_init_op)
+
+      # Initializes the dataset iterator, among others.
+      for hook in self._all_hooks:
+        hook.after_create_session(session, None)
+      # pylint: disable=protected-access
+      hooked_session = monitored_session._HookedSession(
+          session, self._all_hooks)
+      # pylint: enable=protected-access
+      step = 0
+      try:
+        while ((self._steps is None or step < self._steps) and
+               not hooked_session.should_stop()):
+          hooked_session.run(self._update_op)
+          step += 1
+      except tf.errors.OutOfRangeError:
+        pass
+      results = session.run(self._final_ops)
+      for hook in self._all_hooks:
+        hook.end(session)
+      return results
+    finally:
+      self._sessions.put(session)
+
+  def _evaluate_checkpoints(self, checkpoints):
+    """Yields (checkpoint, results) for checkpoints, in order."""
+    if self._graph is None:
+      self._build_graph()
+    if self._num_workers > 1 and len(checkpoints) > 1:
+      pool = multiprocessing.pool.ThreadPool(
+          min(self._num_workers, len(checkpoints)))
+      try:
+        for item in pool.imap(
+            lambda ckpt: (ckpt, self.evaluate_checkpoint(ckpt)), checkpoints):
+          yield item
+      finally:
+        pool.terminate()
+        pool.join()
+    else:
+      for ckpt in checkpoints:
+        yield ckpt, self.evaluate_checkpoint(ckpt)
+
+  def run(self, timeout_mins=120, seconds_to_sleep=60):
+    """Evaluates new checkpoints until none is written for timeout_mins.
+
+    Args:
+      timeout_mins: int, stop when no new checkpoint was written for that long.
+      seconds_to_sleep: int, time between two looks for a new checkpoint.
+
+    Returns:
+      dict, results of the last evaluated checkpoint, None if there was none.
+    """
+    last_results = None
+    for checkpoints in new_checkpoints(
+        self._estimator.model_dir, timeout_mins=timeout_mins,
+        seconds_to_sleep=seconds_to_sleep):
+      if not self._evaluate_all_checkpoints:
+        self._skip(checkpoints[:-1])
+        checkpoints = checkpoints[-1:]
+      for ckpt, results in self._evaluate_checkpoints(checkpoints):
+        if results is None:
+          self._skip([ckpt])
+          continue
+        # pylint: disable=protected-access
+        estimator_lib._write_dict_to_summary(
+            self._eval_dir, results, results[tf.GraphKeys.GLOBAL_STEP])
+        # pylint: enable=protected-access
+        self.evaluated_checkpoints.append(ckpt)
+        last_results = results
+    return last_results
+
+  def _skip(self, checkpoints):
+    if checkpoints:
+      tf.logging.info("Skipped evaluation of checkpoints: %s",
+                      ", ".join(checkpoints))
+      self.skipped_checkpoints.extend(checkpoints)
+
+  def close(self):
+    """Closes the sessions."""
+    while not self._sessions.empty():
+      session = self._sessions.get()
+      if session is not None:
+        session.close()
+    for _ in range(self._num_workers):
+      self._sessions.put(None)
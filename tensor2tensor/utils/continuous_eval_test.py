@@ -0,0 +1,169 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for continuous_eval."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+import numpy as np
+
+from tensor2tensor.utils import continuous_eval
+
+import tensorflow as tf
+
+
+def input_fn():
+  x = np.arange(10, dtype=np.float32)
+  dataset = tf.data.Dataset.from_tensor_slices(({"x": x}, 3. * x + 1.))
+  return dataset.batch(3)
+
+
+class CountingModelFn(object):
+  """Linear regression model_fn counting the graphs it builds."""
+
+  def __init__(self):
+    self.num_calls = 0
+
+  def __call__(self, features, labels, mode):
+    self.num_calls += 1
+    w = tf.get_variable("w", [], initializer=tf.zeros_initializer())
+    b = tf.get_variable("b", [], initializer=tf.zeros_initializer())
+    predictions = features["x"] * w + b
+    loss = tf.reduce_mean(tf.square(predictions - labels))
+    train_op = tf.train.GradientDescentOptimizer(0.01).minimize(
+        loss, global_step=tf.train.get_global_step())
+    eval_metric_ops = {
+        "mae": tf.metrics.mean_absolute_error(labels, predictions),
+    }
+    return tf.estimator.EstimatorSpec(
+        mode, loss=loss, train_op=train_op, eval_metric_ops=eval_metric_ops)
+
+
+class OverlapHook(tf.train.SessionRunHook):
+  """Counts its calls that overlap with a call from another thread."""
+
+  def __init__(self):
+    self.num_calls = 0
+    self.num_overlaps = 0
+    self._running = False
+
+  def _call(self):
+    if self._running:
+      self.num_overlaps += 1
+    self._running = True
+    time.sleep(0.01)
+    self._running = False
+    self.num_calls += 1
+
+  def after_create_session(self, session, coord):
+    self._call()
+
+  def before_run(self, run_context):
+    self._call()
+
+  def after_run(self, run_context, run_values):
+    self._call()
+
+  def end(self, session):
+    self._call()
+
+
+class ContinuousEvalTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.model_fn = CountingModelFn()
+    config = tf.estimator.RunConfig(
+        model_dir=self.get_temp_dir(), save_checkpoints_steps=2,
+        keep_checkpoint_max=10)
+    self.estimator = tf.estimator.Estimator(self.model_fn, config=config)
+    self.estimator.train(lambda: input_fn().repeat(), steps=6)
+    self.checkpoints = list(tf.train.get_checkpoint_state(
+        self.estimator.model_dir).all_model_checkpoint_paths)
+    self.model_fn.num_calls = 0
+
+  def testNewCheckpoints(self):
+    self.assertEqual(
+        [self.checkpoints],
+        list(continuous_eval.new_checkpoints(
+            self.estimator.model_dir, timeout_mins=0.01, seconds_to_sleep=0)))
+
+  def testEvaluateCheckpoint(self):
+    self.assertGreater(len(self.checkpoints), 2)
+    evaluator = continuous_eval.ContinuousEvaluator(
+        self.estimator, input_fn, name="persistent")
+    for ckpt in self.checkpoints + self.checkpoints[:1]:
+      results = evaluator.evaluate_checkpoint(ckpt)
+      expected = self.estimator.evaluate(input_fn, checkpoint_path=ckpt)
+      self.assertEqual(sorted(expected), sorted(results))
+      for key in expected:
+        self.assertAllClose(expected[key], results[key])
+    # One graph for the evaluator, one per call to Estimator.evaluate.
+    self.assertEqual(1 + len(self.checkpoints) + 1, self.model_fn.num_calls)
+    evaluator.close()
+
+  def testEvaluateCheckpointSteps(self):
+    evaluator = continuous_eval.ContinuousEvaluator(
+        self.estimator, input_fn, steps=2)
+    expected = self.estimator.evaluate(
+        input_fn, steps=2, checkpoint_path=self.checkpoints[-1])
+    results = evaluator.evaluate_checkpoint(self.checkpoints[-1])
+    self.assertAllClose(expected["loss"], results["loss"])
+    evaluator.close()
+
+  def testRunLatestCheckpoint(self):
+    evaluator = continuous_eval.ContinuousEvaluator(self.estimator, input_fn)
+    results = evaluator.run(timeout_mins=0.01, seconds_to_sleep=0)
+    evaluator.close()
+    self.assertEqual(6, results["global_step"])
+    self.assertEqual(self.checkpoints[-1:], evaluator.evaluated_checkpoints)
+    self.assertEqual(self.checkpoints[:-1], evaluator.skipped_checkpoints)
+    self.assertTrue(tf.gfile.Glob(
+        os.path.join(evaluator.eval_dir, "events.out.tfevents*")))
+    self.assertEqual(1, self.model_fn.num_calls)
+
+  def testRunAllCheckpoints(self):
+    # The second checkpoint was deleted before it could be evaluated.
+    for path in tf.gfile.Glob(self.checkpoints[1] + ".*"):
+      tf.gfile.Remove(path)
+    evaluator = continuous_eval.ContinuousEvaluator(
+        self.estimator, input_fn, evaluate_all_checkpoints=True,
+        num_workers=2)
+    evaluator.run(timeout_mins=0.01, seconds_to_sleep=0)
+    evaluator.close()
+    self.assertEqual(self.checkpoints[:1] + self.checkpoints[2:],
+                     evaluator.evaluated_checkpoints)
+    self.assertEqual(self.checkpoints[1:2], evaluator.skipped_checkpoints)
+    self.assertEqual(1, self.model_fn.num_calls)
+
+  def testRunAllCheckpointsHooks(self):
+    hook = OverlapHook()
+    evaluator = continuous_eval.ContinuousEvaluator(
+        self.estimator, input_fn, hooks=[hook], evaluate_all_checkpoints=True,
+        num_workers=2)
+    evaluator.run(timeout_mins=0.01, seconds_to_sleep=0)
+    evaluator.close()
+    self.assertEqual(self.checkpoints, evaluator.evaluated_checkpoints)
+    # after_create_session, end, before_run and after_run for the 4 batches,
+    # and before_run for the run hitting the end of the dataset.
+    self.assertEqual(len(self.checkpoints) * 11, hook.num_calls)
+    self.assertEqual(0, hook.num_overlaps)
+
+
+if __name__ == "__main__":
+  tf.test.main()
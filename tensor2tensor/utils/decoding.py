@@ -18,6 +18,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import json
 import operator
 import os
 import time
@@ -63,7 +64,19 @@ def decode_hparams(overrides=""):
       shards=1,
       shard_id=0,
       num_decodes=1,
-      force_decode_length=False)
+      force_decode_length=False,
+      preallocate_cache=False,
+      compact_batch_every=0,
+      vocab_shortlist_size=0,
+      vocab_shortlist_lexicon="",
+      per_beam_topk=False,
+      # Write the decodes of each batch to a spill file as they finish and
+      # resume from it, rather than keeping all of them in memory.
+      stream_decodes=False,
+      # Per-batch throughput and latency metrics of decode_from_file, written
+      # as JSON lines and/or TF summaries.
+      decode_metrics_file="",
+      decode_metrics_summary_dir="")
   hp.parse(overrides)
   return hp
 
@@ -333,18 +346,54 @@ def decode_from_file(estimator,
   tf.logging.info("Performing decoding from a file.")
   sorted_inputs, sorted_keys = _get_sorted_inputs(filename, decode_hp.shards,
                                                   decode_hp.delimiter)
-  num_decode_batches = (len(sorted_inputs) - 1) // decode_hp.batch_size + 1
+  # If decode_to_file was provided use it as the output filename without change
+  # (except for adding shard_id if using more shards for decoding).
+  # Otherwise, use the input filename plus model, hp, problem, beam, alpha.
+  decode_filename = decode_to_file if decode_to_file else filename
+  if decode_hp.shards > 1:
+    decode_filename += "%.2d" % decode_hp.shard_id
+  if not decode_to_file:
+    decode_filename = _decode_filename(decode_filename, problem_name, decode_hp)
+
+  # Original indices of the inputs in decoding order, from the longest to the
+  # shortest input.
+  decode_order = sorted(sorted_keys, key=sorted_keys.get, reverse=True)
+  if decode_hp.stream_decodes:
+    spill_filename = decode_filename + ".spill"
+    spilled_decodes = _read_spill_file(spill_filename)
+    if spilled_decodes:
+      tf.logging.info("Resuming decoding with %d of %d inputs decoded." %
+                      (len(spilled_decodes), len(sorted_inputs)))
+    decode_order = [i for i in decode_order if i not in spilled_decodes]
+    # Rewrite the spill file without a partially written last record.
+    spill_file = _write_spill_file(spill_filename, spilled_decodes)
+    # _decode_batch_input_fn expects the inputs in ascending length order.
+    inputs_to_decode = [sorted_inputs[sorted_keys[i]] for i in decode_order]
+    inputs_to_decode.reverse()
+  else:
+    inputs_to_decode = sorted_inputs
+  num_decode_batches = (len(inputs_to_decode) - 1) // decode_hp.batch_size + 1
+
+  metrics = None
+  encode_times = []
+  if decode_hp.decode_metrics_file or decode_hp.decode_metrics_summary_dir:
+    metrics = DecodeMetrics(len(inputs_to_decode), decode_hp.batch_size,
+                            decode_hp.extra_length,
+                            metrics_file=decode_hp.decode_metrics_file,
+                            summary_dir=decode_hp.decode_metrics_summary_dir)
 
   def input_fn():
-    input_gen = _decode_batch_input_fn(num_decode_batches, sorted_inputs,
+    input_gen = _decode_batch_input_fn(num_decode_batches, inputs_to_decode,
                                        inputs_vocab, decode_hp.batch_size,
-                                       decode_hp.max_input_size)
+                                       decode_hp.max_input_size,
+                                       encode_times=encode_times)
     gen_fn = make_input_fn_from_generator(input_gen)
     example = gen_fn()
     return _decode_input_tensor_to_features_dict(example, hparams)
 
   decodes = []
-  result_iter = estimator.predict(input_fn, checkpoint_path=checkpoint_path)
+  batch_records = []
+  num_decoded = 0
 
   start_time = time.time()
   total_time_per_step = 0
@@ -360,7 +409,12 @@ def decode_from_file(estimator,
       except StopIteration:
         break
 
+  if inputs_to_decode:
+    result_iter = estimator.predict(input_fn, checkpoint_path=checkpoint_path)
+  else:
+    result_iter = iter([])
   for elapsed_time, result in timer(result_iter):
+    detokenize_start_time = time.time()
     if decode_hp.return_beams:
       beam_decodes = []
       beam_scores = []
@@ -383,14 +437,14 @@ def decode_from_file(estimator,
         if decode_hp.write_beam_scores:
           beam_scores.append(score)
       if decode_hp.write_beam_scores:
-        decodes.append("\t".join([
+        decode = "\t".join([
             "\t".join([d, "%.2f" % s])
             for d, s in zip(beam_decodes, beam_scores)
-        ]))
+        ])
       else:
-        decodes.append("\t".join(beam_decodes))
+        decode = "\t".join(beam_decodes)
     else:
-      _, decoded_outputs, _ = log_decode_results(
+      _, decode, _ = log_decode_results(
           result["inputs"],
           result["outputs"],
           problem_name,
@@ -398,29 +452,340 @@ def decode_from_file(estimator,
           inputs_vocab,
           targets_vocab,
           log_results=decode_hp.log_results)
-      decodes.append(decoded_outputs)
+    if metrics:
+      metrics.add_example(result, elapsed_time,
+                          time.time() - detokenize_start_time, encode_times)
+    if decode_hp.stream_decodes:
+      batch_records.append(json.dumps([decode_order[num_decoded], decode]))
+      if len(batch_records) == decode_hp.batch_size:
+        _append_spill_records(spill_file, batch_records)
+        batch_records = []
+    else:
+      decodes.append(decode)
+    num_decoded += 1
     total_time_per_step += elapsed_time
     total_cnt += result["outputs"].shape[-1]
   tf.logging.info("Elapsed Time: %5.5f" % (time.time() - start_time))
-  tf.logging.info("Averaged Single Token Generation Time: %5.7f" %
-                  (total_time_per_step / total_cnt))
+  if total_cnt:
+    tf.logging.info("Averaged Single Token Generation Time: %5.7f" %
+                    (total_time_per_step / total_cnt))
+  if metrics:
+    metrics.close()
+
+  tf.logging.info("Writing decodes into %s" % decode_filename)
+  if decode_hp.stream_decodes:
+    _append_spill_records(spill_file, batch_records)
+    spill_file.close()
+    decodes = _read_spill_file(spill_filename)
+    with tf.gfile.Open(decode_filename, "w") as outfile:
+      for index in range(len(sorted_inputs)):
+        outfile.write("%s%s" % (decodes[index], decode_hp.delimiter))
+    tf.gfile.Remove(spill_filename)
+    return
 
   # Reversing the decoded inputs and outputs because they were reversed in
   # _decode_batch_input_fn
   sorted_inputs.reverse()
   decodes.reverse()
-  # If decode_to_file was provided use it as the output filename without change
-  # (except for adding shard_id if using more shards for decoding).
-  # Otherwise, use the input filename plus model, hp, problem, beam, alpha.
-  decode_filename = decode_to_file if decode_to_file else filename
-  if decode_hp.shards > 1:
-    decode_filename += "%.2d" % decode_hp.shard_id
-  if not decode_to_file:
-    decode_filename = _decode_filename(decode_filename, problem_name, decode_hp)
-  tf.logging.info("Writing decodes into %s" % decode_filename)
-  outfile = tf.gfile.Open(decode_filename, "w")
-  for index in range(len(sorted_inputs)):
-    outfile.write("%s%s" % (decodes[sorted_keys[index]], decode_hp.delimiter))
+  with tf.gfile.Open(decode_filename, "w") as outfile:
+    for index in range(len(sorted_inputs)):
+      outfile.write("%s%s" % (decodes[sorted_keys[index]], decode_hp.delimiter))
+
+
+def _read_spill_file(filename):
+  """Reads the decodes written by decode_from_file with stream_decodes.
+
+  Args:
+    filename: path of the spill file, which need not exist.
+
+  Returns:
+    a dict from input line index to decode. A partially written last record,
+    e.g. from a preempted job, is ignored.
+  """
+  decodes = {}
+  if not tf.gfile.Exists(filename):
+    return decodes
+  with tf.gfile.Open(filename) as f:
+    for line in f:
+      if not line.endswith("\n"):
+        break
+      index, decode = json.loads(line)
+      decodes[index] = decode
+  return decodes
+
+
+def _write_spill_file(filename, decodes):
+  """Writes decodes to a new spill file and returns it open for appending."""
+  # The decodes are written next to the spill file and only then replace it,
+  # so that a preemption during the rewrite loses nothing.
+  with tf.gfile.Open(filename + ".tmp", "w") as spill_file:
+    spill_file.write("".join(json.dumps([index, decode]) + "\n"
+                             for index, decode in decodes.items()))
+  tf.gfile.Rename(filename + ".tmp", filename, overwrite=True)
+  return tf.gfile.Open(filename, "a")
+
+
+def _append_spill_records(spill_file, records):
+  """Appends the records of a finished batch to the spill file."""
+  if records:
+    spill_file.write("".join(record + "\n" for record in records))
+    spill_file.flush()
+
+
+class DecodeMetrics(object):
+  """Per-batch throughput and latency metrics of decode_from_file.
+
+  Each batch is written as a JSON line with its number of examples, input and
+  output tokens, input padding ratio, decode steps taken and allowed, and the
+  time spent encoding, decoding and detokenizing it. A last line summarizes
+  all batches with tokens per second and batch latency percentiles. The same
+  values can also be written as TF summaries.
+  """
+
+  def __init__(self, num_inputs, batch_size, extra_length, metrics_file=None,
+               summary_dir=None):
+    """Creates a DecodeMetrics.
+
+    Args:
+      num_inputs: total number of inputs to decode.
+      batch_size: number of inputs per batch, the last batch may be smaller.
+      extra_length: decode_hp.extra_length, how many more steps than the input
+        length decoding may take.
+      metrics_file: optional path of the JSON lines file.
+      summary_dir: optional directory for TF summaries.
+    """
+    self._num_inputs = num_inputs
+    self._batch_size = batch_size
+    self._extra_length = extra_length
+    self._metrics_file = metrics_file and tf.gfile.Open(metrics_file, "w")
+    self._summary_writer = (
+        summary_dir and tf.summary.FileWriter(summary_dir))
+    self._num_examples = 0
+    self._batches = []
+    self._batch = None
+
+  def add_example(self, result, decode_time, detokenize_time, encode_times):
+    """Adds the result of one example.
+
+    Args:
+      result: dict of numpy arrays returned by estimator.predict.
+      decode_time: seconds spent waiting for the result, which include the
+        time spent encoding the inputs of its batch.
+      detokenize_time: seconds spent turning the result into a string.
+      encode_times: list of the seconds spent encoding each batch.
+    """
+    if self._batch is None:
+      self._batch = collections.defaultdict(float)
+    batch = self._batch
+    inputs = result["inputs"].flatten()
+    batch["examples"] += 1
+    batch["input_tokens"] += np.count_nonzero(inputs)
+    batch["input_positions"] += inputs.size
+    batch["output_tokens"] += np.count_nonzero(_save_until_eos(
+        result["outputs"]))
+    batch["decode_steps"] = max(batch["decode_steps"],
+                                result["outputs"].shape[-1])
+    batch["max_decode_steps"] = max(batch["max_decode_steps"],
+                                    inputs.size + self._extra_length)
+    batch["decode_time"] += decode_time
+    batch["detokenize_time"] += detokenize_time
+    self._num_examples += 1
+
+    batch_index = len(self._batches)
+    if (self._num_examples == self._num_inputs or
+        batch["examples"] == self._batch_size):
+      if batch_index < len(encode_times):
+        # The inputs are encoded while estimator.predict waits for them.
+        batch["encode_time"] = encode_times[batch_index]
+        batch["decode_time"] = max(
+            0., batch["decode_time"] - batch["encode_time"])
+      self._finish_batch(batch_index, batch)
+
+  def _finish_batch(self, batch_index, batch):
+    """Writes the metrics of a finished batch."""
+    input_positions = batch.pop("input_positions")
+    batch["padding_ratio"] = 1. - batch["input_tokens"] / max(
+        1., input_positions)
+    batch["latency"] = (
+        batch["encode_time"] + batch["decode_time"] + batch["detokenize_time"])
+    batch["tokens_per_sec"] = batch["output_tokens"] / max(
+        1e-9, batch["decode_time"])
+    record = dict(batch, batch=batch_index)
+    self._write(record, batch_index)
+    self._batches.append(batch)
+    self._batch = None
+
+  def _write(self, record, step):
+    record = {k: (v if isinstance(v, bool) else
+                  float(v) if isinstance(v, (float, np.floating)) else int(v))
+              for k, v in six.iteritems(record)}
+    if self._metrics_file:
+      self._metrics_file.write(json.dumps(record, sort_keys=True) + "\n")
+      self._metrics_file.flush()
+    if self._summary_writer:
+      self._summary_writer.add_summary(
+          tf.Summary(value=[
+              tf.Summary.Value(tag="decode/%s" % k, simple_value=v)
+              for k, v in sorted(six.iteritems(record))
+              if not isinstance(v, bool)
+          ]), step)
+
+  def close(self):
+    """Writes the summary of all batches and closes the outputs."""
+    if self._batches:
+      latencies = [batch["latency"] for batch in self._batches]
+      totals = {
+          k: sum(batch[k] for batch in self._batches)
+          for k in ["examples", "input_tokens", "output_tokens", "decode_time"]
+      }
+      record = dict(
+          totals,
+          summary=True,
+          batches=len(self._batches),
+          tokens_per_sec=totals["output_tokens"] / max(
+              1e-9, totals["decode_time"]),
+          latency_p50=np.percentile(latencies, 50),
+          latency_p95=np.percentile(latencies, 95),
+          latency_p99=np.percentile(latencies, 99))
+      tf.logging.info("Decode metrics: %s" % json.dumps(
+          {k: float(v) for k, v in six.iteritems(record)}, sort_keys=True))
+      self._write(record, len(self._batches))
+    if self._metrics_file:
+      self._metrics_file.close()
+    if self._summary_writer:
+      self._summary_writer.close()
+
+
+def _decode_unit_filename(unit_dir, unit, suffix):
+  return os.path.join(unit_dir, "unit-%05d.%s" % (unit, suffix))
+
+
+def split_decode_units(filename, unit_dir, unit_size, delimiter="\n"):
+  """Splits the inputs of decode_from_file into work units for many workers.
+
+  The inputs are sorted by length, so that each unit holds inputs of similar
+  length, and units with longer inputs come first.
+
+  When unit_dir holds a complete split of the same file with the same
+  unit_size, e.g. left by a run whose workers failed, it is kept with its
+  decodes so that only the remaining units are decoded. Any other content of
+  unit_dir is removed first.
+
+  Args:
+    filename: path to file with inputs, 1 per line.
+    unit_dir: directory to write the work units to.
+    unit_size: number of inputs per unit.
+    delimiter: str, delimits records in the file.
+
+  Returns:
+    the number of work units.
+  """
+  split = {"filename": filename, "unit_size": unit_size,
+           "delimiter": delimiter}
+  split_filename = os.path.join(unit_dir, "split.json")
+  if tf.gfile.Exists(split_filename):
+    with tf.gfile.Open(split_filename) as f:
+      previous_split = json.load(f)
+    num_units = previous_split.pop("num_units")
+    if previous_split == split:
+      tf.logging.info("Resuming the decoding of the work units in %s." %
+                      unit_dir)
+      release_decode_units(unit_dir)
+      return num_units
+  if tf.gfile.Exists(unit_dir):
+    tf.gfile.DeleteRecursively(unit_dir)
+
+  sorted_inputs, sorted_keys = _get_sorted_inputs(filename, delimiter=delimiter)
+  decode_order = sorted(sorted_keys, key=sorted_keys.get, reverse=True)
+  tf.gfile.MakeDirs(unit_dir)
+  num_units = 0
+  for start in range(0, len(decode_order), unit_size):
+    indices = decode_order[start:start + unit_size]
+    with tf.gfile.Open(
+        _decode_unit_filename(unit_dir, num_units, "indices"), "w") as f:
+      json.dump(indices, f)
+    with tf.gfile.Open(
+        _decode_unit_filename(unit_dir, num_units, "inputs"), "w") as f:
+      for index in indices:
+        f.write("%s%s" % (sorted_inputs[sorted_keys[index]], delimiter))
+    num_units += 1
+  # Written last, so that a split only counts once complete.
+  with tf.gfile.Open(split_filename, "w") as f:
+    json.dump(dict(split, num_units=num_units), f)
+  return num_units
+
+
+def claim_decode_unit(unit_dir):
+  """Claims a work unit written by split_decode_units.
+
+  Workers on the same machine can call this concurrently: each unit is
+  claimed exactly once by atomically renaming its inputs file.
+
+  Args:
+    unit_dir: local directory of the work units.
+
+  Returns:
+    a tuple (inputs filename, decodes filename) of the claimed unit, or None
+    if all units are claimed.
+  """
+  for name in sorted(os.listdir(unit_dir)):
+    if not name.endswith(".inputs"):
+      continue
+    prefix = os.path.join(unit_dir, name[:-len(".inputs")])
+    try:
+      os.rename(prefix + ".inputs", prefix + ".claimed")
+    except OSError:
+      # Another worker claimed it first.
+      continue
+    return prefix + ".claimed", prefix + ".decodes"
+  return None
+
+
+def release_decode_units(unit_dir):
+  """Makes the claimed work units that were not decoded claimable again.
+
+  Call this when no worker is running, e.g. after stopping the workers because
+  one of them failed, or before resuming a split. Partially written decodes
+  are removed.
+
+  Args:
+    unit_dir: local directory of the work units.
+  """
+  for name in os.listdir(unit_dir):
+    prefix = os.path.join(unit_dir, name.rsplit(".", 1)[0])
+    if name.endswith(".decodes.tmp"):
+      os.remove(os.path.join(unit_dir, name))
+    elif (name.endswith(".claimed") and
+          not os.path.exists(prefix + ".decodes")):
+      os.rename(prefix + ".claimed", prefix + ".inputs")
+
+
+def merge_decode_units(unit_dir, decode_to_file, delimiter="\n"):
+  """Merges the decodes of all work units in the order of the inputs.
+
+  Args:
+    unit_dir: directory of the work units, removed after merging.
+    decode_to_file: path of the output file.
+    delimiter: str, delimits records in the files.
+
+  Raises:
+    ValueError: if a work unit was not decoded.
+  """
+  decodes = {}
+  for name in sorted(tf.gfile.ListDirectory(unit_dir)):
+    if not name.endswith(".indices"):
+      continue
+    prefix = os.path.join(unit_dir, name[:-len(".indices")])
+    if not tf.gfile.Exists(prefix + ".decodes"):
+      raise ValueError("Work unit %s was not decoded." % prefix)
+    with tf.gfile.Open(prefix + ".indices") as f:
+      indices = json.load(f)
+    with tf.gfile.Open(prefix + ".decodes") as f:
+      decodes.update(zip(indices, f.read().split(delimiter)))
+  with tf.gfile.Open(decode_to_file, "w") as outfile:
+    for index in range(len(decodes)):
+      outfile.write("%s%s" % (decodes[index], delimiter))
+  tf.gfile.DeleteRecursively(unit_dir)
 
 
 def _decode_filename(base_filename, problem_name, decode_hp):
@@ -499,14 +864,28 @@ def decode_interactively(estimator, hparams, decode_hp, checkpoint_path=None):
 
 
 def _decode_batch_input_fn(num_decode_batches, sorted_inputs, vocabulary,
-                           batch_size, max_input_size):
-  """Generator to produce batches of inputs."""
+                           batch_size, max_input_size, encode_times=None):
+  """Generator to produce batches of inputs.
+
+  Args:
+    num_decode_batches: number of batches to produce.
+    sorted_inputs: list of input strings sorted by ascending length.
+    vocabulary: encoder for the inputs.
+    batch_size: number of inputs per batch.
+    max_input_size: if positive, inputs are truncated to this many ids.
+    encode_times: optional list to append the time spent encoding each batch
+      to.
+
+  Yields:
+    dicts of batched input ids.
+  """
   tf.logging.info(" batch %d" % num_decode_batches)
   # First reverse all the input sentences so that if you're going to get OOMs,
   # you'll see it in the first batch
   sorted_inputs.reverse()
   for b in range(num_decode_batches):
     tf.logging.info("Decoding batch %d" % b)
+    start_time = time.time()
     batch_length = 0
     batch_inputs = []
     for inputs in sorted_inputs[b * batch_size:(b + 1) * batch_size]:
@@ -523,6 +902,8 @@ def _decode_batch_input_fn(num_decode_batches, sorted_inputs, vocabulary,
       assert len(input_ids) <= batch_length
       x = input_ids + [0] * (batch_length - len(input_ids))
       final_batch_inputs.append(x)
+    if encode_times is not None:
+      encode_times.append(time.time() - start_time)
 
     yield {
         "inputs": np.array(final_batch_inputs).astype(np.int32),
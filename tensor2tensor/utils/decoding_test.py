@@ -0,0 +1,184 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for decoding utilities."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+
+from tensor2tensor.utils import decoding
+
+import tensorflow as tf
+
+
+class DecodingTest(tf.test.TestCase):
+
+  def testSpillFile(self):
+    filename = os.path.join(tf.test.get_temp_dir(), "decodes.spill")
+    self.assertEqual(decoding._read_spill_file(filename), {})
+
+    spill_file = decoding._write_spill_file(filename, {})
+    decoding._append_spill_records(spill_file, ['[2, "b\\tc"]', '[0, "a"]'])
+    # Simulate a job preempted while writing a batch.
+    spill_file.write('[1, "d')
+    spill_file.close()
+    decodes = decoding._read_spill_file(filename)
+    self.assertEqual(decodes, {0: "a", 2: "b\tc"})
+
+    # A rewrite preempted before it replaced the spill file loses nothing.
+    with tf.gfile.Open(filename + ".tmp", "w") as f:
+      f.write('[0, "a"]\n')
+    self.assertEqual(decoding._read_spill_file(filename), decodes)
+
+    # Resuming drops the partial record.
+    spill_file = decoding._write_spill_file(filename, decodes)
+    decoding._append_spill_records(spill_file, ['[1, "d"]'])
+    spill_file.close()
+    self.assertEqual(decoding._read_spill_file(filename),
+                     {0: "a", 1: "d", 2: "b\tc"})
+    self.assertFalse(tf.gfile.Exists(filename + ".tmp"))
+
+  def testDecodeUnits(self):
+    tmp_dir = tf.test.get_temp_dir()
+    filename = os.path.join(tmp_dir, "inputs.txt")
+    unit_dir = os.path.join(tmp_dir, "units")
+    lines = ["a b c", "a", "a b c d e", "a b", "a b c d"]
+    with tf.gfile.Open(filename, "w") as f:
+      f.write("\n".join(lines) + "\n")
+
+    self.assertEqual(decoding.split_decode_units(filename, unit_dir, 2), 3)
+    claimed = []
+    unit = decoding.claim_decode_unit(unit_dir)
+    while unit:
+      inputs_filename, decodes_filename = unit
+      claimed.append(inputs_filename)
+      # Decode each input to itself, reversed.
+      with tf.gfile.Open(inputs_filename) as f:
+        inputs = f.read().split("\n")[:-1]
+      with tf.gfile.Open(decodes_filename, "w") as f:
+        f.write("".join(line[::-1] + "\n" for line in inputs))
+      unit = decoding.claim_decode_unit(unit_dir)
+    self.assertEqual(len(claimed), 3)
+    # The longest inputs come first.
+    with tf.gfile.Open(claimed[0]) as f:
+      self.assertEqual(f.read(), "a b c d e\na b c d\n")
+
+    decode_to_file = os.path.join(tmp_dir, "decodes.txt")
+    decoding.merge_decode_units(unit_dir, decode_to_file)
+    with tf.gfile.Open(decode_to_file) as f:
+      self.assertEqual(f.read().split("\n")[:-1],
+                       [line[::-1] for line in lines])
+    self.assertFalse(tf.gfile.Exists(unit_dir))
+
+  def testResumeDecodeUnits(self):
+    tmp_dir = tf.test.get_temp_dir()
+    filename = os.path.join(tmp_dir, "resume_inputs.txt")
+    unit_dir = os.path.join(tmp_dir, "resume_units")
+    with tf.gfile.Open(filename, "w") as f:
+      f.write("a\nb c\nd e f\n")
+    self.assertEqual(decoding.split_decode_units(filename, unit_dir, 1), 3)
+    _, decodes_filename = decoding.claim_decode_unit(unit_dir)
+    with tf.gfile.Open(decodes_filename, "w") as f:
+      f.write("x\n")
+    # A worker was killed with a unit claimed.
+    _, claimed_filename = decoding.claim_decode_unit(unit_dir)
+
+    # The same split resumes: only the units not decoded can be claimed.
+    self.assertEqual(decoding.split_decode_units(filename, unit_dir, 1), 3)
+    self.assertTrue(tf.gfile.Exists(decodes_filename))
+    unclaimed = []
+    unit = decoding.claim_decode_unit(unit_dir)
+    while unit:
+      unclaimed.append(unit[1])
+      unit = decoding.claim_decode_unit(unit_dir)
+    self.assertEqual(2, len(unclaimed))
+    self.assertIn(claimed_filename, unclaimed)
+
+    # Another unit size splits again, without the earlier units and decodes.
+    self.assertEqual(decoding.split_decode_units(filename, unit_dir, 2), 2)
+    self.assertFalse(tf.gfile.Exists(decodes_filename))
+    self.assertEqual(
+        ["split.json", "unit-00000.indices", "unit-00000.inputs",
+         "unit-00001.indices", "unit-00001.inputs"],
+        sorted(tf.gfile.ListDirectory(unit_dir)))
+
+  def testReleaseDecodeUnits(self):
+    tmp_dir = tf.test.get_temp_dir()
+    filename = os.path.join(tmp_dir, "release_inputs.txt")
+    unit_dir = os.path.join(tmp_dir, "release_units")
+    with tf.gfile.Open(filename, "w") as f:
+      f.write("a\nb\nc\n")
+    self.assertEqual(decoding.split_decode_units(filename, unit_dir, 1), 3)
+
+    # A unit was decoded, another one only partially when its worker stopped.
+    _, decodes_filename = decoding.claim_decode_unit(unit_dir)
+    with tf.gfile.Open(decodes_filename, "w") as f:
+      f.write("x\n")
+    _, partial_filename = decoding.claim_decode_unit(unit_dir)
+    with tf.gfile.Open(partial_filename + ".tmp", "w") as f:
+      f.write("y")
+    decoding.release_decode_units(unit_dir)
+
+    self.assertFalse(tf.gfile.Exists(partial_filename + ".tmp"))
+    unclaimed = []
+    unit = decoding.claim_decode_unit(unit_dir)
+    while unit:
+      unclaimed.append(unit[1])
+      unit = decoding.claim_decode_unit(unit_dir)
+    self.assertEqual(2, len(unclaimed))
+    self.assertIn(partial_filename, unclaimed)
+    self.assertNotIn(decodes_filename, unclaimed)
+
+  def testDecodeMetrics(self):
+    metrics_file = os.path.join(tf.test.get_temp_dir(), "metrics.jsonl")
+    metrics = decoding.DecodeMetrics(3, 2, 5, metrics_file=metrics_file)
+    encode_times = [0.5, 0.25]
+    results = [
+        {"inputs": np.array([4, 5, 1, 0]), "outputs": np.array([6, 7, 1, 0])},
+        {"inputs": np.array([4, 5, 6, 1]), "outputs": np.array([6, 1, 0, 0])},
+        {"inputs": np.array([4, 1]), "outputs": np.array([6, 6, 6])},
+    ]
+    for result in results:
+      metrics.add_example(result, 1.0, 0.125, encode_times)
+    metrics.close()
+
+    with tf.gfile.Open(metrics_file) as f:
+      records = [json.loads(line) for line in f]
+    self.assertEqual(len(records), 3)
+    self.assertEqual(records[0]["batch"], 0)
+    self.assertEqual(records[0]["examples"], 2)
+    self.assertEqual(records[0]["input_tokens"], 7)
+    self.assertAllClose(records[0]["padding_ratio"], 1. / 8)
+    self.assertEqual(records[0]["output_tokens"], 3)
+    self.assertEqual(records[0]["max_decode_steps"], 9)
+    # The encode times are part of the measured decode times.
+    self.assertAllClose(records[0]["decode_time"], 1.5)
+    self.assertAllClose(records[0]["latency"], 2.25)
+    self.assertEqual(records[1]["examples"], 1)
+    self.assertEqual(records[1]["output_tokens"], 3)
+    self.assertTrue(records[2]["summary"])
+    self.assertEqual(records[2]["batches"], 2)
+    self.assertEqual(records[2]["output_tokens"], 6)
+    self.assertAllClose(records[2]["decode_time"], 2.25)
+    self.assertAllClose(records[2]["tokens_per_sec"], 6. / 2.25)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,429 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Embedding export and approximate nearest neighbor search.
+
+`export_embeddings` runs a model whose predictions are embeddings, like
+SimilarityTransformer, over a corpus and stores them as a memory-mapped .npy
+matrix with a file of ids. `IVFIndex` is an inverted file index over such a
+matrix, optionally with product quantization, searched by cosine similarity.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import time
+
+import numpy as np
+import six
+from six.moves import range  # pylint: disable=redefined-builtin
+
+from tensor2tensor.data_generators import text_encoder
+from tensor2tensor.utils import decoding
+
+import tensorflow as tf
+
+
+def embeddings_filename(path):
+  return path + ".npy"
+
+
+def ids_filename(path):
+  return path + ".ids"
+
+
+def export_embeddings(estimator, hparams, texts, path, ids=None,
+                      feature_name="inputs", batch_size=32, max_input_size=-1,
+                      dtype=np.float32, checkpoint_path=None):
+  """Embeds texts with estimator and writes the embeddings to path.
+
+  The texts are batched by length and their embeddings written in the order
+  of texts to a [len(texts), depth] .npy matrix, which `load_embeddings` maps
+  into memory, and their ids to a text file with one id per line.
+
+  Args:
+    estimator: tf.estimator.Estimator of a model predicting one embedding per
+      example, e.g. SimilarityTransformer.
+    hparams: model hparams, with problem_hparams set.
+    texts: list of strings to embed.
+    path: prefix of the files to write, see `embeddings_filename` and
+      `ids_filename`.
+    ids: list of string ids of the texts, defaults to their positions.
+    feature_name: "inputs" to embed the texts as inputs, or "targets" to embed
+      them as targets; SimilarityTransformer embeds the targets (the code side)
+      with its second encoder.
+    batch_size: number of texts embedded at a time.
+    max_input_size: if positive, texts are truncated to this many ids.
+    dtype: numpy dtype of the stored embeddings, e.g. np.float16 to halve
+      their size.
+    checkpoint_path: checkpoint to restore, defaults to the latest one.
+  """
+  if ids is None:
+    ids = [str(i) for i in range(len(texts))]
+  if len(ids) != len(texts):
+    raise ValueError("Got %d ids for %d texts." % (len(ids), len(texts)))
+  vocabulary = hparams.problem_hparams.vocabulary[feature_name]
+  order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+  def batches():
+    for start in range(0, len(order), batch_size):
+      batch_indices = order[start:start + batch_size]
+      batch_ids = []
+      for i in batch_indices:
+        text_ids = vocabulary.encode(texts[i])
+        if max_input_size > 0:
+          # Subtract 1 for the EOS_ID.
+          text_ids = text_ids[:max_input_size - 1]
+        batch_ids.append(text_ids + [text_encoder.EOS_ID])
+      length = max(len(text_ids) for text_ids in batch_ids)
+      padded = np.zeros([len(batch_ids), length], dtype=np.int32)
+      for row, text_ids in enumerate(batch_ids):
+        padded[row, :len(text_ids)] = text_ids
+      yield {
+          feature_name: padded,
+          "embedding_index": np.array(batch_indices, dtype=np.int32),
+      }
+
+  def input_fn():
+    example = decoding.make_input_fn_from_generator(batches())()
+    p_hparams = hparams.problem_hparams
+    return {
+        feature_name: tf.reshape(example[feature_name],
+                                 [tf.shape(example[feature_name])[0], -1, 1,
+                                  1]),
+        "embedding_index": example["embedding_index"],
+        "input_space_id": tf.constant(p_hparams.input_space_id),
+        "target_space_id": tf.constant(p_hparams.target_space_id),
+    }
+
+  embeddings = None
+  if texts:
+    for result in estimator.predict(input_fn, checkpoint_path=checkpoint_path):
+      embedding = np.reshape(result["outputs"], [-1])
+      if embeddings is None:
+        embeddings = np.lib.format.open_memmap(
+            embeddings_filename(path), mode="w+", dtype=dtype,
+            shape=(len(texts), embedding.shape[0]))
+      embeddings[result["embedding_index"]] = embedding
+    embeddings.flush()
+  with io.open(ids_filename(path), "w", encoding="utf-8") as f:
+    for text_id in ids:
+      f.write(six.text_type(text_id) + u"\n")
+
+
+def load_embeddings(path):
+  """Returns the memory-mapped embedding matrix and the ids at path."""
+  embeddings = np.load(embeddings_filename(path), mmap_mode="r")
+  with io.open(ids_filename(path), encoding="utf-8") as f:
+    ids = [line.rstrip(u"\n") for line in f]
+  return embeddings, ids
+
+
+def l2_normalize(x):
+  """Returns the rows of x divided by their L2 norm, as float32."""
+  x = np.asarray(x, dtype=np.float32)
+  norms = np.linalg.norm(x, axis=-1, keepdims=True)
+  return x / np.maximum(norms, 1e-12)
+
+
+def nearest_centroids(points, centroids, chunk_size=65536):
+  """Returns the index of the closest centroid (in L2 distance) of each point."""
+  centroid_norms = np.sum(np.square(centroids), axis=1)
+  assignments = np.empty(len(points), dtype=np.int64)
+  for start in range(0, len(points), chunk_size):
+    chunk = np.asarray(points[start:start + chunk_size], dtype=np.float32)
+    distances = centroid_norms - 2.0 * np.dot(chunk, centroids.T)
+    assignments[start:start + chunk_size] = np.argmin(distances, axis=1)
+  return assignments
+
+
+def kmeans(points, num_clusters, num_iterations=10, rng=None):
+  """Lloyd's k-means.
+
+  Args:
+    points: float32 array [num_points, depth].
+    num_clusters: number of centroids.
+    num_iterations: number of assignment and update steps.
+    rng: np.random.RandomState used to pick the initial centroids, and the new
+      centroids of clusters that become empty.
+
+  Returns:
+    float32 array [num_clusters, depth] of centroids.
+  """
+  rng = rng or np.random.RandomState(0)
+  points = np.asarray(points, dtype=np.float32)
+  centroids = points[rng.choice(len(points), num_clusters,
+                                replace=len(points) < num_clusters)]
+  for _ in range(num_iterations):
+    assignments = nearest_centroids(points, centroids)
+    counts = np.bincount(assignments, minlength=num_clusters)
+    order = np.argsort(assignments, kind="mergesort")
+    starts = np.cumsum(counts) - counts
+    nonempty = counts > 0
+    centroids = points[rng.choice(len(points), num_clusters)]
+    centroids[nonempty] = (
+        np.add.reduceat(points[order], starts[nonempty], axis=0) /
+        counts[nonempty, np.newaxis])
+  return centroids
+
+
+class IVFIndex(object):
+  """Inverted file index for cosine similarity search.
+
+  The embeddings are normalized and clustered with k-means into num_lists
+  lists. A query scores the embeddings of the num_probes lists whose centroids
+  are the most similar to it. The embeddings of a list are stored either as
+  float16 vectors, or, with product quantization, as the codes of their
+  residuals to the centroid in num_subspaces codebooks of 256 entries.
+  """
+
+  def __init__(self, centroids, list_offsets, ids, vectors=None,
+               codebooks=None, codes=None):
+    """Creates an index from its arrays, see `IVFIndex.build`.
+
+    Args:
+      centroids: float32 array [num_lists, depth].
+      list_offsets: int64 array [num_lists + 1], list i holds rows
+        list_offsets[i] to list_offsets[i + 1] of ids and vectors or codes.
+      ids: int64 array [num_embeddings], row of each entry in the embedding
+        matrix.
+      vectors: float16 array [num_embeddings, depth] of normalized embeddings
+        for an index without quantization.
+      codebooks: float32 array [num_subspaces, 256, depth / num_subspaces] for
+        an index with product quantization.
+      codes: uint8 array [num_embeddings, num_subspaces] for an index with
+        product quantization.
+    """
+    self.centroids = centroids
+    self.list_offsets = list_offsets
+    self.ids = ids
+    self.vectors = vectors
+    self.codebooks = codebooks
+    self.codes = codes
+
+  @property
+  def num_lists(self):
+    return len(self.centroids)
+
+  @classmethod
+  def build(cls, embeddings, num_lists, num_subspaces=0, train_size=100000,
+            num_iterations=10, seed=0, chunk_size=65536):
+    """Builds an index of the rows of embeddings.
+
+    Args:
+      embeddings: array [num_embeddings, depth], e.g. from `load_embeddings`.
+      num_lists: number of inverted lists, about sqrt(num_embeddings) works
+        well.
+      num_subspaces: if positive, the embeddings are stored with product
+        quantization in num_subspaces bytes each; depth must be divisible by
+        it. Otherwise they are stored as float16.
+      train_size: number of embeddings the k-means are trained on.
+      num_iterations: number of k-means iterations.
+      seed: random seed of the k-means.
+      chunk_size: number of embeddings processed at a time, which bounds the
+        memory used for a memory-mapped embedding matrix.
+
+    Returns:
+      An IVFIndex.
+
+    Raises:
+      ValueError: if depth is not divisible by num_subspaces.
+    """
+    num_embeddings, depth = embeddings.shape
+    if num_subspaces and depth % num_subspaces:
+      raise ValueError("Depth %d is not divisible by %d subspaces." %
+                       (depth, num_subspaces))
+    rng = np.random.RandomState(seed)
+    train_rows = np.sort(rng.choice(num_embeddings,
+                                    min(train_size, num_embeddings),
+                                    replace=False))
+    train = l2_normalize(embeddings[train_rows])
+    centroids = kmeans(train, num_lists, num_iterations, rng)
+
+    codebooks = None
+    if num_subspaces:
+      residuals = train - centroids[nearest_centroids(train, centroids)]
+      codebooks = np.stack([
+          kmeans(subspace, 256, num_iterations, rng)
+          for subspace in np.split(residuals, num_subspaces, axis=1)])
+
+    assignments = np.empty(num_embeddings, dtype=np.int64)
+    if num_subspaces:
+      stored = np.empty([num_embeddings, num_subspaces], dtype=np.uint8)
+    else:
+      stored = np.empty([num_embeddings, depth], dtype=np.float16)
+    for start in range(0, num_embeddings, chunk_size):
+      chunk = l2_normalize(embeddings[start:start + chunk_size])
+      chunk_assignments = nearest_centroids(chunk, centroids)
+      assignments[start:start + len(chunk)] = chunk_assignments
+      if num_subspaces:
+        residuals = chunk - centroids[chunk_assignments]
+        for m, subspace in enumerate(np.split(residuals, num_subspaces,
+                                              axis=1)):
+          stored[start:start + len(chunk), m] = nearest_centroids(
+              subspace, codebooks[m])
+      else:
+        stored[start:start + len(chunk)] = chunk
+
+    ids = np.argsort(assignments, kind="mergesort")
+    counts = np.bincount(assignments, minlength=num_lists)
+    list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    if num_subspaces:
+      return cls(centroids, list_offsets, ids, codebooks=codebooks,
+                 codes=stored[ids])
+    return cls(centroids, list_offsets, ids, vectors=stored[ids])
+
+  def _candidates(self, query, num_probes):
+    """Returns the rows and approximate scores of the probed lists."""
+    coarse_scores = np.dot(self.centroids, query)
+    num_probes = min(num_probes, self.num_lists)
+    probes = np.argpartition(-coarse_scores, num_probes - 1)[:num_probes]
+    rows = np.concatenate([
+        np.arange(self.list_offsets[l], self.list_offsets[l + 1])
+        for l in probes])
+    if self.codes is None:
+      scores = np.dot(self.vectors[rows].astype(np.float32), query)
+    else:
+      # The score of a centroid plus quantized residual is the score of the
+      # centroid plus the scores of the codebook entries of the residual.
+      num_subspaces = len(self.codebooks)
+      tables = np.einsum("mcd,md->mc", self.codebooks,
+                         np.reshape(query, [num_subspaces, -1]))
+      sizes = self.list_offsets[probes + 1] - self.list_offsets[probes]
+      scores = (np.repeat(coarse_scores[probes], sizes) +
+                tables[np.arange(num_subspaces), self.codes[rows]].sum(axis=1))
+    return rows, scores
+
+  def search(self, queries, k=10, num_probes=8, embeddings=None, rerank=0):
+    """Finds the embeddings most similar to each query.
+
+    Args:
+      queries: array [num_queries, depth] of query embeddings.
+      k: number of results per query.
+      num_probes: number of lists scored per query; more lists give better
+        recall at a higher latency.
+      embeddings: the embedding matrix the index was built from, needed for
+        rerank.
+      rerank: if positive, this many approximate results per query are scored
+        again with the exact embeddings before keeping the top k.
+
+    Returns:
+      A pair of int64 array [num_queries, k] of embedding rows and float32
+      array [num_queries, k] of their cosine similarities, best first. Rows
+      are -1 and scores -inf when fewer than k embeddings were scored.
+
+    Raises:
+      ValueError: if rerank is set without embeddings.
+    """
+    if rerank and embeddings is None:
+      raise ValueError("Reranking needs the embedding matrix.")
+    queries = l2_normalize(queries)
+    result_rows = np.full([len(queries), k], -1, dtype=np.int64)
+    result_scores = np.full([len(queries), k], -np.inf, dtype=np.float32)
+    for q, query in enumerate(queries):
+      rows, scores = self._candidates(query, num_probes)
+      if rerank:
+        if len(scores) > rerank:
+          best = np.argpartition(-scores, rerank - 1)[:rerank]
+          rows, scores = rows[best], scores[best]
+        ids = self.ids[rows]
+        order = np.argsort(ids)  # Read the embedding matrix sequentially.
+        rows, ids = rows[order], ids[order]
+        scores = np.dot(l2_normalize(embeddings[ids]), query)
+      if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[best], scores[best]
+      order = np.argsort(-scores)
+      result_rows[q, :len(order)] = self.ids[rows[order]]
+      result_scores[q, :len(order)] = scores[order]
+    return result_rows, result_scores
+
+  def save(self, filename):
+    arrays = {
+        "centroids": self.centroids,
+        "list_offsets": self.list_offsets,
+        "ids": self.ids,
+    }
+    if self.codes is None:
+      arrays["vectors"] = self.vectors
+    else:
+      arrays["codebooks"] = self.codebooks
+      arrays["codes"] = self.codes
+    # np.savez seeks in its output, which GFile does not support.
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    with tf.gfile.Open(filename, "wb") as f:
+      f.write(buf.getvalue())
+
+  @classmethod
+  def load(cls, filename):
+    with tf.gfile.Open(filename, "rb") as f:
+      arrays = dict(np.load(io.BytesIO(f.read())).items())
+    return cls(**arrays)
+
+
+def exact_search(embeddings, queries, k=10, chunk_size=65536):
+  """Brute force cosine similarity search, with the output of `search`."""
+  queries = l2_normalize(queries)
+  query_indices = np.arange(len(queries))[:, np.newaxis]
+  result_rows = np.zeros([len(queries), 0], dtype=np.int64)
+  result_scores = np.zeros([len(queries), 0], dtype=np.float32)
+  for start in range(0, len(embeddings), chunk_size):
+    scores = np.dot(queries,
+                    l2_normalize(embeddings[start:start + chunk_size]).T)
+    rows = np.broadcast_to(np.arange(start, start + scores.shape[1]),
+                           scores.shape)
+    result_rows = np.concatenate([result_rows, rows], axis=1)
+    result_scores = np.concatenate([result_scores, scores], axis=1)
+    if result_scores.shape[1] > k:
+      best = np.argpartition(-result_scores, k - 1, axis=1)[:, :k]
+      result_rows = result_rows[query_indices, best]
+      result_scores = result_scores[query_indices, best]
+  order = np.argsort(-result_scores, axis=1)
+  return result_rows[query_indices, order], result_scores[query_indices, order]
+
+
+def benchmark(index, embeddings, queries, k=10, num_probes=8, rerank=0):
+  """Measures the recall and latency of index against exact search.
+
+  Args:
+    index: an IVFIndex built from embeddings.
+    embeddings: the embedding matrix.
+    queries: array [num_queries, depth] of query embeddings.
+    k: number of results per query.
+    num_probes: see `IVFIndex.search`.
+    rerank: see `IVFIndex.search`.
+
+  Returns:
+    A dict with the recall at k of the index, i.e. the fraction of the exact
+    top k it finds, and the mean latency per query in milliseconds of the
+    index and of exact search.
+  """
+  start_time = time.time()
+  exact_rows, _ = exact_search(embeddings, queries, k)
+  exact_time = time.time() - start_time
+
+  start_time = time.time()
+  rows, _ = index.search(queries, k, num_probes, embeddings, rerank)
+  index_time = time.time() - start_time
+
+  found = sum(len(np.intersect1d(rows[q], exact_rows[q]))
+              for q in range(len(queries)))
+  return {
+      "recall": found / float(exact_rows.size),
+      "ms_per_query": 1000.0 * index_time / len(queries),
+      "exact_ms_per_query": 1000.0 * exact_time / len(queries),
+  }
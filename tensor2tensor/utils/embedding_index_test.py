@@ -0,0 +1,112 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for tensor2tensor.utils.embedding_index."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+
+import numpy as np
+from tensor2tensor.utils import embedding_index
+
+import tensorflow as tf
+
+
+def clustered_embeddings(num_embeddings, depth, num_clusters, seed=0):
+  rng = np.random.RandomState(seed)
+  centers = rng.randn(num_clusters, depth)
+  assignments = rng.randint(num_clusters, size=num_embeddings)
+  return (centers[assignments] +
+          0.3 * rng.randn(num_embeddings, depth)).astype(np.float32)
+
+
+class EmbeddingIndexTest(tf.test.TestCase):
+
+  def testExactSearch(self):
+    embeddings = clustered_embeddings(500, 8, 10)
+    queries = embeddings[:20] + 0.01
+    rows, scores = embedding_index.exact_search(embeddings, queries, k=5,
+                                                chunk_size=64)
+    all_scores = np.dot(embedding_index.l2_normalize(queries),
+                        embedding_index.l2_normalize(embeddings).T)
+    self.assertAllEqual(rows, np.argsort(-all_scores, axis=1)[:, :5])
+    self.assertAllClose(scores, -np.sort(-all_scores, axis=1)[:, :5])
+
+  def testKmeans(self):
+    rng = np.random.RandomState(0)
+    centers = np.array([[10., 0.], [0., 10.], [-10., -10.]])
+    points = np.concatenate([center + rng.randn(100, 2) for center in centers])
+    centroids = embedding_index.kmeans(points, 3, rng=rng)
+    for center in centers:
+      self.assertLess(np.min(np.linalg.norm(centroids - center, axis=1)), 0.5)
+
+  def testIVFIndexAllProbes(self):
+    embeddings = clustered_embeddings(2000, 16, 20)
+    queries = clustered_embeddings(50, 16, 20, seed=1)
+    index = embedding_index.IVFIndex.build(embeddings, 16)
+    rows, _ = index.search(queries, k=10, num_probes=16)
+    exact_rows, _ = embedding_index.exact_search(embeddings, queries, k=10)
+    recall = np.mean([len(np.intersect1d(r, e)) / 10.0
+                      for r, e in zip(rows, exact_rows)])
+    self.assertGreater(recall, 0.95)
+
+  def testProductQuantizedIndexBenchmark(self):
+    embeddings = clustered_embeddings(3000, 16, 20)
+    queries = clustered_embeddings(50, 16, 20, seed=1)
+    index = embedding_index.IVFIndex.build(embeddings, 32, num_subspaces=4)
+    self.assertEqual(index.codes.shape, (3000, 4))
+    self.assertEqual(index.codes.dtype, np.uint8)
+    approx = embedding_index.benchmark(index, embeddings, queries, k=10,
+                                       num_probes=8)
+    reranked = embedding_index.benchmark(index, embeddings, queries, k=10,
+                                         num_probes=8, rerank=100)
+    self.assertGreater(approx["recall"], 0.5)
+    self.assertGreater(reranked["recall"], 0.9)
+    self.assertGreater(reranked["ms_per_query"], 0.0)
+
+  def testSearchFewerCandidatesThanK(self):
+    embeddings = clustered_embeddings(5, 4, 1)
+    index = embedding_index.IVFIndex.build(embeddings, 1)
+    rows, scores = index.search(embeddings[:1], k=8)
+    self.assertAllEqual(rows[0, 5:], [-1, -1, -1])
+    self.assertTrue(np.all(np.isinf(scores[0, 5:])))
+    self.assertEqual(rows[0, 0], 0)
+
+  def testSaveAndLoad(self):
+    embeddings = clustered_embeddings(300, 8, 5)
+    index = embedding_index.IVFIndex.build(embeddings, 4, num_subspaces=2)
+    filename = os.path.join(self.get_temp_dir(), "index.npz")
+    index.save(filename)
+    loaded = embedding_index.IVFIndex.load(filename)
+    queries = embeddings[:10]
+    self.assertAllEqual(index.search(queries)[0], loaded.search(queries)[0])
+
+  def testLoadEmbeddings(self):
+    path = os.path.join(self.get_temp_dir(), "corpus")
+    embeddings = clustered_embeddings(10, 4, 2).astype(np.float16)
+    np.save(embedding_index.embeddings_filename(path), embeddings)
+    with io.open(embedding_index.ids_filename(path), "w") as f:
+      f.write(u"".join(u"snippet_%d\n" % i for i in range(10)))
+    loaded, ids = embedding_index.load_embeddings(path)
+    self.assertIsInstance(loaded, np.memmap)
+    self.assertAllEqual(loaded, embeddings)
+    self.assertEqual(ids[3], "snippet_3")
+
+
+if __name__ == "__main__":
+  tf.test.main()
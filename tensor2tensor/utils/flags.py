@@ -91,6 +91,12 @@ flags.DEFINE_integer("local_eval_frequency", 1000,
 flags.DEFINE_integer("eval_throttle_seconds", 600,
                      "Do not re-evaluate unless the last evaluation was started"
                      " at least this many seconds ago.")
+flags.DEFINE_bool("eval_all_checkpoints", False,
+                  "With --schedule=continuous_eval, evaluate every new "
+                  "checkpoint instead of only the latest one.")
+flags.DEFINE_integer("eval_num_workers", 1,
+                     "With --eval_all_checkpoints, number of checkpoints "
+                     "evaluated at the same time.")
 flags.DEFINE_bool("locally_shard_to_cpu", False,
                   "Use CPU as a sharding device running locally. This allows "
                   "to test sharded model construction on a machine with 1 GPU.")
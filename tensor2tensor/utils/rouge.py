@@ -26,6 +26,8 @@ from __future__ import unicode_literals
 
 import numpy as np
 
+from tensor2tensor.utils import bleu_hook
+
 import tensorflow as tf
 
 
@@ -130,6 +132,51 @@ def rouge_l_sentence_level(eval_sentences, ref_sentences):
   return np.mean(f1_scores, dtype=np.float32)
 
 
+def batch_len_lcs(x, y):
+  """Returns the lengths of the LCS between the rows of two padded arrays.
+
+  Fills the DP table of _lcs for the whole batch at once, one anti-diagonal
+  at a time.
+
+  Args:
+    x: int array [batch, n].
+    y: int array [batch, m].
+
+  Returns:
+    int array [batch] of LCS lengths.
+  """
+  x = np.asarray(x)
+  y = np.asarray(y)
+  batch_size, n = x.shape
+  m = y.shape[1]
+  table = np.zeros([batch_size, n + 1, m + 1], dtype=np.int32)
+  for diagonal in range(2, n + m + 1):
+    i = np.arange(max(1, diagonal - m), min(n, diagonal - 1) + 1)
+    j = diagonal - i
+    table[:, i, j] = np.where(
+        x[:, i - 1] == y[:, j - 1], table[:, i - 1, j - 1] + 1,
+        np.maximum(table[:, i - 1, j], table[:, i, j - 1]))
+  return table[:, n, m]
+
+
+def rouge_l_batch(eval_sentences, ref_sentences):
+  """Computes ROUGE-L of padded batches of ids, see rouge_l_sentence_level.
+
+  Args:
+    eval_sentences: int array [batch, n] of the sentences of the summarizer.
+    ref_sentences: int array [batch, m] of the reference sentences.
+
+  Returns:
+    A float: F_lcs
+  """
+  batch_size = min(len(eval_sentences), len(ref_sentences))
+  eval_sentences = np.asarray(eval_sentences)[:batch_size]
+  ref_sentences = np.asarray(ref_sentences)[:batch_size]
+  lcs = batch_len_lcs(eval_sentences, ref_sentences)
+  f1_scores = _f_lcs(lcs, ref_sentences.shape[1], eval_sentences.shape[1])
+  return np.mean(f1_scores, dtype=np.float32)
+
+
 def rouge_l_fscore(predictions, labels, **unused_kwargs):
   """ROUGE scores computation between labels and predictions.
 
@@ -147,8 +194,7 @@ def rouge_l_fscore(predictions, labels, **unused_kwargs):
   # Convert the outputs and labels to a [batch_size, input_length] tensor.
   outputs = tf.squeeze(outputs, axis=[-1, -2])
   labels = tf.squeeze(labels, axis=[-1, -2])
-  rouge_l_f_score = tf.py_func(rouge_l_sentence_level, (outputs, labels),
-                               tf.float32)
+  rouge_l_f_score = tf.py_func(rouge_l_batch, (outputs, labels), tf.float32)
   return rouge_l_f_score, tf.constant(1.0)
 
 
@@ -213,6 +259,42 @@ def rouge_n(eval_sentences, ref_sentences, n=2):
   return np.mean(f1_scores, dtype=np.float32)
 
 
+def rouge_n_batch(eval_sentences, ref_sentences, n=2):
+  """Computes ROUGE-N of padded batches of ids, see rouge_n.
+
+  Gives the same result as rouge_n on the rows of the arrays, but compares the
+  n-grams of the whole batch at once with NumPy.
+
+  Args:
+    eval_sentences: int array [batch, length] of the sentences of the
+      summarizer.
+    ref_sentences: int array [batch, length] of the reference sentences.
+    n: Size of ngram.  Defaults to 2.
+
+  Returns:
+    f1 score for ROUGE-N
+  """
+  batch_size = min(len(eval_sentences), len(ref_sentences))
+  eval_sentences = np.asarray(eval_sentences)[:batch_size]
+  ref_sentences = np.asarray(ref_sentences)[:batch_size]
+  (eval_ngrams, ref_ngrams), num_ngrams = list(
+      bleu_hook.batch_ngram_ids([eval_sentences, ref_sentences], n))[-1]
+  # The distinct n-grams of each sentence.
+  eval_keys, _ = bleu_hook.batch_row_ngram_counts(eval_ngrams, num_ngrams)
+  ref_keys, _ = bleu_hook.batch_row_ngram_counts(ref_ngrams, num_ngrams)
+  _, overlapping = bleu_hook.sorted_intersection_indices(ref_keys, eval_keys)
+  eval_count = np.bincount(eval_keys // num_ngrams, minlength=batch_size)
+  ref_count = np.bincount(ref_keys // num_ngrams, minlength=batch_size)
+  overlapping_count = np.bincount(
+      eval_keys[overlapping] // num_ngrams, minlength=batch_size)
+
+  # Handle edge case. This isn't mathematically correct, but it's good enough
+  precision = overlapping_count / np.maximum(eval_count, 1)
+  recall = overlapping_count / np.maximum(ref_count, 1)
+  f1_scores = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+  return np.mean(f1_scores, dtype=np.float32)
+
+
 def rouge_2_fscore(predictions, labels, **unused_kwargs):
   """ROUGE-2 F1 score computation between labels and predictions.
 
@@ -231,5 +313,5 @@ def rouge_2_fscore(predictions, labels, **unused_kwargs):
   # Convert the outputs and labels to a [batch_size, input_length] tensor.
   outputs = tf.squeeze(outputs, axis=[-1, -2])
   labels = tf.squeeze(labels, axis=[-1, -2])
-  rouge_2_f_score = tf.py_func(rouge_n, (outputs, labels), tf.float32)
+  rouge_2_f_score = tf.py_func(rouge_n_batch, (outputs, labels), tf.float32)
   return rouge_2_f_score, tf.constant(1.0)
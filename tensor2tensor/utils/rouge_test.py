@@ -112,5 +112,22 @@ class TestRougeMetricsE2E(tf.test.TestCase):
       session.run(a)
 
 
+class TestRougeBatch(tf.test.TestCase):
+  """Tests that the batched metrics match the per-sentence ones."""
+
+  def testRougeBatchMatchesSentenceLevel(self):
+    rng = np.random.RandomState(0)
+    for length in [1, 2, 9]:
+      hypotheses = rng.randint(0, 5, size=(6, length))
+      references = rng.randint(0, 5, size=(6, length + 3))
+      references[0, :length] = hypotheses[0]
+      self.assertAllClose(
+          rouge.rouge_n_batch(hypotheses, references),
+          rouge.rouge_n(hypotheses, references))
+      self.assertAllClose(
+          rouge.rouge_l_batch(hypotheses, references),
+          rouge.rouge_l_sentence_level(hypotheses, references))
+
+
 if __name__ == "__main__":
   tf.test.main()
@@ -22,6 +22,7 @@ import os
 import random
 import numpy as np
 
+from tensor2tensor.utils import continuous_eval as continuous_eval_lib
 from tensor2tensor.utils import decoding
 from tensor2tensor.utils import devices
 from tensor2tensor.utils import metrics_hook
@@ -279,13 +280,16 @@ class T2TExperiment(object):
   """Custom Experiment class for running distributed experiments."""
 
   def __init__(self, estimator, hparams, train_spec, eval_spec,
-               use_validation_monitor, decode_hparams=None):
+               use_validation_monitor, decode_hparams=None,
+               eval_all_checkpoints=False, eval_num_workers=1):
     self._train_spec = train_spec
     self._eval_spec = eval_spec
     self._hparams = hparams
     self._decode_hparams = decode_hparams
     self._estimator = estimator
     self._use_validation_monitor = use_validation_monitor
+    self._eval_all_checkpoints = eval_all_checkpoints
+    self._eval_num_workers = eval_num_workers
 
   @property
   def estimator(self):
@@ -333,13 +337,39 @@ class T2TExperiment(object):
 
   def continuous_eval(self):
     """Evaluate until checkpoints stop being produced."""
-    for _ in next_checkpoint(self._hparams.model_dir):
-      self.evaluate()
+    if isinstance(self._estimator, tf.contrib.tpu.TPUEstimator):
+      for _ in next_checkpoint(self._hparams.model_dir):
+        self.evaluate()
+      return
+    evaluator = self._continuous_evaluator(self._eval_spec.input_fn)
+    try:
+      evaluator.run()
+    finally:
+      evaluator.close()
 
   def continuous_eval_on_train_data(self):
     """Evaluate on train data until checkpoints stop being produced."""
-    for _ in next_checkpoint(self._hparams.model_dir):
-      self.evaluate_on_train_data()
+    if isinstance(self._estimator, tf.contrib.tpu.TPUEstimator):
+      for _ in next_checkpoint(self._hparams.model_dir):
+        self.evaluate_on_train_data()
+      return
+    evaluator = self._continuous_evaluator(
+        self._train_spec.input_fn, name="eval_train")
+    try:
+      evaluator.run()
+    finally:
+      evaluator.close()
+
+  def _continuous_evaluator(self, input_fn, name=None):
+    """ContinuousEvaluator building the eval graph once for all checkpoints."""
+    return continuous_eval_lib.ContinuousEvaluator(
+        self._estimator,
+        input_fn,
+        steps=self._eval_spec.steps,
+        hooks=self._eval_spec.hooks,
+        name=name,
+        evaluate_all_checkpoints=self._eval_all_checkpoints,
+        num_workers=self._eval_num_workers)
 
   def test(self):
     """Perform 1 step of train and 2 step of eval."""
@@ -410,7 +440,9 @@ def create_experiment(
     use_tpu=False,
     xla_compile=False,
     additional_train_hooks=None,
-    additional_eval_hooks=None):
+    additional_eval_hooks=None,
+    eval_all_checkpoints=False,
+    eval_num_workers=1):
   """Create Experiment."""
   # HParams
   hparams.add_hparam("model_dir", run_config.model_dir)
@@ -511,7 +543,9 @@ def create_experiment(
         eval_delay_secs=0 if schedule == "evaluate" else 120,
         **hooks_kwargs if not use_tpu else {})
   return T2TExperiment(estimator, hparams, train_spec, eval_spec,
-                       use_validation_monitor, decode_hparams)
+                       use_validation_monitor, decode_hparams,
+                       eval_all_checkpoints=eval_all_checkpoints,
+                       eval_num_workers=eval_num_workers)
 
 
 def create_experiment_fn(*args, **kwargs):
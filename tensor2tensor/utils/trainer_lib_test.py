@@ -18,6 +18,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 from tensor2tensor import models  # pylint: disable=unused-import
 from tensor2tensor.data_generators import algorithmic
 from tensor2tensor.data_generators import problem as problem_lib
@@ -48,6 +50,25 @@ class TrainerLibTest(tf.test.TestCase):
     exp = exp_fn(run_config, hparams)
     exp.test()
 
+  def testExperimentSyntheticData(self):
+    # The problem generates its data in the input pipeline, the data_dir is
+    # empty.
+    data_dir = os.path.join(self.get_temp_dir(), "synthetic")
+    tf.gfile.MakeDirs(data_dir)
+    exp_fn = trainer_lib.create_experiment_fn(
+        "transformer",
+        "algorithmic_reverse_binary40_synthetic",
+        data_dir,
+        train_steps=1,
+        eval_steps=1,
+        min_eval_frequency=1,
+        use_tpu=False)
+    run_config = trainer_lib.create_run_config(
+        model_dir=data_dir, num_gpus=0, use_tpu=False)
+    hparams = registry.hparams("transformer_tiny_tpu")
+    exp = exp_fn(run_config, hparams)
+    exp.test()
+
   def testModel(self):
     # HParams
     hparams = trainer_lib.create_hparams(